@@ -0,0 +1,91 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from telebot.apihelper import ApiTelegramException
+
+import config
+from metrics import cache_hit
+
+logger = logging.getLogger(__name__)
+
+ADMIN_STATUSES = {'creator', 'administrator'}
+
+
+class ChatAdmins:
+    def __init__(self, bot, ttl=None, limit=None):
+        self.bot = bot
+        self.ttl = ttl or config.CHAT_ADMINS_TTL
+        self.limit = limit or config.CHAT_ADMINS_LIMIT
+        self.lock = threading.Lock()
+        # chat_id -> (истекает, frozenset id админов)
+        self.entries = OrderedDict()
+        # chat_id -> Future загрузки; одновременные запросы ждут один getChatAdministrators
+        self.loading = {}
+
+    def cached(self, chat_id):
+        entry = self.entries.get(chat_id)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+        return None
+
+    def get(self, chat_id):
+        admins = self.cached(chat_id)
+        cache_hit('chat_admins', admins is not None)
+        if admins is not None:
+            return admins
+        with self.lock:
+            future = self.loading.get(chat_id)
+            owner = future is None
+            if owner:
+                future = Future()
+                self.loading[chat_id] = future
+        if not owner:
+            return future.result()
+        try:
+            admins = self.fetch(chat_id)
+            future.set_result(admins)
+        finally:
+            with self.lock:
+                del self.loading[chat_id]
+        return admins
+
+    def fetch(self, chat_id):
+        try:
+            members = self.bot.get_chat_administrators(chat_id)
+        except ApiTelegramException as e:
+            # Чат без доступа к списку админов: запоминаем пустой список на ttl
+            logger.warning("getChatAdministrators %s failed: %s", chat_id, e)
+            admins = frozenset()
+        except Exception as e:
+            # Сетевая ошибка: отдаем устаревший список, если он был, и не кэшируем
+            logger.warning("getChatAdministrators %s failed: %s", chat_id, e)
+            entry = self.entries.get(chat_id)
+            return entry[1] if entry else frozenset()
+        else:
+            admins = frozenset(member.user.id for member in members)
+        self.store(chat_id, admins)
+        return admins
+
+    def store(self, chat_id, admins, expires=None):
+        with self.lock:
+            self.entries[chat_id] = (expires or time.monotonic() + self.ttl, admins)
+            self.entries.move_to_end(chat_id)
+            while len(self.entries) > self.limit:
+                self.entries.popitem(last=False)
+
+    def update(self, chat_id, user_id, status):
+        # chat_member: правим кэш на месте, без повторного запроса к Telegram
+        entry = self.entries.get(chat_id)
+        if entry is None:
+            return
+        if status in ADMIN_STATUSES:
+            admins = entry[1] | {user_id}
+        else:
+            admins = entry[1] - {user_id}
+        self.store(chat_id, admins, entry[0])
+
+    def is_admin(self, chat_id, user_id):
+        return user_id in self.get(chat_id)
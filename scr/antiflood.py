@@ -0,0 +1,176 @@
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+import config
+
+
+class MutedSpamGuard:
+    def __init__(self, window=None, escalate_after=None, limit=None):
+        self.window = window or config.MUTED_WARN_WINDOW
+        self.escalate_after = escalate_after or config.MUTED_ESCALATE_AFTER
+        self.limit = limit or config.MUTED_TRACK_LIMIT
+        self.lock = threading.Lock()
+        # (chat_id, user_id) -> [начало окна, удалено сообщений, предупреждение отправлено]
+        self.entries = OrderedDict()
+
+    def hit(self, chat_id, user_id, now=None):
+        now = now or time.monotonic()
+        key = (chat_id, user_id)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or now - entry[0] > self.window:
+                entry = [now, 0, False]
+                self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.limit:
+                self.entries.popitem(last=False)
+            entry[1] += 1
+            warn = not entry[2]
+            entry[2] = True
+            escalate = entry[1] % self.escalate_after == 0
+        return warn, escalate
+
+    def forget(self, chat_id, user_id):
+        with self.lock:
+            self.entries.pop((chat_id, user_id), None)
+
+
+class RaidGuard:
+    def __init__(self, window=None, threshold=None, limit=None):
+        self.window = window or config.RAID_WINDOW
+        self.threshold = threshold or config.RAID_JOIN_THRESHOLD
+        self.limit = limit or config.RAID_TRACK_LIMIT
+        self.lock = threading.Lock()
+        # chat_id -> [кольцо из threshold последних входов, позиция]
+        self.entries = OrderedDict()
+        # chat_id -> id участников, ограниченных за время рейда
+        self.raids = {}
+
+    def joined(self, chat_id, count=1, now=None):
+        # Возвращает (чат в режиме рейда, режим включился на этом вызове)
+        now = now or time.monotonic()
+        with self.lock:
+            entry = self.entries.get(chat_id)
+            if entry is None:
+                entry = [[float('-inf')] * self.threshold, 0]
+                self.entries[chat_id] = entry
+            self.entries.move_to_end(chat_id)
+            while len(self.entries) > self.limit:
+                self.entries.popitem(last=False)
+            ring = entry[0]
+            started = False
+            for _ in range(count):
+                # В кольце threshold входов: если самый старый моложе окна — это рейд
+                oldest = ring[entry[1]]
+                ring[entry[1]] = now
+                entry[1] = (entry[1] + 1) % self.threshold
+                if now - oldest <= self.window and chat_id not in self.raids:
+                    self.raids[chat_id] = []
+                    started = True
+            return chat_id in self.raids, started
+
+    def active(self, chat_id):
+        return chat_id in self.raids
+
+    def restricted(self, chat_id, user_id):
+        with self.lock:
+            if chat_id in self.raids:
+                self.raids[chat_id].append(user_id)
+
+    def lift(self, chat_id):
+        # Возвращает ограниченных за рейд или None, если рейда не было
+        with self.lock:
+            self.entries.pop(chat_id, None)
+            return self.raids.pop(chat_id, None)
+
+
+class FloodEntry:
+    # Сотни тысяч записей: без __dict__, счетчики окна и хэши текстов в одном array
+    __slots__ = ('slot', 'cells', 'position', 'flagged')
+
+    def __init__(self, size):
+        self.slot = 0
+        # [0, slots) — сообщений в ячейке окна, [slots, slots + history) — хэши последних текстов
+        self.cells = array('i', bytes(4 * size))
+        self.position = 0
+        self.flagged = False
+
+
+class FloodGuard:
+    def __init__(self, window=None, slots=None, limit=None, duplicates=None, history=None, track_limit=None,
+                 history_window=None):
+        self.window = window or config.FLOOD_WINDOW
+        self.slots = slots or config.FLOOD_SLOTS
+        self.limit = limit or config.FLOOD_LIMIT
+        self.duplicates = duplicates or config.FLOOD_DUPLICATES
+        self.history = history or config.FLOOD_DUPLICATE_HISTORY
+        self.track_limit = track_limit or config.FLOOD_TRACK_LIMIT
+        self.slot_width = self.window / self.slots
+        # История текстов переживает окно счетчика и забывается после history_window тишины
+        self.history_window = max(history_window or config.FLOOD_DUPLICATE_WINDOW, self.window)
+        self.history_slots = int(self.history_window / self.slot_width)
+        self.empty = array('i', bytes(4 * (self.slots + self.history)))
+        self.empty_window = array('i', bytes(4 * self.slots))
+        self.lock = threading.Lock()
+        # (chat_id, user_id) -> FloodEntry, от давно молчащих к недавним
+        self.entries = OrderedDict()
+
+    def hit(self, chat_id, user_id, text=None, now=None):
+        # Возвращает (причина или None, наказывать ли сейчас): 'flood' — больше limit
+        # сообщений за окно, 'duplicate' — текст повторился duplicates раз среди последних history
+        now = now or time.monotonic()
+        slot = int(now / self.slot_width)
+        slots = self.slots
+        key = (chat_id, user_id)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = self.entries[key] = FloodEntry(slots + self.history)
+            else:
+                self.entries.move_to_end(key)
+            cells = entry.cells
+            if slot - entry.slot >= self.history_slots:
+                # Молчал дольше history_window: начинаем заново, вместе с историей текстов
+                cells[:] = self.empty
+                entry.flagged = False
+            elif slot - entry.slot >= slots:
+                # Окно целиком прошло: счетчик с нуля, последние тексты остаются
+                cells[:slots] = self.empty_window
+                entry.flagged = False
+            else:
+                # Ячейки, через которые окно проехало с прошлого сообщения, обнуляются
+                for passed in range(entry.slot + 1, slot + 1):
+                    cells[passed % slots] = 0
+            entry.slot = slot
+            self.expire(slot)
+            cells[slot % slots] += 1
+            reason = None
+            if sum(cells[:slots]) > self.limit:
+                reason = 'flood'
+            elif text:
+                # Нулевой хэш — пустая ячейка истории
+                digest = (hash(text) & 0x7fffffff) or 1
+                if cells[slots:].count(digest) + 1 >= self.duplicates:
+                    reason = 'duplicate'
+                cells[slots + entry.position] = digest
+                entry.position = (entry.position + 1) % self.history
+            if reason is None:
+                return None, False
+            first = not entry.flagged
+            entry.flagged = True
+            return reason, first
+
+    def expire(self, slot):
+        # Вызывается под self.lock; в начале словаря те, кто дольше всех молчит
+        entries = self.entries
+        while entries:
+            key, oldest = next(iter(entries.items()))
+            if slot - oldest.slot < self.history_slots and len(entries) <= self.track_limit:
+                break
+            del entries[key]
+
+    def forget(self, chat_id, user_id):
+        with self.lock:
+            self.entries.pop((chat_id, user_id), None)
@@ -0,0 +1,66 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from telebot.async_telebot import AsyncTeleBot
+from telebot import util
+from telebot.asyncio_handler_backends import BaseMiddleware
+import config
+
+# Обработчики те же, что в bot.py: они синхронные и работают с базой, Telegram и очередью,
+# поэтому event loop только принимает апдейты, а каждый обработчик выполняется в пуле потоков
+HANDLERS = ('message', 'callback_query', 'chat_member')
+
+
+class UserSightings(BaseMiddleware):
+    # Справочник пользователей пишет в буфер в памяти, в пул его не уносим
+    def __init__(self, logic):
+        self.update_types = ['message']
+        self.logic = logic
+
+    async def pre_process(self, message, data):
+        self.logic.see_message(message)
+
+    async def post_process(self, message, data, exception):
+        pass
+
+
+def in_executor(executor, function):
+    @functools.wraps(function)
+    async def handler(update):
+        await asyncio.get_running_loop().run_in_executor(executor, function, update)
+
+    return handler
+
+
+def build(sync_bot, logic, executor):
+    # Регистрирует обработчики sync_bot на AsyncTeleBot с теми же фильтрами и в том же порядке
+    bot = AsyncTeleBot(config.TOKEN)
+    bot.setup_middleware(UserSightings(logic))
+    for kind in HANDLERS:
+        register = getattr(bot, f'register_{kind}_handler')
+        for handler in getattr(sync_bot, f'{kind}_handlers'):
+            register(in_executor(executor, handler['function']), **handler['filters'])
+    return bot
+
+
+async def main(bot):
+    try:
+        await bot.infinity_polling(allowed_updates=util.update_types)
+    finally:
+        await bot.close_session()
+
+
+def run(sync_bot, logic):
+    # Расписание, очередь и логику запускает и останавливает bot.py
+    executor = ThreadPoolExecutor(max_workers=config.ASYNC_WORKERS, thread_name_prefix='handler')
+    try:
+        asyncio.run(main(build(sync_bot, logic, executor)))
+    finally:
+        executor.shutdown()
+
+
+if __name__ == '__main__':
+    # То же, что python bot.py с RUNTIME = 'async'
+    config.RUNTIME = 'async'
+    import runpy
+    runpy.run_module('bot', run_name='__main__')
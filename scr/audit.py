@@ -0,0 +1,95 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+import config
+
+# Действия в журнале и как они называются в /audit
+ACTIONS = {
+    'warn': 'варн',
+    'unwarn': 'минус варн',
+    'reset_warns': 'сброс варнов',
+    'mute': 'мут',
+    'unmute': 'размут',
+    'ban': 'бан',
+    'unban': 'разбан',
+    'report': 'репорт',
+    'resolve': 'решение',
+}
+
+
+class AuditJournal:
+    def __init__(self, storage, interval=None, max_pending=None, retention=None, compact_interval=None, compact_batch=None):
+        self.storage = storage
+        self.interval = interval or config.AUDIT_FLUSH_INTERVAL
+        self.max_pending = max_pending or config.AUDIT_FLUSH_MAX
+        self.retention = retention or config.AUDIT_RETENTION
+        self.compact_interval = compact_interval or config.AUDIT_COMPACT_INTERVAL
+        self.compact_batch = compact_batch or config.AUDIT_COMPACT_BATCH
+        # Хранилищу без пакетной записи буфер не нужен, пишем сразу
+        self.batching = storage.batching
+        self.lock = threading.Lock()
+        # (время, chat_id, кто, кого, действие, срок в секундах, подробности) — в порядке записи
+        self.pending = []
+        # flush зовут и фоновый поток, и обработчики: пачки уходят в базу по очереди
+        self.flushing = threading.Lock()
+        # Первая очистка — в первом проходе фонового потока
+        self.compacted = None
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.running = False
+
+    def record(self, action, chat_id, actor_id, target_id, duration=None, details=None):
+        # actor_id None — действие самого бота: фильтр, антифлуд, истекший срок
+        row = (datetime.now().isoformat(timespec='seconds'), chat_id, actor_id, target_id, action, duration, details)
+        with self.lock:
+            self.pending.append(row)
+            full = len(self.pending) >= self.max_pending
+            if self.thread is None:
+                self.start()
+        if not self.batching:
+            self.flush()
+        elif full:
+            self.wakeup.set()
+
+    def start(self):
+        # Вызывается под self.lock при первой записи
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='audit-journal', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while self.running:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            self.flush()
+            # Очистка только здесь, обработчик с /audit ее не ждет
+            if self.compacted is None or time.monotonic() - self.compacted >= self.compact_interval:
+                self.compact()
+
+    def flush(self):
+        with self.flushing:
+            with self.lock:
+                pending, self.pending = self.pending, []
+            if pending:
+                self.storage.append_audit(pending)
+
+    def compact(self):
+        # Старые записи удаляются порциями, чтобы не держать запись в базу надолго
+        self.compacted = time.monotonic()
+        before = (datetime.now() - timedelta(seconds=self.retention)).isoformat(timespec='seconds')
+        total = 0
+        while True:
+            deleted = self.storage.compact_audit(before, self.compact_batch)
+            total += deleted
+            if deleted < self.compact_batch:
+                return total
+
+    def stop(self):
+        with self.lock:
+            thread, self.thread = self.thread, None
+            self.running = False
+        if thread:
+            self.wakeup.set()
+            thread.join()
+        self.flush()
@@ -0,0 +1,841 @@
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import config
+from logic import BotLogic
+from content_filter import Automaton, ContentFilter, KINDS, ACTIONS
+from antiflood import FloodGuard
+import audit
+import transfer
+from storage import MemoryStorage, SQLiteStorage
+from audit import AuditJournal
+
+
+def bench_writes(group_commit, threads, ops):
+    with tempfile.TemporaryDirectory() as tmp:
+        logic = BotLogic(os.path.join(tmp, 'bench.db'), group_commit=group_commit)
+
+        def worker(n):
+            for i in range(ops):
+                user_id = n * ops + i
+                logic.add_user(user_id, -100, f"user{user_id}", "Bench")
+                logic.add_warn(user_id, -100)
+
+        workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+        start = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        logic.durable().result()
+        elapsed = time.perf_counter() - start
+        logic.close()
+    return threads * ops * 2 / elapsed
+
+
+def cmd_commit(args):
+    per_call = bench_writes(False, args.threads, args.ops)
+    grouped = bench_writes(True, args.threads, args.ops)
+    print(f"per-call commit: {per_call:10.0f} writes/sec")
+    print(f"group commit:    {grouped:10.0f} writes/sec  (x{grouped / per_call:.1f})")
+
+
+def handler_mix(logic, rnd):
+    # Те же вызовы BotLogic, что делают обработчики bot.py
+    user_id = rnd.randrange(500)
+    chat_id = -rnd.randrange(1, 20)
+    action = rnd.random()
+    if action < 0.6:
+        logic.is_muted(user_id, chat_id)
+    elif action < 0.75:
+        if not logic.get_user(user_id, chat_id):
+            logic.add_user(user_id, chat_id, f"user{user_id}", "Stress")
+    elif action < 0.85:
+        logic.add_warn(user_id, chat_id)
+    elif action < 0.9:
+        logic.mute_user(user_id, chat_id, 60)
+    elif action < 0.95:
+        logic.add_report(chat_id, user_id, rnd.randrange(500), "stress")
+    else:
+        logic.get_pending_reports(chat_id)
+
+
+def cmd_stress(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        logic = BotLogic(os.path.join(tmp, 'stress.db'), group_commit=args.group_commit)
+        errors = []
+
+        def worker(seed):
+            rnd = random.Random(seed)
+            for _ in range(args.calls):
+                try:
+                    handler_mix(logic, rnd)
+                except Exception as e:
+                    errors.append(e)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.threads) as pool:
+            list(pool.map(worker, range(args.threads)))
+        logic.durable().result()
+        elapsed = time.perf_counter() - start
+        logic.close()
+
+    total = args.threads * args.calls
+    print(f"{total} calls in {elapsed:.2f}s ({total / elapsed:.0f} calls/sec), errors: {len(errors)}")
+    for e in errors[:5]:
+        print(f"  {type(e).__name__}: {e}")
+    if errors:
+        raise SystemExit(1)
+
+
+def cmd_outbound(args):
+    import telebot
+    from telebot import apihelper
+    from fake_api import FakeBotAPI
+    from outbound import OutboundDispatcher
+
+    api = FakeBotAPI(flood_every=args.flood_every, retry_after=1).start()
+    apihelper.API_URL = api.url
+    dispatcher = OutboundDispatcher(telebot.TeleBot('1:bench'))
+    dispatcher.start()
+
+    chats = range(1, args.chats + 1)
+    start = time.perf_counter()
+    futures = [
+        dispatcher.send_message(chat_id, f"{chat_id}:{n}")
+        for n in range(args.messages) for chat_id in chats
+    ]
+    futures += [dispatcher.delete_message(chat_id, 1) for chat_id in chats]
+    enqueued = time.perf_counter() - start
+    failed = 0
+    for future in futures:
+        try:
+            future.result(timeout=300)
+        except Exception:
+            failed += 1
+    elapsed = time.perf_counter() - start
+    dispatcher.stop()
+    api.stop()
+
+    problems = []
+    sent = {}
+    for at, method, params, status in api.calls:
+        if method == 'sendMessage' and status == 200:
+            chat_id, n = map(int, params['text'].split(':'))
+            sent.setdefault(chat_id, []).append((at, n))
+    limit = config.OUTBOUND_CHAT_BURST + config.OUTBOUND_CHAT_RATE
+    for chat_id, messages in sent.items():
+        if [n for _, n in messages] != sorted(n for _, n in messages):
+            problems.append(f"chat {chat_id}: порядок нарушен")
+        times = [at for at, _ in messages]
+        for i, at in enumerate(times):
+            in_window = sum(1 for other in times[i:] if other - at < 1)
+            if in_window > limit:
+                problems.append(f"chat {chat_id}: {in_window} сообщений за секунду")
+                break
+    calls = [method for _, method, _, status in api.calls if status == 200]
+    last_delete = max(i for i, method in enumerate(calls) if method == 'deleteMessage')
+    # Удаление поставлено после всех сообщений, но MODERATION не ждет очереди REPLY: в чате,
+    # где сообщений больше, чем пропускает лимит, оно уходит раньше последнего из них
+    if args.messages > limit:
+        order = {}
+        for _, method, params, status in api.calls:
+            if status == 200 and method in ('sendMessage', 'deleteMessage'):
+                order.setdefault(int(params['chat_id']), []).append(method)
+        late = [chat_id for chat_id, methods in order.items() if methods[-1] == 'deleteMessage']
+        if late:
+            problems.append(f"удаление не обогнало ответы в чатах {late[:5]}")
+    if failed:
+        problems.append(f"{failed} задач завершились ошибкой")
+
+    print(f"{len(futures)} calls, enqueue {enqueued * 1000:.1f} ms, delivered in {elapsed:.2f}s")
+    print(f"429 responses: {api.floods}, last moderation call at position {last_delete + 1}/{len(calls)}")
+    for problem in problems:
+        print(f"  FAIL {problem}")
+    if problems:
+        raise SystemExit(1)
+
+
+def cmd_replay(args):
+    import replay
+
+    results, handlers = replay.run_replay(args.scenario, args.seed, args.repeat, args.storage)
+    print(f"{'scenario':<12} {'updates':>8} {'upd/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'sql ms/upd':>11} {'api/upd':>8}")
+    for scenario, m in results.items():
+        print(
+            f"{scenario:<12} {m['updates']:>8} {m['updates_per_sec']:>9.0f} {m['p50_ms']:>8.3f} "
+            f"{m['p99_ms']:>8.3f} {m['sqlite_ms_per_update']:>11.3f} {m['api_calls_per_update']:>8.2f}"
+        )
+    print()
+    for name, m in sorted(handlers.items()):
+        print(f"  {name:<24} {m['calls']:>7} calls  p50 {m['p50_ms']:.3f} ms  p99 {m['p99_ms']:.3f} ms")
+
+    if args.save:
+        replay.save_baseline(args.save, results)
+    if args.baseline:
+        regressions = replay.compare(results, replay.load_baseline(args.baseline), args.tolerance)
+        for regression in regressions:
+            print(f"  REGRESSION {regression}")
+        if regressions:
+            raise SystemExit(1)
+
+
+def ingest(harness, updates, deliver):
+    # Считаем обработанные апдейты и порядок message_id внутри каждого чата
+    bot = harness.bot.bot
+    process = bot.process_new_updates
+    lock = threading.Lock()
+    seen = {}
+
+    def recording(batch):
+        process(batch)
+        with lock:
+            for update in batch:
+                seen.setdefault(update.message.chat.id, []).append(update.message.message_id)
+
+    bot.process_new_updates = recording
+    start = time.perf_counter()
+    try:
+        deliver()
+        while sum(map(len, seen.values())) < len(updates):
+            time.sleep(0.001)
+        elapsed = time.perf_counter() - start
+    finally:
+        del bot.process_new_updates
+    harness.bot.outbound.drain(60)
+    unordered = [chat_id for chat_id, ids in seen.items() if ids != sorted(ids)]
+    return elapsed, unordered
+
+
+def post_updates(address, updates):
+    import http.client
+    import json
+
+    connection = http.client.HTTPConnection(*address)
+    for update in updates:
+        connection.request('POST', '/hook', json.dumps(update), {'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        response.read()
+        if response.status != 200:
+            raise RuntimeError(f"webhook answered {response.status}")
+    connection.close()
+
+
+def cmd_webhook(args):
+    import replay
+    import webhook
+
+    with tempfile.TemporaryDirectory() as tmp:
+        harness = replay.ReplayHarness(tmp, args.seed)
+        harness.api.latency = args.latency
+        bot = harness.bot.bot
+        results = {}
+        try:
+            updates = getattr(harness.generator, args.scenario)()
+            polling = threading.Thread(
+                target=bot.polling,
+                kwargs={'non_stop': True, 'interval': 0, 'timeout': 1, 'long_polling_timeout': 1},
+                daemon=True
+            )
+
+            def deliver_polling():
+                harness.api.updates = list(updates)
+                polling.start()
+
+            results['polling'] = ingest(harness, updates, deliver_polling)
+            bot.stop_polling()
+            polling.join()
+
+            updates = getattr(harness.generator, args.scenario)()
+            pipeline = webhook.UpdatePipeline(bot, args.workers, args.queue_size).start()
+            server = webhook.WebhookServer(pipeline, host='127.0.0.1', port=0, path='/hook', secret='')
+
+            chats = {}
+            for update in updates:
+                chats.setdefault(update['message']['chat']['id'], []).append(update)
+
+            address = server.server.server_address[:2]
+
+            def deliver_webhook():
+                # Как Telegram: апдейты одного чата по очереди, чаты параллельно, до --connections соединений.
+                # Клиент в отдельных процессах, чтобы не делить GIL с воркерами бота
+                with ProcessPoolExecutor(min(args.connections, len(chats))) as pool:
+                    list(pool.map(post_updates, [address] * len(chats), chats.values()))
+
+            server.start()
+            try:
+                results['webhook'] = ingest(harness, updates, deliver_webhook)
+            finally:
+                server.stop()
+                pipeline.stop()
+        finally:
+            harness.close()
+
+    problems = []
+    for mode, (elapsed, unordered) in results.items():
+        print(f"{mode:<8} {len(updates)} updates in {elapsed:.2f}s, {len(updates) / elapsed:.0f} upd/s")
+        if unordered:
+            problems.append(f"{mode}: out of order in chats {unordered[:5]}")
+    print(f"speedup x{results['polling'][0] / results['webhook'][0]:.1f}")
+    for problem in problems:
+        print(f"  FAIL {problem}")
+    if problems:
+        raise SystemExit(1)
+
+
+def cmd_shards(args):
+    import telebot
+    import replay
+    import sharding
+    from fake_api import FakeBotAPI
+    from outbound import OutboundDispatcher
+
+    # Личку админов отправляет фронт, ему нужны те же ADMIN_IDS, что и шардам
+    config.ADMIN_IDS = [replay.ADMIN_ID]
+    config.OUTBOUND_CHAT_RATE = 1e6
+    api = FakeBotAPI().start()
+    telebot.apihelper.API_URL = api.url
+    front = OutboundDispatcher(telebot.TeleBot('1:replay'))
+    front.start()
+    timings = {}
+    dms = {}
+    try:
+        for shards in args.shards:
+            with tempfile.TemporaryDirectory() as tmp:
+                settings = {
+                    'TOKEN': '1:replay',
+                    'ADMIN_IDS': [replay.ADMIN_ID],
+                    'DB_PATH': os.path.join(tmp, 'shards.db'),
+                    'API_URL': api.url,
+                    'OUTBOUND_GLOBAL_RATE': 1e6,
+                    'OUTBOUND_CHAT_RATE': 1e6,
+                    'OUTBOUND_GROUP_RATE': 1e6,
+                }
+                generator = replay.UpdateGenerator(args.seed)
+                updates = []
+                for scenario in args.scenario or ['chatty', 'admin_burst']:
+                    updates += getattr(generator, scenario)()
+                # Репорты из чатов разных шардов должны прийти админам одной сводкой
+                for n in range(4):
+                    updates += generator.admin_burst(chat_id=-4100 - n, users=5, commands=20)
+                manager = sharding.ShardManager(shards, args.queue_size, settings).start(notify=front.notify_admins)
+                api.reset()
+                start = time.perf_counter()
+                for update in updates:
+                    manager.put(update)
+                manager.stop()
+                timings[shards] = time.perf_counter() - start
+                front.drain(60)
+                admin_dms = dms[shards] = sum(1 for call in api.calls if str(call[2].get('chat_id')) == str(replay.ADMIN_ID))
+                print(
+                    f"{shards} shards: {len(updates)} updates in {timings[shards]:.2f}s, "
+                    f"{len(updates) / timings[shards]:.0f} upd/s, x{timings[args.shards[0]] / timings[shards]:.2f}, "
+                    f"admin DMs {admin_dms}"
+                )
+    finally:
+        front.stop()
+        api.stop()
+    print(f"cpu cores: {os.cpu_count()}")
+    if len(set(dms.values())) > 1:
+        print(f"  FAIL admin DMs depend on the number of shards: {dms}")
+        raise SystemExit(1)
+
+
+def filter_rules(rnd, count):
+    letters = 'abcdefghijklmnop'
+    rules = set()
+    while len(rules) < count:
+        kind = rnd.choice(KINDS)
+        word = ''.join(rnd.choice(letters) for _ in range(rnd.randint(4, 9)))
+        pattern = {'word': word, 'link': f"{word}.com", 'invite': f"t.me/+{word}"}[kind]
+        rules.add((kind, pattern, rnd.choice(list(ACTIONS))))
+        if kind == 'word' and rnd.random() < 0.1:
+            # Ссылка без домена совпадает со словом: оба правила живут в одном узле бора
+            rules.add(('link', pattern, rnd.choice(list(ACTIONS))))
+    return sorted(rules)[:count]
+
+
+def filter_messages(rnd, rules, count):
+    # Короткий алфавит дает много частичных совпадений, часть сообщений несет настоящий шаблон
+    letters = 'abcdefghijklmnop '
+    messages = []
+    for _ in range(count):
+        text = ''.join(rnd.choice(letters) for _ in range(rnd.randint(40, 200)))
+        if rnd.random() < 0.2:
+            position = rnd.randrange(len(text))
+            text = f"{text[:position]} {rnd.choice(rules)[1]} {text[position:]}"
+        messages.append(text)
+    return messages
+
+
+def naive_search(rules, text):
+    found = set()
+    for kind, pattern, action in rules:
+        start = text.find(pattern)
+        while start != -1:
+            found.add((start + len(pattern) - 1, (kind, pattern, action)))
+            start = text.find(pattern, start + 1)
+    return found
+
+
+def build_automaton(rules):
+    automaton = Automaton()
+    with automaton.lock:
+        for rule in rules:
+            automaton.add(*rule)
+        automaton.relink()
+    return automaton
+
+
+def cmd_filter(args):
+    rnd = random.Random(args.seed)
+    rules = filter_rules(rnd, args.patterns)
+    messages = filter_messages(rnd, rules, args.messages)
+
+    start = time.perf_counter()
+    automaton = build_automaton(rules)
+    build = time.perf_counter() - start
+    print(f"patterns: {len(rules)}, trie nodes: {len(automaton.goto)}, build {build * 1000:.1f} ms")
+
+    # Сверка с наивным поиском на части сообщений
+    mismatches = sum(
+        1 for text in messages[:args.verify]
+        if set(automaton.search(text)) != naive_search(rules, text)
+    )
+    print(f"verified against naive search: {min(args.verify, len(messages))} messages, mismatches: {mismatches}")
+
+    # Цена на сообщение не должна расти с числом шаблонов
+    print(f"{'patterns':>9} {'msg/s':>10} {'us/msg':>8} {'naive msg/s':>12}")
+    for count in sorted({10, 100, 1000, len(rules)}):
+        subset = rules[:count]
+        small = build_automaton(subset)
+        start = time.perf_counter()
+        for text in messages:
+            small.search(text)
+        elapsed = time.perf_counter() - start
+        sample = messages[:max(1, len(messages) // 20)]
+        start = time.perf_counter()
+        for text in sample:
+            naive_search(subset, text)
+        naive = len(sample) / (time.perf_counter() - start)
+        print(f"{count:>9} {len(messages) / elapsed:>10.0f} {elapsed / len(messages) * 1e6:>8.1f} {naive:>12.0f}")
+
+    # Добавление правила в готовый автомат против сборки с нуля
+    extra = [rule for rule in filter_rules(random.Random(args.seed + 1), args.adds + len(rules)) if rule not in rules][:args.adds]
+    start = time.perf_counter()
+    for rule in extra:
+        with automaton.lock:
+            automaton.add(*rule)
+        automaton.search('x')
+    incremental = (time.perf_counter() - start) / len(extra)
+    start = time.perf_counter()
+    build_automaton(rules + extra)
+    rebuild = time.perf_counter() - start
+    print(f"add one rule + first search: {incremental * 1000:.1f} ms, full rebuild: {rebuild * 1000:.1f} ms")
+
+    # Весь путь обработчика: кэш автомата на чат, границы слов, выбор самого строгого действия
+    content = ContentFilter(types.SimpleNamespace(storage=MemoryStorage()))
+    for rule in rules:
+        content.logic.storage.add_filter(-1, *rule)
+    content.match(-1, 'warmup')
+    start = time.perf_counter()
+    matched = sum(1 for text in messages if content.match(-1, text))
+    elapsed = time.perf_counter() - start
+    print(f"ContentFilter.match: {len(messages) / elapsed:.0f} msg/s, matched {matched}/{len(messages)}")
+    if mismatches:
+        raise SystemExit(1)
+
+
+def cmd_flood(args):
+    # Время задаем сами: за прогон проходят минуты переписки, окна успевают истечь
+    guard = FloodGuard(track_limit=args.limit)
+    rnd = random.Random(args.seed)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for user_id in range(args.users):
+        guard.hit(-1, user_id, f"text {user_id}", now=1000.0)
+    per_entry = (tracemalloc.get_traced_memory()[0] - before) / len(guard.entries)
+    tracemalloc.stop()
+    print(f"entries: {len(guard.entries)}, {per_entry:.0f} bytes per (chat, user), {per_entry * len(guard.entries) / 2 ** 20:.1f} MiB")
+
+    now = 1000.0
+    flagged = 0
+    start = time.perf_counter()
+    for n in range(args.messages):
+        now += args.interval
+        user_id = rnd.randrange(args.users)
+        # Каждый сотый пишет пачкой, как флудер
+        burst = args.burst if user_id % 100 == 0 else 1
+        for _ in range(burst):
+            reason, first = guard.hit(-1 - user_id % 50, user_id, f"msg {n}", now=now)
+            flagged += first
+    elapsed = time.perf_counter() - start
+    print(f"hits: {args.messages} messages in {elapsed:.2f} s, {args.messages / elapsed:.0f} msg/s, flood episodes: {flagged}")
+    print(f"entries after {now - 1000:.0f} s of traffic: {len(guard.entries)} (limit {guard.track_limit})")
+    guard.hit(-1, -1, now=now + guard.history_window * 2)
+    print(f"after {guard.history_window * 2:.0f} s of silence: {len(guard.entries)} entries")
+
+    # Повторы, разнесенные дальше окна счетчика, все равно ловятся по истории текстов
+    guard = FloodGuard()
+    reasons = [guard.hit(-1, 1, "buy now", now=1000.0 + n * (guard.window + 1))[0] for n in range(guard.duplicates)]
+    if reasons[-1] != 'duplicate':
+        print(f"  FAIL duplicates across windows: {reasons}")
+        raise SystemExit(1)
+
+
+def audit_rows(rnd, count, chats, users, days):
+    # Записи равномерно за days дней, в порядке времени, как их пишет бот
+    start = datetime.now() - timedelta(days=days)
+    step = days * 86400 / count
+    actions = list(audit.ACTIONS)
+    return [
+        ((start + timedelta(seconds=n * step)).isoformat(timespec='seconds'), -1 - rnd.randrange(chats),
+         10, rnd.randrange(users), rnd.choice(actions), rnd.choice([None, 600, 3600]), None)
+        for n in range(count)
+    ]
+
+
+def cmd_audit(args):
+    rnd = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = SQLiteStorage(os.path.join(tmp, 'audit.db'), group_commit=False)
+        rows = audit_rows(rnd, args.writes, args.chats, args.users, 1)
+        start = time.perf_counter()
+        for row in rows:
+            storage.append_audit([row])
+        single = len(rows) / (time.perf_counter() - start)
+        journal = AuditJournal(storage)
+        start = time.perf_counter()
+        for at, chat_id, actor_id, target_id, action, duration, details in rows:
+            journal.record(action, chat_id, actor_id, target_id, duration, details)
+        journal.stop()
+        batched = len(rows) / (time.perf_counter() - start)
+        print(f"insert per entry: {single:10.0f} entries/s")
+        print(f"AuditJournal:     {batched:10.0f} entries/s  (x{batched / single:.1f})")
+
+        storage.append_audit(audit_rows(rnd, args.entries, args.chats, args.users, args.days))
+        since = (datetime.now() - timedelta(days=7)).isoformat(timespec='seconds')
+        start = time.perf_counter()
+        for _ in range(args.queries):
+            storage.get_audit(-1 - rnd.randrange(args.chats), since, limit=config.AUDIT_LIST_LIMIT)
+        by_chat = (time.perf_counter() - start) * 1000 / args.queries
+        start = time.perf_counter()
+        for _ in range(args.queries):
+            storage.get_audit(-1 - rnd.randrange(args.chats), target_id=rnd.randrange(args.users), limit=config.AUDIT_LIST_LIMIT)
+        by_user = (time.perf_counter() - start) * 1000 / args.queries
+        print(f"{args.entries} entries over {args.days} days: /audit 7d {by_chat:.3f} ms, /audit user {by_user:.3f} ms")
+
+        journal = AuditJournal(storage, retention=args.retention * 86400)
+        start = time.perf_counter()
+        deleted = journal.compact()
+        elapsed = time.perf_counter() - start
+        with storage.read() as cursor:
+            left = cursor.execute("SELECT COUNT(*) FROM audit").fetchone()[0]
+        print(f"compaction to {args.retention} days: {deleted} deleted in {elapsed:.2f} s "
+              f"({journal.compact_batch} per batch), {left} left")
+        storage.close()
+
+
+def transfer_users(rnd, count, chunk=10000):
+    for start in range(0, count, chunk):
+        yield [
+            (n, -1 - n % 1000, f"user{n}", f"Имя {n}", rnd.randrange(3), 0, None, 0, None,
+             f"2024-01-{1 + n % 28:02d}T12:00:00", rnd.randrange(1000), None)
+            for n in range(start, min(start + chunk, count))
+        ]
+
+
+def transfer_pass(label, operation):
+    start = time.perf_counter()
+    count = operation()
+    elapsed = time.perf_counter() - start
+    # Второй проход под tracemalloc: пик памяти не должен зависеть от числа строк
+    tracemalloc.start()
+    operation()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"{label:<12} {count:>9} rows  {count / elapsed:>9.0f} rows/s  peak {peak / 2 ** 20:.1f} MiB")
+    return count
+
+
+def cmd_transfer(args):
+    rnd = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        source = transfer.open_target(os.path.join(tmp, 'source.db'))
+        for batch in transfer_users(rnd, args.rows):
+            with source:
+                source.executemany(f"INSERT INTO users VALUES ({', '.join('?' * 12)})", batch)
+        source.close()
+        source = transfer.open_source(os.path.join(tmp, 'source.db'))
+        checksum = "SELECT COUNT(*), SUM(user_id * 31 + warns), SUM(message_count), MAX(last_seen) FROM users"
+        expected = source.execute(checksum).fetchone()
+        for fmt in transfer.FORMATS:
+            path = os.path.join(tmp, f"users.{fmt}")
+
+            def export():
+                columns, cursor = transfer.select_rows(source, 'users')
+                with open(path, 'w', encoding='utf-8', newline='') as out:
+                    return transfer.write_rows(out, fmt, columns, transfer.fetch(cursor))
+
+            transfer_pass(f"export {fmt}", export)
+            target = transfer.open_target(os.path.join(tmp, f"target_{fmt}.db"))
+
+            def load():
+                with open(path, encoding='utf-8', newline='') as source_file:
+                    columns, rows = transfer.read_rows(source_file, fmt)
+                    return transfer.import_rows(target, 'users', columns, rows, args.chunk)
+
+            transfer_pass(f"import {fmt}", load)
+            got = target.execute(checksum).fetchone()
+            target.close()
+            print(f"{'':<12} {os.path.getsize(path) / 2 ** 20:.0f} MiB file, round trip {'ok' if got == expected else f'FAIL {got} != {expected}'}")
+            if got != expected:
+                raise SystemExit(1)
+        source.close()
+
+
+def cmd_bulk(args):
+    import telebot
+    from telebot import apihelper
+    from fake_api import FakeBotAPI
+    from outbound import OutboundDispatcher
+    import bulk
+
+    user_ids = list(range(1000, 1000 + args.users))
+    with tempfile.TemporaryDirectory() as tmp:
+        logic = BotLogic(os.path.join(tmp, 'bulk.db'))
+        for chat_id in (-1, -2):
+            for user_id in user_ids:
+                logic.add_user(user_id, chat_id, f"user{user_id}", "Bulk")
+        start = time.perf_counter()
+        for user_id in user_ids:
+            logic.mute_user(user_id, -1, 3600)
+        single = time.perf_counter() - start
+        start = time.perf_counter()
+        logic.mute_users(user_ids, -2, 3600)
+        batched = time.perf_counter() - start
+        logic.close()
+    print(f"DB, {args.users} mutes: one by one {single * 1000:.1f} ms, "
+          f"one transaction {batched * 1000:.1f} ms (x{single / batched:.1f})")
+
+    # Telegram отвечает с задержкой, часть пользователей уже вышла из чата и дает 400
+    api = FakeBotAPI(latency=args.latency).start()
+    api.missing_users = set(user_ids[::args.missing_every])
+    apihelper.API_URL = api.url
+    dispatcher = OutboundDispatcher(telebot.TeleBot('1:bench'))
+    dispatcher.start()
+    problems = []
+    message = types.SimpleNamespace(chat=types.SimpleNamespace(id=-1), message_id=1)
+    calls = [(user_id, 'ban_chat_member', {}) for user_id in user_ids]
+    for concurrency in (1, args.concurrency):
+        job = bulk.BulkJob(dispatcher, message, "Бан", calls, concurrency)
+        start = time.perf_counter()
+        job.start().thread.join()
+        elapsed = time.perf_counter() - start
+        print(f"API, concurrency {concurrency}: {elapsed:.2f} s ({len(calls) / elapsed:.0f} calls/s), "
+              f"failed {len(job.failed)}/{len(calls)}")
+        if sorted(user_id for user_id, _ in job.failed) != sorted(api.missing_users):
+            problems.append(f"concurrency {concurrency}: ошибки не совпадают с вышедшими пользователями")
+    dispatcher.stop()
+    api.stop()
+    for problem in problems:
+        print(f"  FAIL {problem}")
+    if problems:
+        raise SystemExit(1)
+
+
+def cmd_chatstats(args):
+    from chatstats import FIELDS
+
+    rnd = random.Random(args.seed)
+    chat_id = -1
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = SQLiteStorage(os.path.join(tmp, 'chatstats.db'), group_commit=False)
+        today = datetime.now().isoformat(timespec='seconds')
+        with storage.write() as cursor:
+            cursor.executemany(
+                "INSERT INTO users (user_id, chat_id, is_muted, mute_until, is_banned) VALUES (?, ?, ?, ?, ?)",
+                ((n, chat_id, int(n % 100 == 1), '2100-01-01T00:00:00' if n % 100 == 1 else None, int(n % 100 == 2))
+                 for n in range(args.users))
+            )
+            cursor.executemany(
+                "INSERT INTO reports (chat_id, reporter_id, reported_id, reason) VALUES (?, ?, ?, ?)",
+                ((chat_id, n, n + 1, 'bench') for n in range(args.users // 100))
+            )
+        storage.append_audit([(today, chat_id, 10, n, 'warn', None, None) for n in range(args.users // 200)])
+        logic = BotLogic(storage=storage)
+
+        start = time.perf_counter()
+        logic.counters.get(chat_id)
+        logic.counters.reconcile()
+        reconcile = time.perf_counter() - start
+        day = datetime.now().date().isoformat()
+        start = time.perf_counter()
+        for _ in range(args.queries):
+            storage.count_chat(chat_id, day)
+        counted = (time.perf_counter() - start) / args.queries
+        start = time.perf_counter()
+        for _ in range(args.queries):
+            logic.get_chat_stats(chat_id)
+        cached = (time.perf_counter() - start) / args.queries
+        print(f"{args.users} users: COUNT(*) {counted * 1000:.3f} ms, counters {cached * 1000:.4f} ms "
+              f"(x{counted / cached:.0f}), reconcile {reconcile * 1000:.1f} ms")
+
+        # Случайные мутаторы BotLogic, затем счетчики сверяются с таблицами
+        reports = [row[0] for row in storage.get_pending_reports(chat_id)]
+        for _ in range(args.changes):
+            user_id = rnd.randrange(args.users)
+            action = rnd.randrange(9)
+            if action == 0:
+                logic.add_warn(user_id, chat_id)
+            elif action == 1:
+                logic.mute_user(user_id, chat_id, 3600)
+            elif action == 2:
+                logic.unmute_user(user_id, chat_id)
+            elif action == 3:
+                logic.ban_user(user_id, chat_id)
+            elif action == 4:
+                logic.unban_user(user_id, chat_id)
+            elif action == 5:
+                reports.append(logic.add_report(chat_id, user_id, rnd.randrange(args.users), 'bench'))
+            elif action == 6:
+                # Новые участники и повторы уже добавленных
+                logic.add_user(args.users + rnd.randrange(args.changes), chat_id, None, None)
+            elif action == 7:
+                # Массовые команды по смеси старых и новых id
+                user_ids = list({rnd.randrange(args.users + args.changes) for _ in range(5)})
+                bulk = rnd.randrange(3)
+                if bulk == 0:
+                    logic.warn_users(user_ids, chat_id)
+                elif bulk == 1:
+                    logic.mute_users(user_ids, chat_id, 3600)
+                else:
+                    logic.ban_users(user_ids, chat_id, 3600)
+            elif reports:
+                # Из лички суперадмин решает репорт без указания чата
+                logic.mark_report_resolved(reports.pop(rnd.randrange(len(reports))), rnd.choice((chat_id, None)))
+        logic.audit.flush()
+        real = storage.count_chat(chat_id, day)
+        drift = {field: got - want for field, got, want in zip(FIELDS, logic.get_chat_stats(chat_id), real) if got != want}
+        print(f"{args.changes} changes, drift before reconcile: {drift or 'none'}")
+        fixed = logic.counters.reconcile()
+        problems = [f"{field} разошелся на {value}" for field, value in drift.items()]
+        if logic.get_chat_stats(chat_id) != real:
+            problems.append(f"после сверки {logic.get_chat_stats(chat_id)} != {real}")
+        print(f"reconcile fixed {fixed} chat(s)")
+        logic.close()
+    for problem in problems:
+        print(f"  FAIL {problem}")
+    if problems:
+        raise SystemExit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки админ-бота")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commit = commands.add_parser('commit', help="коммит на каждую запись против группового коммита")
+    commit.add_argument('--threads', type=int, default=8)
+    commit.add_argument('--ops', type=int, default=250)
+    commit.set_defaults(func=cmd_commit)
+
+    stress = commands.add_parser('stress', help="параллельные вызовы обработчиков на одном файле базы")
+    stress.add_argument('--threads', type=int, default=32)
+    stress.add_argument('--calls', type=int, default=500)
+    stress.add_argument('--group-commit', action='store_true')
+    stress.set_defaults(func=cmd_stress)
+
+    outbound = commands.add_parser('outbound', help="исходящая очередь против локального API с ответами 429")
+    outbound.add_argument('--chats', type=int, default=20)
+    outbound.add_argument('--messages', type=int, default=5)
+    outbound.add_argument('--flood-every', type=int, default=7)
+    outbound.set_defaults(func=cmd_outbound)
+
+    replay_parser = commands.add_parser('replay', help="синтетические апдейты через настоящие обработчики")
+    replay_parser.add_argument('--scenario', action='append', help="chatty, raid, muted_spam, admin_burst, flood")
+    replay_parser.add_argument('--seed', type=int, default=0)
+    replay_parser.add_argument('--repeat', type=int, default=5)
+    replay_parser.add_argument('--save', help="сохранить результат как baseline")
+    replay_parser.add_argument('--baseline', help="сравнить с сохраненным baseline")
+    replay_parser.add_argument('--tolerance', type=float, default=0.2)
+    replay_parser.add_argument('--storage', choices=['sqlite', 'memory'], help="бэкенд хранилища, по умолчанию из config")
+    replay_parser.set_defaults(func=cmd_replay)
+
+    webhook_parser = commands.add_parser('webhook', help="long polling против вебхука с пулом воркеров")
+    webhook_parser.add_argument('--scenario', default='admin_burst', help="chatty, raid, muted_spam, admin_burst, flood")
+    webhook_parser.add_argument('--seed', type=int, default=0)
+    webhook_parser.add_argument('--latency', type=float, default=0.1, help="задержка ответа Bot API (RTT до Telegram), с")
+    webhook_parser.add_argument('--workers', type=int, default=8)
+    webhook_parser.add_argument('--queue-size', type=int, default=64)
+    webhook_parser.add_argument('--connections', type=int, default=40)
+    webhook_parser.set_defaults(func=cmd_webhook)
+
+    shards = commands.add_parser('shards', help="масштабирование по числу процессов-шардов")
+    shards.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4])
+    shards.add_argument('--scenario', action='append', help="chatty, raid, muted_spam, admin_burst, flood")
+    shards.add_argument('--seed', type=int, default=0)
+    shards.add_argument('--queue-size', type=int, default=1000)
+    shards.set_defaults(func=cmd_shards)
+
+    filter_parser = commands.add_parser('filter', help="фильтр сообщений на автомате Aho-Corasick")
+    filter_parser.add_argument('--patterns', type=int, default=10000)
+    filter_parser.add_argument('--messages', type=int, default=5000)
+    filter_parser.add_argument('--verify', type=int, default=200)
+    filter_parser.add_argument('--adds', type=int, default=20)
+    filter_parser.add_argument('--seed', type=int, default=0)
+    filter_parser.set_defaults(func=cmd_filter)
+
+    flood_parser = commands.add_parser('flood', help="счетчики флуда: память на пользователя, скорость, вытеснение")
+    flood_parser.add_argument('--users', type=int, default=300000)
+    flood_parser.add_argument('--messages', type=int, default=500000)
+    flood_parser.add_argument('--interval', type=float, default=0.0005, help="шаг модельного времени между сообщениями, с")
+    flood_parser.add_argument('--burst', type=int, default=15)
+    flood_parser.add_argument('--limit', type=int, default=config.FLOOD_TRACK_LIMIT)
+    flood_parser.add_argument('--seed', type=int, default=0)
+    flood_parser.set_defaults(func=cmd_flood)
+
+    audit_parser = commands.add_parser('audit', help="журнал модерации: пачки против вставки по одной, запросы, очистка")
+    audit_parser.add_argument('--writes', type=int, default=5000)
+    audit_parser.add_argument('--entries', type=int, default=500000)
+    audit_parser.add_argument('--days', type=int, default=180)
+    audit_parser.add_argument('--retention', type=int, default=90)
+    audit_parser.add_argument('--chats', type=int, default=100)
+    audit_parser.add_argument('--users', type=int, default=5000)
+    audit_parser.add_argument('--queries', type=int, default=500)
+    audit_parser.add_argument('--seed', type=int, default=0)
+    audit_parser.set_defaults(func=cmd_audit)
+
+    transfer_parser = commands.add_parser('transfer', help="потоковый экспорт и импорт users: строк в секунду, пик памяти")
+    transfer_parser.add_argument('--rows', type=int, default=1000000)
+    transfer_parser.add_argument('--chunk', type=int, default=transfer.CHUNK)
+    transfer_parser.add_argument('--seed', type=int, default=0)
+    transfer_parser.set_defaults(func=cmd_transfer)
+
+    bulk_parser = commands.add_parser('bulk', help="массовые команды: одна транзакция и параллельные вызовы Telegram")
+    bulk_parser.add_argument('--users', type=int, default=100)
+    bulk_parser.add_argument('--latency', type=float, default=0.1)
+    bulk_parser.add_argument('--concurrency', type=int, default=config.BULK_CONCURRENCY)
+    bulk_parser.add_argument('--missing-every', type=int, default=10)
+    bulk_parser.set_defaults(func=cmd_bulk)
+
+    chatstats_parser = commands.add_parser('chatstats', help="счетчики /chatstats против COUNT(*), расхождения и сверка")
+    chatstats_parser.add_argument('--users', type=int, default=200000)
+    chatstats_parser.add_argument('--queries', type=int, default=20)
+    chatstats_parser.add_argument('--changes', type=int, default=2000)
+    chatstats_parser.add_argument('--seed', type=int, default=0)
+    chatstats_parser.set_defaults(func=cmd_chatstats)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,146 +1,137 @@
 import telebot
-from telebot import types
+from telebot import apihelper, types, util
 from datetime import datetime, timedelta
 import config
 from logic import BotLogic
+from outbound import OutboundDispatcher
+from antiflood import MutedSpamGuard, RaidGuard, FloodGuard
+from admins import ChatAdmins
+from digest import ReportDigest
+import content_filter
+import audit
+import bulk
+import metrics
 
+# Функциональные middleware вызываются один раз на пачку апдейтов, без разбора сигнатур обработчиков
+apihelper.ENABLE_MIDDLEWARE = True
 bot = telebot.TeleBot(config.TOKEN)
 logic = BotLogic()
+muted_guard = MutedSpamGuard()
+raid_guard = RaidGuard()
+flood_guard = FloodGuard()
+# outbound подменяется в шардах, поэтому берем его в момент отправки
+report_digest = ReportDigest(lambda text: outbound.notify_admins(text))
 
-def is_admin(user_id):
-    return user_id in config.ADMIN_IDS
+MUTED_PERMISSIONS = types.ChatPermissions(
+    can_send_messages=False,
+    can_send_media_messages=False,
+    can_send_polls=False,
+    can_send_other_messages=False,
+    can_add_web_page_previews=False
+)
 
-def extract_user_info(message):
-    if message.reply_to_message:
-        user = message.reply_to_message.from_user
-        return user.id, user.username or user.first_name
-    
-    parts = message.text.split()
-    if len(parts) > 1:
-        for part in parts[1:]:
-            if part.startswith('@'):
-                return None, part[1:]
-            elif part.isdigit():
-                return int(part), None
-    
-    return None, None
+UNMUTED_PERMISSIONS = types.ChatPermissions(
+    can_send_messages=True,
+    can_send_media_messages=True,
+    can_send_polls=True,
+    can_send_other_messages=True,
+    can_add_web_page_previews=True
+)
+
+outbound = OutboundDispatcher(bot)
+logic.admins = ChatAdmins(bot)
+
+@bot.middleware_handler(update_types=['message'])
+def user_sightings(bot_instance, message):
+    logic.see_message(message)
 
 @bot.message_handler(commands=['start', 'help'])
 def send_welcome(message):
-    help_text = """🤖 Админ-бот
-
-Для админов:
-/warn - выдать предупреждение
-/mute [время] - замьютить
-/ban [время] - забанить
-/unmute - снять мут
-/unban - разбанить
-/warns - проверить варны
-/reset_warns - сбросить варны
-/reports - показать репорты
-/welcome - вкл/выкл приветствие
-
-Для всех:
-/report [причина] - пожаловаться (ответом)
-/mywarns - мои варны
-
-Примеры:
-/warn id_user
-/mute 2h id_user
-/ban 1d id_user
-/report спам
-
-Форматы времени:
-30m - 30 минут
-2h - 2 часа
-1d - 1 день
-permanent - навсегда"""
-    
-    bot.reply_to(message, help_text)
+    outbound.reply_to(message, config.HELP_TEXT)
 
 @bot.message_handler(commands=['warn'])
 def warn_command(message):
-    if not is_admin(message.from_user.id):
-        bot.reply_to(message, "❌ Нужны права администратора")
+    if not logic.is_admin(message.from_user.id, message.chat.id):
+        outbound.reply_to(message, "❌ Нужны права администратора")
         return
     
-    user_id, username = extract_user_info(message)
+    user_id, username = logic.extract_user_info(message)
     if not user_id and not username:
-        bot.reply_to(message, "❌ Укажите пользователя (ответом или @username)")
+        outbound.reply_to(message, "❌ Укажите пользователя (ответом или @username)")
         return
     
     if username and not user_id:
-        bot.reply_to(message, "❌ Укажите ID пользователя или ответьте на сообщение")
+        outbound.reply_to(message, f"❌ Пользователь @{username} не найден, укажите ID")
         return
     
-    warns = logic.add_warn(user_id, message.chat.id)
-    bot.reply_to(message, f"⚠️ Предупреждение выдано. Всего: {warns}/{config.MAX_WARNS}")
+    warns = logic.add_warn(user_id, message.chat.id, actor_id=message.from_user.id)
+    outbound.reply_to(message, f"⚠️ Предупреждение выдано. Всего: {warns}/{config.MAX_WARNS}")
     
     if warns >= config.MAX_WARNS:
-        logic.ban_user(user_id, message.chat.id)
-        bot.ban_chat_member(message.chat.id, user_id)
-        bot.reply_to(message, f"🚫 Пользователь забанен за {config.MAX_WARNS} предупреждения!")
+        logic.ban_user(user_id, message.chat.id, actor_id=message.from_user.id, reason=f"{config.MAX_WARNS} предупреждения")
+        outbound.ban_chat_member(message.chat.id, user_id)
+        outbound.reply_to(message, f"🚫 Пользователь забанен за {config.MAX_WARNS} предупреждения!")
 
 @bot.message_handler(commands=['warns'])
 def warns_command(message):
-    if not is_admin(message.from_user.id):
-        bot.reply_to(message, "❌ Нужны права администратора")
+    if not logic.is_admin(message.from_user.id, message.chat.id):
+        outbound.reply_to(message, "❌ Нужны права администратора")
         return
     
-    user_id, username = extract_user_info(message)
+    user_id, username = logic.extract_user_info(message)
     if not user_id and not username:
-        bot.reply_to(message, "❌ Укажите пользователя")
+        outbound.reply_to(message, "❌ Укажите пользователя")
         return
     
     if username and not user_id:
-        bot.reply_to(message, "❌ Укажите ID пользователя")
+        outbound.reply_to(message, f"❌ Пользователь @{username} не найден, укажите ID")
         return
     
     user = logic.get_user(user_id, message.chat.id)
     if user:
         warns = user[4]
-        bot.reply_to(message, f"📊 Варнов: {warns}/{config.MAX_WARNS}")
+        outbound.reply_to(message, f"📊 Варнов: {warns}/{config.MAX_WARNS}")
     else:
-        bot.reply_to(message, "❌ Пользователь не найден")
+        outbound.reply_to(message, "❌ Пользователь не найден")
 
 @bot.message_handler(commands=['mywarns'])
 def my_warns_command(message):
     user = logic.get_user(message.from_user.id, message.chat.id)
     if user:
         warns = user[4]
-        bot.reply_to(message, f"📊 Ваши варны: {warns}/{config.MAX_WARNS}")
+        outbound.reply_to(message, f"📊 Ваши варны: {warns}/{config.MAX_WARNS}")
     else:
         logic.add_user(message.from_user.id, message.chat.id, 
                       message.from_user.username, message.from_user.first_name)
-        bot.reply_to(message, "📊 У вас нет варнов")
+        outbound.reply_to(message, "📊 У вас нет варнов")
 
 @bot.message_handler(commands=['reset_warns'])
 def reset_warns_command(message):
-    if not is_admin(message.from_user.id):
-        bot.reply_to(message, "❌ Нужны права администратора")
+    if not logic.is_admin(message.from_user.id, message.chat.id):
+        outbound.reply_to(message, "❌ Нужны права администратора")
         return
     
-    user_id, username = extract_user_info(message)
+    user_id, username = logic.extract_user_info(message)
     if not user_id and not username:
-        bot.reply_to(message, "❌ Укажите пользователя")
+        outbound.reply_to(message, "❌ Укажите пользователя")
         return
     
     if username and not user_id:
-        bot.reply_to(message, "❌ Укажите ID пользователя")
+        outbound.reply_to(message, f"❌ Пользователь @{username} не найден, укажите ID")
         return
     
-    logic.reset_warns(user_id, message.chat.id)
-    bot.reply_to(message, "✅ Варны сброшены")
+    logic.reset_warns(user_id, message.chat.id, actor_id=message.from_user.id)
+    outbound.reply_to(message, "✅ Варны сброшены")
 
 @bot.message_handler(commands=['mute'])
 def mute_command(message):
-    if not is_admin(message.from_user.id):
-        bot.reply_to(message, "❌ Нужны права администратора")
+    if not logic.is_admin(message.from_user.id, message.chat.id):
+        outbound.reply_to(message, "❌ Нужны права администратора")
         return
     
     parts = message.text.split()
     if len(parts) < 2:
-        bot.reply_to(message, "❌ Используйте: /mute [время] [пользователь]\nПример: /mute 1h user_id")
+        outbound.reply_to(message, "❌ Используйте: /mute [время] [пользователь]\nПример: /mute 1h user_id")
         return
     
     time_str = parts[1]
@@ -148,234 +139,705 @@ def mute_command(message):
     if not seconds:
         seconds = 3600
     
-    user_id, username = extract_user_info(message)
+    user_id, username = logic.extract_user_info(message)
     if not user_id and not username:
         if len(parts) > 2 and parts[2].startswith('@'):
             username = parts[2][1:]
-            bot.reply_to(message, f"❌ Нужен ID пользователя {username}")
+            outbound.reply_to(message, f"❌ Нужен ID пользователя {username}")
             return
         else:
-            bot.reply_to(message, "❌ Укажите пользователя")
+            outbound.reply_to(message, "❌ Укажите пользователя")
             return
     
     if username and not user_id:
-        bot.reply_to(message, f"❌ Нужен ID пользователя {username}")
+        outbound.reply_to(message, f"❌ Пользователь @{username} не найден, укажите ID")
         return
     
-    logic.mute_user(user_id, message.chat.id, seconds)
+    logic.mute_user(user_id, message.chat.id, seconds, actor_id=message.from_user.id)
     
     if seconds >= 315360000:
         until_date = None
     else:
         until_date = datetime.now() + timedelta(seconds=seconds)
     
-    bot.restrict_chat_member(
+    outbound.restrict_chat_member(
         message.chat.id,
         user_id,
         until_date=until_date,
-        permissions=types.ChatPermissions(
-            can_send_messages=False,
-            can_send_media_messages=False,
-            can_send_polls=False,
-            can_send_other_messages=False,
-            can_add_web_page_previews=False
-        )
+        permissions=MUTED_PERMISSIONS
     )
     
     duration = logic.format_time(seconds)
-    bot.reply_to(message, f"🔇 Пользователь замьючен на {duration}")
+    outbound.reply_to(message, f"🔇 Пользователь замьючен на {duration}")
 
 @bot.message_handler(commands=['unmute'])
 def unmute_command(message):
-    if not is_admin(message.from_user.id):
-        bot.reply_to(message, "❌ Нужны права администратора")
+    if not logic.is_admin(message.from_user.id, message.chat.id):
+        outbound.reply_to(message, "❌ Нужны права администратора")
         return
     
-    user_id, username = extract_user_info(message)
+    user_id, username = logic.extract_user_info(message)
     if not user_id and not username:
-        bot.reply_to(message, "❌ Укажите пользователя")
+        outbound.reply_to(message, "❌ Укажите пользователя")
         return
     
     if username and not user_id:
-        bot.reply_to(message, "❌ Укажите ID пользователя")
+        outbound.reply_to(message, f"❌ Пользователь @{username} не найден, укажите ID")
         return
     
-    logic.unmute_user(user_id, message.chat.id)
+    logic.unmute_user(user_id, message.chat.id, actor_id=message.from_user.id)
+    muted_guard.forget(message.chat.id, user_id)
+    flood_guard.forget(message.chat.id, user_id)
     
-    bot.restrict_chat_member(
+    outbound.restrict_chat_member(
         message.chat.id,
         user_id,
-        permissions=types.ChatPermissions(
-            can_send_messages=True,
-            can_send_media_messages=True,
-            can_send_polls=True,
-            can_send_other_messages=True,
-            can_add_web_page_previews=True
-        )
+        permissions=UNMUTED_PERMISSIONS
     )
     
-    bot.reply_to(message, "🔊 Мут снят")
+    outbound.reply_to(message, "🔊 Мут снят")
 
 @bot.message_handler(commands=['ban'])
 def ban_command(message):
-    if not is_admin(message.from_user.id):
-        bot.reply_to(message, "❌ Нужны права администратора")
+    if not logic.is_admin(message.from_user.id, message.chat.id):
+        outbound.reply_to(message, "❌ Нужны права администратора")
         return
     
     parts = message.text.split()
     time_str = 'permanent' if len(parts) < 2 else parts[1]
     seconds = logic.parse_time(time_str) or 86400
     
-    user_id, username = extract_user_info(message)
+    user_id, username = logic.extract_user_info(message)
     if not user_id and not username:
         if len(parts) > 2 and parts[2].startswith('@'):
             username = parts[2][1:]
-            bot.reply_to(message, f"❌ Нужен ID пользователя {username}")
+            outbound.reply_to(message, f"❌ Нужен ID пользователя {username}")
             return
         else:
-            bot.reply_to(message, "❌ Укажите пользователя")
+            outbound.reply_to(message, "❌ Укажите пользователя")
             return
     
     if username and not user_id:
-        bot.reply_to(message, f"❌ Нужен ID пользователя {username}")
+        outbound.reply_to(message, f"❌ Пользователь @{username} не найден, укажите ID")
         return
     
-    logic.ban_user(user_id, message.chat.id)
+    logic.ban_user(user_id, message.chat.id, seconds, actor_id=message.from_user.id)
     
     if seconds >= 315360000:
-        bot.ban_chat_member(message.chat.id, user_id)
+        outbound.ban_chat_member(message.chat.id, user_id)
     else:
         until_date = datetime.now() + timedelta(seconds=seconds)
-        bot.ban_chat_member(message.chat.id, user_id, until_date=until_date)
+        outbound.ban_chat_member(message.chat.id, user_id, until_date=until_date)
     
     duration = logic.format_time(seconds)
-    bot.reply_to(message, f"🚫 Пользователь забанен на {duration}")
+    outbound.reply_to(message, f"🚫 Пользователь забанен на {duration}")
 
 @bot.message_handler(commands=['unban'])
 def unban_command(message):
-    if not is_admin(message.from_user.id):
-        bot.reply_to(message, "❌ Нужны права администратора")
+    if not logic.is_admin(message.from_user.id, message.chat.id):
+        outbound.reply_to(message, "❌ Нужны права администратора")
         return
     
-    user_id, username = extract_user_info(message)
+    user_id, username = logic.extract_user_info(message)
     if not user_id and not username:
-        bot.reply_to(message, "❌ Укажите ID пользователя")
+        outbound.reply_to(message, "❌ Укажите ID пользователя")
         return
     
     if username and not user_id:
-        bot.reply_to(message, "❌ Укажите ID пользователя")
+        outbound.reply_to(message, f"❌ Пользователь @{username} не найден, укажите ID")
         return
     
-    logic.unban_user(user_id, message.chat.id)
-    bot.unban_chat_member(message.chat.id, user_id)
-    bot.reply_to(message, "✅ Пользователь разбанен")
+    logic.unban_user(user_id, message.chat.id, actor_id=message.from_user.id)
+    outbound.unban_chat_member(message.chat.id, user_id)
+    outbound.reply_to(message, "✅ Пользователь разбанен")
 
 @bot.message_handler(commands=['report'])
 def report_command(message):
     if not message.reply_to_message:
-        bot.reply_to(message, "❌ Ответьте на сообщение пользователя")
+        outbound.reply_to(message, "❌ Ответьте на сообщение пользователя")
         return
     
     reported_user = message.reply_to_message.from_user
     reporter_user = message.from_user
     
+    reply_id = message.reply_to_message.message_id
+    
     reason = ' '.join(message.text.split()[1:]) or "Причина не указана"
     
-    report_id = logic.add_report(
+    if report_digest.complained(message.chat.id, reported_user.id, reply_id, reporter_user.id):
+        outbound.reply_to(message, "ℹ️ Вы уже пожаловались на это сообщение")
+        return
+    
+    report_id, complaints = logic.file_report(
         message.chat.id,
         reporter_user.id,
         reported_user.id,
+        reason,
+        reply_id
+    )
+    
+    report_digest.add(
+        report_id,
+        complaints,
+        message.chat.id,
+        message.chat.title or message.chat.id,
+        f"{reported_user.first_name} (ID: {reported_user.id})",
         reason
     )
     
-    for admin_id in config.ADMIN_IDS:
-        bot.send_message(
-            admin_id,
-            f"🚨 Новый репорт #{report_id}\nЧат: {message.chat.title or message.chat.id}\nНа кого: {reported_user.first_name} (ID: {reported_user.id})\nПричина: {reason}"
-        )
+    if complaints == 1:
+        outbound.reply_to(message, f"✅ Репорт #{report_id} отправлен")
+    else:
+        outbound.reply_to(message, f"✅ Жалоба добавлена к репорту #{report_id}, всего жалоб: {complaints}")
+
+def reports_page(chat_id, after=None, before=None):
+    groups, has_prev, has_next = logic.get_report_groups(chat_id, after, before, config.REPORTS_PAGE_SIZE)
+    if not groups and before is None and after is not None:
+        groups, has_prev, has_next = logic.get_report_groups(chat_id, before=after + 1, limit=config.REPORTS_PAGE_SIZE)
+    if not groups:
+        return "📭 Нет репортов", None
     
-    bot.reply_to(message, f"✅ Репорт #{report_id} отправлен")
+    text = "📋 Репорты:\n\n"
+    markup = types.InlineKeyboardMarkup()
+    first = groups[0][0]
+    for reported_id, count, report_id, reason in groups:
+        text += f"На кого: {reported_id} (жалоб: {count})\n"
+        text += f"Последний: #{report_id}, {reason[:30]}...\n"
+        text += f"———\n"
+        markup.add(types.InlineKeyboardButton(
+            f"✅ Решить все на {reported_id}",
+            callback_data=f"reports:resolve:{reported_id}:{first}"
+        ))
+    
+    nav = []
+    if has_prev:
+        nav.append(types.InlineKeyboardButton("⬅️", callback_data=f"reports:prev:{first}"))
+    if has_next:
+        nav.append(types.InlineKeyboardButton("➡️", callback_data=f"reports:next:{groups[-1][0]}"))
+    if nav:
+        markup.row(*nav)
+    return text, markup
 
 @bot.message_handler(commands=['reports'])
 def reports_command(message):
-    if not is_admin(message.from_user.id):
-        bot.reply_to(message, "❌ Нужны права администратора")
+    if not logic.is_admin(message.from_user.id, message.chat.id):
+        outbound.reply_to(message, "❌ Нужны права администратора")
         return
     
-    reports = logic.get_pending_reports(message.chat.id)
-    if not reports:
-        bot.reply_to(message, "📭 Нет репортов")
+    text, markup = reports_page(message.chat.id)
+    outbound.reply_to(message, text, reply_markup=markup)
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith('reports:'))
+def reports_callback(call):
+    chat_id = call.message.chat.id
+    if not logic.is_admin(call.from_user.id, call.message.chat.id):
+        outbound.answer_callback_query(chat_id, call.id, "❌ Нужны права администратора")
         return
     
-    text = "📋 Репорты:\n\n"
-    for report in reports[:5]:
-        report_id, chat_id, reporter_id, reported_id, reason, status, created_at = report
-        text += f"ID: {report_id}\n"
-        text += f"На кого: {reported_id}\n"
-        text += f"Причина: {reason[:30]}...\n"
-        text += f"———\n"
+    _, action, value, *rest = call.data.split(':')
+    answer = None
+    if action == 'resolve':
+        count = logic.resolve_reports_against(chat_id, int(value), actor_id=call.from_user.id)
+        answer = f"✅ Решено репортов: {count}"
+        text, markup = reports_page(chat_id, after=int(rest[0]) - 1)
+    elif action == 'next':
+        text, markup = reports_page(chat_id, after=int(value))
+    else:
+        text, markup = reports_page(chat_id, before=int(value))
     
-    bot.reply_to(message, text)
+    outbound.edit_message_text(text, chat_id, call.message.message_id, reply_markup=markup)
+    outbound.answer_callback_query(chat_id, call.id, answer)
 
 @bot.message_handler(regexp=r'^/resolve_(\d+)$')
 def resolve_command(message):
-    if not is_admin(message.from_user.id):
+    if not logic.is_admin(message.from_user.id, message.chat.id):
         return
     
     report_id = int(message.text.split('_')[1])
-    logic.mark_report_resolved(report_id)
-    bot.reply_to(message, f"✅ Репорт #{report_id} решен")
+    # В группе решаются только ее репорты. В личку сюда доходят лишь суперадмины, им доступны все чаты
+    chat_id = message.chat.id if message.chat.id < 0 else None
+    if logic.mark_report_resolved(report_id, chat_id, message.from_user.id):
+        outbound.reply_to(message, f"✅ Репорт #{report_id} решен")
+    else:
+        outbound.reply_to(message, f"❌ Репорт #{report_id} не найден или уже решен")
+
+@bot.message_handler(commands=['resolve_user'])
+def resolve_user_command(message):
+    if not logic.is_admin(message.from_user.id, message.chat.id):
+        outbound.reply_to(message, "❌ Нужны права администратора")
+        return
+    
+    user_id, username = logic.extract_user_info(message)
+    if not user_id:
+        outbound.reply_to(message, "❌ Укажите ID пользователя")
+        return
+    
+    count = logic.resolve_reports_against(message.chat.id, user_id, actor_id=message.from_user.id)
+    outbound.reply_to(message, f"✅ Решено репортов: {count}")
+
+@bot.message_handler(commands=['resolve_older', 'resolve_all'])
+def resolve_older_command(message):
+    if not logic.is_admin(message.from_user.id, message.chat.id):
+        outbound.reply_to(message, "❌ Нужны права администратора")
+        return
+    
+    seconds = None
+    if message.text.split()[0].split('@')[0] == '/resolve_older':
+        parts = message.text.split()
+        seconds = logic.parse_time(parts[1]) if len(parts) > 1 else None
+        if not seconds:
+            outbound.reply_to(message, "❌ Используйте: /resolve_older [время]\nПример: /resolve_older 7d")
+            return
+    
+    count = logic.resolve_reports_older(message.chat.id, seconds, actor_id=message.from_user.id)
+    outbound.reply_to(message, f"✅ Решено репортов: {count}")
+
+@bot.message_handler(commands=list(bulk.COMMANDS))
+def bulk_command(message):
+    if not logic.is_admin(message.from_user.id, message.chat.id):
+        outbound.reply_to(message, "❌ Нужны права администратора")
+        return
+    
+    command = message.text.split()[0][1:].split('@')[0]
+    action = bulk.COMMANDS[command]
+    request = bulk.parse(message.text, logic.parse_time)
+    if request is None:
+        outbound.reply_to(message, f"❌ Используйте: /{command} [время] [id ...] [joined время] [dry]\nПример: /{command} joined 10m dry")
+        return
+    
+    seconds, user_ids, joined, dry = request
+    chat_id = message.chat.id
+    if joined:
+        # На одного больше лимита, чтобы заметить превышение
+        user_ids += logic.get_recent_joins(chat_id, joined, config.BULK_MAX_USERS + 1)
+    bot_id = logic.get_bot_id(bot)
+    targets = [
+        user_id for user_id in dict.fromkeys(user_ids)
+        if user_id != bot_id and not logic.is_admin(user_id, chat_id)
+    ]
+    if not targets:
+        outbound.reply_to(message, "ℹ️ Подходящих пользователей нет")
+        return
+    
+    if len(targets) > config.BULK_MAX_USERS:
+        outbound.reply_to(message, f"❌ Пользователей больше {config.BULK_MAX_USERS}, сузьте выборку")
+        return
+    
+    title = bulk.TITLES[action]
+    if action == 'mute':
+        seconds = seconds or config.DEFAULT_MUTE_TIME
+        title += f" на {logic.format_time(seconds)}"
+    elif action == 'ban':
+        seconds = seconds or 315360000
+        title += f" на {logic.format_time(seconds)}" if seconds < 315360000 else " навсегда"
+    
+    if dry:
+        text = f"🔎 Пробный запуск, ничего не изменено\n{title}: {len(targets)}\n\n"
+        text += ", ".join(str(user_id) for user_id in targets[:config.BULK_LIST_LIMIT])
+        if len(targets) > config.BULK_LIST_LIMIT:
+            text += f" …и еще {len(targets) - config.BULK_LIST_LIMIT}"
+        outbound.reply_to(message, text)
+        return
+    
+    actor_id = message.from_user.id
+    until_date = None
+    if seconds and seconds < 315360000:
+        until_date = datetime.now() + timedelta(seconds=seconds)
+    
+    if action == 'warn':
+        warns = logic.warn_users(targets, chat_id, actor_id=actor_id)
+        title = f"Варн выдан: {len(targets)}, бан за {config.MAX_WARNS} предупреждения"
+        targets = [user_id for user_id in targets if warns[user_id] >= config.MAX_WARNS]
+        if not targets:
+            outbound.reply_to(message, f"⚠️ Варн выдан: {len(warns)}")
+            return
+        logic.ban_users(targets, chat_id, actor_id=actor_id, reason=f"{config.MAX_WARNS} предупреждения")
+        calls = [(user_id, 'ban_chat_member', {}) for user_id in targets]
+    elif action == 'mute':
+        logic.mute_users(targets, chat_id, seconds, actor_id=actor_id)
+        calls = [
+            (user_id, 'restrict_chat_member', {'until_date': until_date, 'permissions': MUTED_PERMISSIONS})
+            for user_id in targets
+        ]
+    elif action == 'ban':
+        logic.ban_users(targets, chat_id, seconds, actor_id=actor_id)
+        kwargs = {'until_date': until_date} if until_date else {}
+        calls = [(user_id, 'ban_chat_member', kwargs) for user_id in targets]
+    elif action == 'unmute':
+        logic.unmute_users(targets, chat_id, actor_id=actor_id)
+        for user_id in targets:
+            muted_guard.forget(chat_id, user_id)
+            flood_guard.forget(chat_id, user_id)
+        calls = [(user_id, 'restrict_chat_member', {'permissions': UNMUTED_PERMISSIONS}) for user_id in targets]
+    else:
+        logic.unban_users(targets, chat_id, actor_id=actor_id)
+        calls = [(user_id, 'unban_chat_member', {}) for user_id in targets]
+    
+    # Вызовы Telegram идут в фоне, прогресс и ошибки — в одном сообщении
+    bulk.BulkJob(outbound, message, title, calls).start()
+
+@bot.message_handler(commands=['inactive'])
+def inactive_command(message):
+    if not logic.is_admin(message.from_user.id, message.chat.id):
+        outbound.reply_to(message, "❌ Нужны права администратора")
+        return
+    
+    parts = message.text.split()
+    seconds = config.INACTIVE_DEFAULT_TIME
+    if len(parts) > 1:
+        seconds = logic.parse_time(parts[1])
+        if not seconds or seconds >= 315360000:
+            outbound.reply_to(message, "❌ Используйте: /inactive [время]\nПример: /inactive 30d")
+            return
+    
+    users = logic.get_inactive_users(message.chat.id, seconds, config.INACTIVE_LIST_LIMIT)
+    if not users:
+        outbound.reply_to(message, f"✅ Все писали за последние {logic.format_time(seconds)}")
+        return
+    
+    text = f"💤 Молчат больше {logic.format_time(seconds)}:\n\n"
+    for user_id, username, first_name, last_seen, message_count in users:
+        name = f"@{username}" if username else first_name or user_id
+        seen = datetime.fromisoformat(last_seen).strftime('%d.%m.%Y') if last_seen else "нет данных"
+        text += f"{name} (ID: {user_id}) — {seen}, сообщений: {message_count}\n"
+    outbound.reply_to(message, text)
+
+@bot.message_handler(commands=['audit'])
+def audit_command(message):
+    if not logic.is_admin(message.from_user.id, message.chat.id):
+        outbound.reply_to(message, "❌ Нужны права администратора")
+        return
+    
+    seconds = None
+    for part in message.text.split()[1:]:
+        if part.isdigit() or part.startswith('@'):
+            continue
+        seconds = logic.parse_time(part)
+        if not seconds or seconds >= 315360000:
+            outbound.reply_to(message, "❌ Используйте: /audit [время] [пользователь]\nПример: /audit 7d @username")
+            return
+    
+    user_id, username = logic.extract_user_info(message)
+    if username and not user_id:
+        outbound.reply_to(message, f"❌ Пользователь @{username} не найден, укажите ID")
+        return
+    
+    entries = logic.get_audit(message.chat.id, seconds, user_id, config.AUDIT_LIST_LIMIT)
+    if not entries:
+        outbound.reply_to(message, "📭 В журнале ничего нет")
+        return
+    
+    text = "📜 Журнал"
+    if user_id:
+        text += f" по {username or user_id}"
+    if seconds:
+        text += f" за {logic.format_time(seconds)}"
+    text += ":\n\n"
+    for _, at, _, actor_id, target_id, action, duration, details in entries:
+        text += f"{datetime.fromisoformat(at).strftime('%d.%m %H:%M')} {audit.ACTIONS.get(action, action)}"
+        if target_id:
+            text += f" {target_id}"
+        if duration:
+            text += f" на {logic.format_time(duration)}"
+        text += f" — {actor_id or 'бот'}"
+        if details:
+            text += f" ({details[:40]})"
+        text += "\n"
+    outbound.reply_to(message, text)
+
+@bot.message_handler(commands=['filter'])
+def filter_command(message):
+    if not logic.is_admin(message.from_user.id, message.chat.id):
+        outbound.reply_to(message, "❌ Нужны права администратора")
+        return
+    
+    parts = message.text.split()
+    if len(parts) < 3 or parts[1].lower() not in content_filter.KINDS:
+        outbound.reply_to(message, "❌ Используйте: /filter [word|link|invite] [шаблон] [delete|warn|mute]\nПример: /filter word казино mute")
+        return
+    
+    kind = parts[1].lower()
+    words = parts[2:]
+    action = config.FILTER_DEFAULT_ACTION
+    if len(words) > 1 and words[-1].lower() in content_filter.ACTIONS:
+        action = words.pop().lower()
+    pattern = content_filter.normalize(' '.join(words), kind)
+    if not pattern:
+        outbound.reply_to(message, "❌ Пустой шаблон")
+        return
+    
+    if logic.count_filters(message.chat.id) >= config.FILTER_MAX_RULES:
+        outbound.reply_to(message, f"❌ В чате уже {config.FILTER_MAX_RULES} правил, удалите лишние: /unfilter")
+        return
+    
+    logic.add_filter(message.chat.id, kind, pattern, action)
+    outbound.reply_to(message, f"✅ Правило добавлено: {kind} «{pattern}» → {action}")
+
+@bot.message_handler(commands=['unfilter'])
+def unfilter_command(message):
+    if not logic.is_admin(message.from_user.id, message.chat.id):
+        outbound.reply_to(message, "❌ Нужны права администратора")
+        return
+    
+    parts = message.text.split(maxsplit=1)
+    if len(parts) < 2:
+        outbound.reply_to(message, "❌ Используйте: /unfilter [шаблон]")
+        return
+    
+    # Шаблон ссылки хранится без схемы и www, поэтому пробуем оба вида
+    if (logic.remove_filter(message.chat.id, content_filter.normalize(parts[1]))
+            or logic.remove_filter(message.chat.id, content_filter.normalize(parts[1], 'link'))):
+        outbound.reply_to(message, "✅ Правило удалено")
+    else:
+        outbound.reply_to(message, "❌ Такого правила нет")
+
+@bot.message_handler(commands=['filters'])
+def filters_command(message):
+    if not logic.is_admin(message.from_user.id, message.chat.id):
+        outbound.reply_to(message, "❌ Нужны права администратора")
+        return
+    
+    rules = logic.get_filters(message.chat.id)
+    if not rules:
+        outbound.reply_to(message, "ℹ️ Правил фильтра нет\nДобавить: /filter [тип] [шаблон] [действие]")
+        return
+    
+    text = f"🧹 Правила фильтра ({len(rules)}):\n\n"
+    for kind, pattern, action in rules[:config.FILTER_LIST_LIMIT]:
+        text += f"{kind} «{pattern}» → {action}\n"
+    if len(rules) > config.FILTER_LIST_LIMIT:
+        text += f"\n…и еще {len(rules) - config.FILTER_LIST_LIMIT}"
+    outbound.reply_to(message, text)
 
 @bot.message_handler(commands=['welcome'])
 def welcome_command(message):
-    if not is_admin(message.from_user.id):
-        bot.reply_to(message, "❌ Нужны права администратора")
+    if not logic.is_admin(message.from_user.id, message.chat.id):
+        outbound.reply_to(message, "❌ Нужны права администратора")
         return
     
     logic.toggle_welcome(message.chat.id)
     chat = logic.get_chat(message.chat.id)
     
     if chat and chat[1] == 1:
-        bot.reply_to(message, "✅ Приветствие включено")
+        outbound.reply_to(message, "✅ Приветствие включено")
     else:
-        bot.reply_to(message, "❌ Приветствие выключено")
+        outbound.reply_to(message, "❌ Приветствие выключено")
 
 @bot.message_handler(content_types=['new_chat_members'])
 def welcome_new_member(message):
     logic.add_chat(message.chat.id)
     
+    bot_id = logic.get_bot_id(bot)
+    members = [member for member in message.new_chat_members if member.id != bot_id]
+    if not members:
+        return
+    
+    raid, started = raid_guard.joined(message.chat.id, len(members))
     chat = logic.get_chat(message.chat.id)
-    if not chat or chat[1] != 1:
+    welcome = chat and chat[1] == 1
+    if not welcome and not raid:
         return
     
-    for member in message.new_chat_members:
-        if member.id == bot.get_me().id:
-            continue
-        
-        logic.add_user(
-            member.id,
-            message.chat.id,
-            member.username,
-            member.first_name
-        )
-        
-        welcome = config.WELCOME_MESSAGE.format(
-            username=f"@{member.username}" if member.username else member.first_name
-        )
-        bot.reply_to(message, welcome)
+    logic.add_users([
+        (member.id, message.chat.id, member.username, member.first_name)
+        for member in members
+    ])
+    
+    if not raid:
+        for member in members:
+            welcome_text = config.WELCOME_MESSAGE.format(
+                username=f"@{member.username}" if member.username else member.first_name
+            )
+            outbound.reply_to(message, welcome_text)
+        return
+    
+    if started:
+        outbound.send_message(message.chat.id, "🚨 Слишком много входов, включен режим рейда\nСнять: /raid_off")
+        outbound.notify_admins(f"🚨 Рейд в чате {message.chat.title or message.chat.id}")
+    
+    if config.RAID_RESTRICT:
+        until = datetime.now() + timedelta(seconds=config.RAID_RESTRICT_TIME)
+        for member in members:
+            outbound.restrict_chat_member(
+                message.chat.id,
+                member.id,
+                until_date=until,
+                permissions=MUTED_PERMISSIONS
+            )
+            raid_guard.restricted(message.chat.id, member.id)
+    
+    if welcome and config.RAID_WELCOME == 'merge':
+        # Новички дописываются в еще не отправленное приветствие
+        for member in members:
+            outbound.send_merged(
+                message.chat.id,
+                ('raid_welcome', message.chat.id),
+                f"@{member.username}" if member.username else member.first_name,
+                lambda names: config.RAID_WELCOME_MESSAGE.format(usernames=', '.join(names)),
+                config.RAID_WELCOME_LIMIT
+            )
+
+@bot.message_handler(commands=['raid_off'])
+def raid_off_command(message):
+    if not logic.is_admin(message.from_user.id, message.chat.id):
+        outbound.reply_to(message, "❌ Нужны права администратора")
+        return
+    
+    restricted = raid_guard.lift(message.chat.id)
+    if restricted is None:
+        outbound.reply_to(message, "ℹ️ Режим рейда не включен")
+        return
+    
+    for user_id in restricted:
+        if not logic.is_muted(user_id, message.chat.id):
+            outbound.restrict_chat_member(message.chat.id, user_id, permissions=UNMUTED_PERMISSIONS)
+    
+    outbound.reply_to(message, f"✅ Режим рейда снят, ограничений снято: {len(restricted)}")
+
+@bot.message_handler(commands=['chatstats'])
+def chatstats_command(message):
+    if not logic.is_admin(message.from_user.id, message.chat.id):
+        outbound.reply_to(message, "❌ Нужны права администратора")
+        return
+    
+    members, muted, banned, reports, warns_today = logic.get_chat_stats(message.chat.id)
+    outbound.reply_to(
+        message,
+        f"📊 Статистика чата\n\n"
+        f"👥 Участников: {members}\n"
+        f"🔇 В муте: {muted}\n"
+        f"🚫 Забанено: {banned}\n"
+        f"📨 Репортов ждут: {reports}\n"
+        f"⚠️ Варнов сегодня: {warns_today}"
+    )
+
+@bot.message_handler(commands=['stats'])
+def stats_command(message):
+    if not logic.is_admin(message.from_user.id, message.chat.id):
+        outbound.reply_to(message, "❌ Нужны права администратора")
+        return
+    
+    outbound.reply_to(message, metrics.stats_text())
+
+@bot.chat_member_handler()
+def chat_member_update(update):
+    if logic.admins:
+        logic.admins.update(update.chat.id, update.new_chat_member.user.id, update.new_chat_member.status)
+
+def flood_action(message, reason, first):
+    chat_id, user = message.chat.id, message.from_user
+    name = f"@{user.username}" if user.username else user.first_name
+    outbound.delete_message(chat_id, message.message_id, batch=True)
+    # Наказываем один раз за эпизод, остальные сообщения эпизода только удаляются
+    if not first:
+        return
+    
+    why = "флуд" if reason == 'flood' else "повтор сообщений"
+    if config.FLOOD_ACTION == 'delete':
+        outbound.send_message(chat_id, f"⚠️ {name}, сообщения удаляются: {why}")
+        return
+    
+    if config.FLOOD_ACTION == 'mute':
+        # Строка пользователя могла еще не дойти до базы из буфера UserDirectory
+        logic.add_user(user.id, chat_id, user.username, user.first_name)
+        logic.mute_user(user.id, chat_id, config.FLOOD_MUTE_TIME, reason=why)
+    else:
+        # Мут только в Telegram, в базу не пишется, но в журнал попадает
+        logic.audit.record('mute', chat_id, None, user.id, config.FLOOD_MUTE_TIME, why)
+    outbound.restrict_chat_member(
+        chat_id,
+        user.id,
+        until_date=datetime.now() + timedelta(seconds=config.FLOOD_MUTE_TIME),
+        permissions=MUTED_PERMISSIONS
+    )
+    outbound.send_message(chat_id, f"🔇 {name} замьючен на {logic.format_time(config.FLOOD_MUTE_TIME)}: {why}")
+
+def filter_action(message, rule):
+    action = rule[2]
+    chat_id, user = message.chat.id, message.from_user
+    name = f"@{user.username}" if user.username else user.first_name
+    outbound.delete_message(chat_id, message.message_id, batch=True)
+    if action == 'delete':
+        return
+    
+    # Строка пользователя могла еще не дойти до базы из буфера UserDirectory
+    logic.add_user(user.id, chat_id, user.username, user.first_name)
+    why = f"фильтр: {rule[0]} {rule[1]}"
+    if action == 'warn':
+        warns = logic.add_warn(user.id, chat_id, reason=why)
+        outbound.send_message(chat_id, f"⚠️ {name}, сообщение удалено фильтром. Предупреждений: {warns}/{config.MAX_WARNS}")
+        if warns >= config.MAX_WARNS:
+            logic.ban_user(user.id, chat_id, reason=f"{config.MAX_WARNS} предупреждения")
+            outbound.ban_chat_member(chat_id, user.id)
+            outbound.send_message(chat_id, f"🚫 {name} забанен за {config.MAX_WARNS} предупреждения!")
+        return
+    
+    logic.mute_user(user.id, chat_id, config.FILTER_MUTE_TIME, reason=why)
+    outbound.restrict_chat_member(
+        chat_id,
+        user.id,
+        until_date=datetime.now() + timedelta(seconds=config.FILTER_MUTE_TIME),
+        permissions=MUTED_PERMISSIONS
+    )
+    outbound.send_message(chat_id, f"🔇 {name}, сообщение удалено фильтром, мут на {logic.format_time(config.FILTER_MUTE_TIME)}")
 
 @bot.message_handler(func=lambda message: True)
 def check_mute(message):
-    if message.from_user.id == bot.get_me().id:
+    if message.from_user.id == logic.get_bot_id(bot):
         return
     
     if logic.is_muted(message.from_user.id, message.chat.id):
-        bot.delete_message(message.chat.id, message.message_id)
-        bot.send_message(
-            message.chat.id,
-            f"⚠️ Вы замьючены и не можете писать",
-            reply_to_message_id=message.message_id
-        )
+        warn, escalate = muted_guard.hit(message.chat.id, message.from_user.id)
+        outbound.delete_message(message.chat.id, message.message_id, batch=True)
+        if warn:
+            outbound.send_message(
+                message.chat.id,
+                f"⚠️ Вы замьючены и не можете писать",
+                coalesce=('muted', message.chat.id, message.from_user.id),
+                reply_to_message_id=message.message_id
+            )
+        if escalate:
+            # Ограничение в Telegram могло слететь, ставим его заново
+            outbound.restrict_chat_member(
+                message.chat.id,
+                message.from_user.id,
+                until_date=logic.get_mute_until(message.from_user.id, message.chat.id),
+                permissions=MUTED_PERMISSIONS
+            )
+        return
+    
+    if config.FLOOD_ACTION:
+        reason, first = flood_guard.hit(message.chat.id, message.from_user.id, message.text)
+        if reason and not logic.is_admin(message.from_user.id, message.chat.id):
+            flood_action(message, reason, first)
+            return
+    
+    rule = logic.match_filter(message.chat.id, message.text)
+    if rule and not logic.is_admin(message.from_user.id, message.chat.id):
+        filter_action(message, rule)
+
+metrics.instrument_handlers(bot)
+metrics.instrument_logic(logic)
+metrics.instrument_api()
+metrics.register_gauges(logic, outbound, muted_guard, flood_guard)
 
 if __name__ == '__main__':
-    bot.infinity_polling()
\ No newline at end of file
+    logic.scheduler.start()
+    outbound.start()
+    if config.METRICS_PORT:
+        metrics.MetricsServer().start()
+    try:
+        if config.RUNTIME == 'async':
+            import async_bot
+            async_bot.run(bot, logic)
+        elif config.WEBHOOK_URL:
+            import webhook
+            webhook.run(bot)
+        else:
+            # Пока висит вебхук, getUpdates отвечает 409
+            bot.remove_webhook()
+            bot.infinity_polling(allowed_updates=util.update_types)
+    finally:
+        report_digest.stop()
+        outbound.stop()
+        logic.close()
\ No newline at end of file
@@ -0,0 +1,109 @@
+import threading
+from concurrent.futures import as_completed
+
+import config
+from outbound import MODERATION
+
+# Команда -> действие
+COMMANDS = {
+    'warn_many': 'warn',
+    'mute_many': 'mute',
+    'ban_many': 'ban',
+    'unmute_many': 'unmute',
+    'unban_many': 'unban',
+}
+TITLES = {
+    'warn': 'Варн',
+    'mute': 'Мут',
+    'ban': 'Бан',
+    'unmute': 'Размут',
+    'unban': 'Разбан',
+}
+DRY_RUN = {'dry', 'dry-run', '--dry-run'}
+
+
+def parse(text, parse_time):
+    # /ban_many [время] [id ...] [joined 30m] [dry] -> (время, ids, вошедшие за секунд, dry) или None
+    seconds, user_ids, joined, dry = None, [], None, False
+    words = text.replace(',', ' ').split()[1:]
+    position = 0
+    while position < len(words):
+        word = words[position].lower()
+        position += 1
+        if word.isdigit():
+            user_ids.append(int(word))
+        elif word in DRY_RUN:
+            dry = True
+        elif word == 'joined' and position < len(words):
+            joined = parse_time(words[position])
+            position += 1
+            if not joined:
+                return None
+        else:
+            seconds = parse_time(word)
+            if not seconds:
+                return None
+    if not user_ids and not joined:
+        return None
+    return seconds, user_ids, joined, dry
+
+
+class BulkJob:
+    # Вызовы Telegram по списку пользователей: полосы очереди ограничивают их до concurrency
+    # одновременно, прогресс и итог с ошибками по каждому пользователю правятся в одном сообщении
+    def __init__(self, outbound, message, title, calls, concurrency=None, step=None):
+        self.outbound = outbound
+        self.message = message
+        self.chat_id = message.chat.id
+        self.title = title
+        # (user_id, метод бота, kwargs)
+        self.calls = calls
+        self.concurrency = concurrency or config.BULK_CONCURRENCY
+        self.step = step or config.BULK_PROGRESS_STEP
+        self.failed = []
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='bulk-job', daemon=True)
+        self.thread.start()
+        return self
+
+    def run(self):
+        status = self.outbound.reply_to(self.message, self.render(0))
+        futures = {}
+        for n, (user_id, method, kwargs) in enumerate(self.calls):
+            lane = ('bulk', self.chat_id, n % self.concurrency)
+            future = self.outbound.submit(method, self.chat_id, (self.chat_id, user_id), kwargs, MODERATION, lane=lane)
+            futures[future] = user_id
+        done = 0
+        for future in as_completed(futures):
+            done += 1
+            error = future.exception()
+            if error is not None:
+                self.failed.append((futures[future], getattr(error, 'description', None) or str(error)))
+            if done % self.step == 0 and done < len(futures):
+                self.edit(status, self.render(done))
+        self.edit(status, self.render(done, True), True)
+
+    def edit(self, status, text, final=False):
+        try:
+            message_id = status.result().message_id
+        except Exception:
+            # Сообщение с прогрессом не ушло: промежуточные пропускаем, итог отправляем отдельно
+            if final:
+                self.outbound.send_message(self.chat_id, text)
+            return
+        self.outbound.edit_message_text(text, self.chat_id, message_id)
+
+    def render(self, done, final=False):
+        total = len(self.calls)
+        if not final:
+            return f"⏳ {self.title}: {done}/{total}"
+        text = f"✅ {self.title}: {total - len(self.failed)}/{total}"
+        if self.failed:
+            text += f"\n\n❌ Не вышло ({len(self.failed)}):\n"
+            for user_id, error in self.failed[:config.BULK_LIST_LIMIT]:
+                text += f"{user_id}: {error}\n"
+            if len(self.failed) > config.BULK_LIST_LIMIT:
+                text += f"…и еще {len(self.failed) - config.BULK_LIST_LIMIT}"
+        return text
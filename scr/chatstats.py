@@ -0,0 +1,117 @@
+import threading
+import time
+from datetime import date
+
+import config
+
+# Счетчики в порядке колонок chat_counters, за ними — день, к которому относятся варны
+FIELDS = ('members', 'muted', 'banned', 'reports', 'warns_today')
+
+
+class ChatCounters:
+    # Счетчики /chatstats: мутаторы BotLogic меняют их вместе с данными, в базу они пишутся
+    # раз в interval секунд, раз в reconcile_interval пересчитываются по таблицам
+    def __init__(self, logic, interval=None, reconcile_interval=None):
+        self.logic = logic
+        self.storage = logic.storage
+        self.interval = interval or config.CHATSTATS_FLUSH_INTERVAL
+        self.reconcile_interval = reconcile_interval or config.CHATSTATS_RECONCILE_INTERVAL
+        self.lock = threading.Lock()
+        # chat_id -> [участники, в муте, забанены, репорты, варны за день, день]
+        self.counters = {}
+        for row in self.storage.load_chat_counters():
+            if logic.owns(row[0]):
+                self.counters[row[0]] = list(row[1:])
+        self.dirty = set()
+        # Новые чаты без строки в базе сверяются на ближайшем шаге потока, не дожидаясь общего прохода
+        self.fresh = set()
+        self.reconciled = time.monotonic()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.running = False
+
+    def entry(self, chat_id):
+        # Вызывается под self.lock. Чата без строки в базе еще нет в таблицах, считаем с нуля
+        today = date.today().isoformat()
+        counters = self.counters.get(chat_id)
+        if counters is None:
+            counters = self.counters[chat_id] = [0, 0, 0, 0, 0, today]
+            self.fresh.add(chat_id)
+        elif counters[5] != today:
+            counters[4], counters[5] = 0, today
+        if self.thread is None:
+            self.start()
+        return counters
+
+    def change(self, chat_id, field, delta):
+        if not delta:
+            return
+        index = FIELDS.index(field)
+        with self.lock:
+            counters = self.entry(chat_id)
+            counters[index] = max(counters[index] + delta, 0)
+            self.dirty.add(chat_id)
+
+    def get(self, chat_id):
+        with self.lock:
+            return tuple(self.entry(chat_id)[:5])
+
+    def start(self):
+        # Вызывается под self.lock при первом обращении
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='chat-counters', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while self.running:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            self.flush()
+            if not self.running:
+                continue
+            if time.monotonic() - self.reconciled >= self.reconcile_interval:
+                self.reconcile()
+            elif self.fresh:
+                with self.lock:
+                    fresh, self.fresh = self.fresh, set()
+                self.reconcile(fresh)
+
+    def flush(self):
+        with self.lock:
+            dirty, self.dirty = self.dirty, set()
+            rows = [(chat_id, *self.counters[chat_id]) for chat_id in dirty]
+        if rows:
+            self.storage.save_chat_counters(rows)
+
+    def reconcile(self, chat_ids=None):
+        # Возвращает число чатов, где счетчики разошлись с таблицами; без chat_ids — все чаты.
+        # Сверка читает базу, поэтому буферы справочника и журнала сначала дописываются
+        self.logic.directory.flush()
+        self.logic.audit.flush()
+        self.storage.durable().result()
+        if chat_ids is None:
+            self.reconciled = time.monotonic()
+            with self.lock:
+                chat_ids = list(self.counters)
+                self.fresh = set()
+        fixed = 0
+        for chat_id in chat_ids:
+            real = list(self.storage.count_chat(chat_id, date.today().isoformat()))
+            # Изменение между подсчетом и записью поправит следующая сверка
+            with self.lock:
+                counters = self.entry(chat_id)
+                if counters[:5] != real:
+                    counters[:5] = real
+                    self.dirty.add(chat_id)
+                    fixed += 1
+        self.flush()
+        return fixed
+
+    def stop(self):
+        with self.lock:
+            thread, self.thread = self.thread, None
+            self.running = False
+        if thread:
+            self.wakeup.set()
+            thread.join()
+        self.flush()
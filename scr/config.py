@@ -6,5 +6,201 @@ MAX_WARNS = 3
 
 WELCOME_MESSAGE = "👋 Добро пожаловать, {username}!"
 
+HELP_TEXT = """🤖 Админ-бот
+
+Для админов:
+/warn - выдать предупреждение
+/mute [время] - замьютить
+/ban [время] - забанить
+/unmute - снять мут
+/unban - разбанить
+/warns - проверить варны
+/reset_warns - сбросить варны
+/reports - показать репорты
+/resolve_user - решить все репорты на пользователя
+/resolve_older [время] - решить репорты старше
+/resolve_all - решить все репорты
+/welcome - вкл/выкл приветствие
+/raid_off - снять режим рейда
+/filter [тип] [шаблон] [действие] - добавить правило фильтра
+/unfilter [шаблон] - удалить правило фильтра
+/filters - правила фильтра чата
+/inactive [время] - кто молчит дольше (по умолчанию 30d)
+/audit [время] [пользователь] - журнал модерации
+/ban_many [время] [id ...] [joined время] [dry] - массовый бан
+/mute_many, /unmute_many, /unban_many, /warn_many - то же для других действий
+/chatstats - статистика чата: участники, муты, баны, репорты
+/stats - статистика работы бота
+
+Для всех:
+/report [причина] - пожаловаться (ответом)
+/mywarns - мои варны
+
+Примеры:
+/warn id_user
+/mute 2h id_user
+/ban 1d id_user
+/report спам
+/filter word казино mute
+/filter link spam.com warn
+/filter invite t.me/+
+/audit 7d @username
+/mute_many 1h 111 222 333
+/ban_many joined 10m dry
+
+Форматы времени:
+30m - 30 минут
+2h - 2 часа
+1d - 1 день
+permanent - навсегда"""
+
+# Приветствие во время рейда: одно сообщение со всеми новичками
+RAID_WELCOME_MESSAGE = "👋 Добро пожаловать: {usernames}"
+
 DEFAULT_BAN_TIME = 86400  
-DEFAULT_MUTE_TIME = 3600
\ No newline at end of file
+DEFAULT_MUTE_TIME = 3600
+
+REPORTS_PAGE_SIZE = 5
+
+# Жалобы на одно сообщение за REPORT_DEDUP_WINDOW секунд копятся в одном репорте.
+# Админам раз в REPORT_DIGEST_INTERVAL секунд уходит сводка (0 — каждый репорт сразу),
+# репорт, набравший REPORT_URGENT_COMPLAINTS жалоб, уходит сразу
+REPORT_DEDUP_WINDOW = 3600
+REPORT_DIGEST_INTERVAL = 300
+REPORT_URGENT_COMPLAINTS = 3
+REPORT_DIGEST_LIMIT = 20
+
+# Фильтр сообщений: типы word, link, invite; действия delete, warn, mute
+FILTER_DEFAULT_ACTION = 'delete'
+FILTER_MUTE_TIME = 3600
+FILTER_MAX_RULES = 10000
+FILTER_LIST_LIMIT = 50
+FILTER_CACHE_LIMIT = 1000
+
+# Журнал модерации: варны, муты, баны, разбаны, репорты и их решения. Записи копятся
+# в памяти и пишутся пачкой раз в AUDIT_FLUSH_INTERVAL секунд или по AUDIT_FLUSH_MAX записей.
+# Записи старше AUDIT_RETENTION секунд удаляются раз в AUDIT_COMPACT_INTERVAL секунд
+# порциями по AUDIT_COMPACT_BATCH строк
+AUDIT_FLUSH_INTERVAL = 2
+AUDIT_FLUSH_MAX = 200
+AUDIT_RETENTION = 90 * 86400
+AUDIT_COMPACT_INTERVAL = 3600
+AUDIT_COMPACT_BATCH = 5000
+AUDIT_LIST_LIMIT = 20
+
+# Массовые команды: не больше BULK_MAX_USERS пользователей за раз, в Telegram идут
+# до BULK_CONCURRENCY вызовов одновременно, прогресс обновляется каждые BULK_PROGRESS_STEP
+BULK_MAX_USERS = 200
+BULK_CONCURRENCY = 4
+BULK_PROGRESS_STEP = 25
+BULK_LIST_LIMIT = 30
+
+# Счетчики /chatstats ведутся в памяти и пишутся в базу раз в CHATSTATS_FLUSH_INTERVAL секунд.
+# Раз в CHATSTATS_RECONCILE_INTERVAL секунд фоновая сверка пересчитывает их по таблицам:
+# так подтягиваются новые участники и исправляются расхождения
+CHATSTATS_FLUSH_INTERVAL = 30
+CHATSTATS_RECONCILE_INTERVAL = 600
+
+# Хранилище: 'sqlite' — файл DB_PATH, 'memory' — словари в памяти процесса (бенчмарки, проверки)
+STORAGE_BACKEND = 'sqlite'
+DB_PATH = './scr/bot.db'
+
+# Групповой коммит: записи копятся GROUP_COMMIT_INTERVAL секунд
+# или до GROUP_COMMIT_MAX_OPS операций и фиксируются одной транзакцией
+GROUP_COMMIT = False
+GROUP_COMMIT_INTERVAL = 0.005
+GROUP_COMMIT_MAX_OPS = 100
+
+# Каждый поток читает через свое соединение, пишет одно общее под блокировкой
+DB_THREAD_READERS = True
+DB_BUSY_TIMEOUT = 5
+
+# Рантайм: 'sync' — TeleBot с потоками, 'async' — AsyncTeleBot на asyncio
+RUNTIME = 'sync'
+# Обработчики в async-рантайме синхронные и выполняются в пуле из стольких потоков
+ASYNC_WORKERS = 4
+
+# Исходящая очередь: лимиты Telegram на отправку сообщений
+OUTBOUND_WORKERS = 4
+OUTBOUND_GLOBAL_RATE = 30
+OUTBOUND_CHAT_RATE = 1
+OUTBOUND_CHAT_BURST = 3
+OUTBOUND_GROUP_RATE = 20 / 60
+OUTBOUND_GROUP_BURST = 20
+OUTBOUND_MAX_RETRIES = 5
+OUTBOUND_DELETE_BATCH = 100
+# Сколько корзин лимитов по чатам держать; сверх этого выбрасываются давно полные
+OUTBOUND_BUCKET_TRACK_LIMIT = 10000
+
+# Замьюченный пишет в чат: одно предупреждение за окно, после
+# MUTED_ESCALATE_AFTER удаленных сообщений ограничение ставится заново
+MUTED_WARN_WINDOW = 60
+MUTED_ESCALATE_AFTER = 10
+MUTED_TRACK_LIMIT = 10000
+
+# Рейд: RAID_JOIN_THRESHOLD входов за RAID_WINDOW секунд включают режим рейда до /raid_off.
+# RAID_WELCOME: 'merge' — одно приветствие на всех новичков, 'off' — без приветствий.
+# RAID_RESTRICT ограничивает новичков на RAID_RESTRICT_TIME секунд или до /raid_off
+RAID_WINDOW = 10
+RAID_JOIN_THRESHOLD = 10
+RAID_TRACK_LIMIT = 10000
+RAID_WELCOME = 'merge'
+RAID_WELCOME_LIMIT = 50
+RAID_RESTRICT = False
+RAID_RESTRICT_TIME = 86400
+
+# Флуд: больше FLOOD_LIMIT сообщений за FLOOD_WINDOW секунд (окно из FLOOD_SLOTS ячеек)
+# или FLOOD_DUPLICATES одинаковых текстов среди последних FLOOD_DUPLICATE_HISTORY
+# (история не зависит от окна и сбрасывается после FLOOD_DUPLICATE_WINDOW секунд тишины).
+# FLOOD_ACTION: 'mute' — мут на FLOOD_MUTE_TIME с записью в базу, 'restrict' — только
+# ограничение в Telegram на FLOOD_MUTE_TIME, 'delete' — удалять лишнее, None — выключено
+FLOOD_WINDOW = 5
+FLOOD_SLOTS = 5
+FLOOD_LIMIT = 10
+FLOOD_DUPLICATES = 3
+FLOOD_DUPLICATE_HISTORY = 5
+FLOOD_DUPLICATE_WINDOW = 60
+FLOOD_ACTION = 'mute'
+FLOOD_MUTE_TIME = 600
+FLOOD_TRACK_LIMIT = 300000
+
+# Админы чата берутся из getChatAdministrators и кэшируются на CHAT_ADMINS_TTL секунд
+CHAT_ADMINS_TTL = 600
+CHAT_ADMINS_LIMIT = 10000
+
+# Индекс @username -> id и активность пользователей: USERS_CACHE_LIMIT записей в памяти,
+# новые имена, счетчики сообщений и время последнего сообщения пишутся в базу
+# пачкой раз в USERS_FLUSH_INTERVAL секунд или по USERS_FLUSH_MAX пользователей
+USERS_CACHE_LIMIT = 100000
+USERS_FLUSH_INTERVAL = 5
+USERS_FLUSH_MAX = 500
+INACTIVE_DEFAULT_TIME = 30 * 86400
+INACTIVE_LIST_LIMIT = 20
+
+# Метрики в формате Prometheus на http://METRICS_HOST:METRICS_PORT/metrics,
+# METRICS_PORT = None выключает сервер. PROFILE_SAMPLE_RATE — доля
+# обработчиков, которые выполняются под cProfile с выводом в лог
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9108
+PROFILE_SAMPLE_RATE = 0
+
+# Вебхук: Telegram присылает апдейты на WEBHOOK_URL, при None бот работает
+# через long polling. Апдейты раскладываются по WEBHOOK_WORKERS очередям по чату,
+# при заполненной очереди запрос ждет до WEBHOOK_PUT_TIMEOUT секунд, потом 503
+WEBHOOK_URL = None
+WEBHOOK_HOST = '0.0.0.0'
+WEBHOOK_PORT = 8443
+WEBHOOK_SECRET = None
+WEBHOOK_WORKERS = 8
+WEBHOOK_QUEUE_SIZE = 1000
+WEBHOOK_PUT_TIMEOUT = 5
+WEBHOOK_MAX_CONNECTIONS = 40
+
+# Шардирование: при SHARDS > 1 запускать python scr/sharding.py. Фронт забирает
+# апдейты (polling или вебхук) и раздает их SHARDS процессам по chat_id
+SHARDS = 1
+SHARD_QUEUE_SIZE = 1000
+# Пауза перед повтором getUpdates во фронте после ошибки удваивается до этого числа секунд
+SHARD_POLL_MAX_BACKOFF = 60
+# (номер, всего) — выставляет процесс-воркер шарда, вручную не задается
+SHARD = None
\ No newline at end of file
@@ -0,0 +1,225 @@
+import threading
+from collections import OrderedDict
+
+import config
+from metrics import cache_hit
+
+# word — слово целиком, link — домен и его поддомены, invite — подстрока (t.me/+, discord.gg/)
+KINDS = ('word', 'link', 'invite')
+# Чем больше вес, тем строже действие; из нескольких совпадений берется самое строгое
+ACTIONS = {'delete': 1, 'warn': 2, 'mute': 3}
+
+
+def normalize(pattern, kind=None):
+    pattern = ' '.join(pattern.lower().split())
+    if kind == 'link':
+        # https://www.spam.com/ и spam.com — одно правило
+        for prefix in ('https://', 'http://', 'www.'):
+            if pattern.startswith(prefix):
+                pattern = pattern[len(prefix):]
+        pattern = pattern.rstrip('/')
+    return pattern
+
+
+def word_char(char):
+    return char.isalnum() or char == '_'
+
+
+def host_char(char):
+    return char.isalnum() or char == '-'
+
+
+class Automaton:
+    # Aho-Corasick: один проход по тексту находит все шаблоны сразу,
+    # время на сообщение зависит от его длины, а не от числа шаблонов
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.goto = [{}]
+        self.fail = [0]
+        # kind -> action для правил, которые заканчиваются в узле; у word и link шаблон может совпадать
+        self.out = [{}]
+        # Шаблон, который заканчивается в узле
+        self.patterns = [None]
+        # Ближайший по fail-ссылкам узел с правилом, 0 — такого нет
+        self.link = [0]
+        # (kind, pattern) -> узел
+        self.terminals = {}
+        self.dirty = False
+        self.removed = 0
+
+    def add(self, kind, pattern, action):
+        # Вызывается под self.lock; новые узлы дописываются в бор, ссылки пересчитаются перед поиском
+        key = (kind, pattern)
+        node = self.terminals.get(key)
+        if node is None:
+            node = 0
+            for char in pattern:
+                next_node = self.goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append({})
+                    self.patterns.append(None)
+                    self.link.append(0)
+                    self.goto[node][char] = next_node
+                    self.dirty = True
+                node = next_node
+            self.terminals[key] = node
+        if not self.out[node]:
+            # Узел уже был в боре, но без правил: его уже могли пропустить в цепочках link
+            self.dirty = True
+        self.patterns[node] = pattern
+        self.out[node][kind] = action
+
+    def remove(self, kind, pattern):
+        # Вызывается под self.lock; узел остается в боре, у него только снимается правило
+        node = self.terminals.pop((kind, pattern), None)
+        if node is None:
+            return False
+        del self.out[node][kind]
+        self.removed += 1
+        return True
+
+    def relink(self):
+        # Вызывается под self.lock; обход в ширину по уже построенному бору, без повторной вставки шаблонов
+        goto, fail, out, link = self.goto, self.fail, self.out, self.link
+        queue = list(goto[0].values())
+        for child in queue:
+            fail[child] = 0
+            link[child] = 0
+        for node in queue:
+            for char, child in goto[node].items():
+                state = fail[node]
+                while char not in goto[state] and state:
+                    state = fail[state]
+                fail[child] = goto[state].get(char, 0)
+                link[child] = fail[child] if out[fail[child]] else link[fail[child]]
+                queue.append(child)
+        self.dirty = False
+
+    def search(self, text):
+        with self.lock:
+            if self.dirty:
+                self.relink()
+            goto, fail, out, link, patterns = self.goto, self.fail, self.out, self.link, self.patterns
+            node = 0
+            found = []
+            for end, char in enumerate(text):
+                while True:
+                    next_node = goto[node].get(char)
+                    if next_node is not None:
+                        node = next_node
+                        break
+                    if not node:
+                        break
+                    node = fail[node]
+                hit = node
+                while hit:
+                    for kind, action in out[hit].items():
+                        found.append((end, (kind, patterns[hit], action)))
+                    hit = link[hit]
+        return found
+
+    def size(self):
+        return len(self.terminals)
+
+
+def bounded(text, kind, start, end):
+    # Совпадение внутри другого слова или домена не считается: "class" не попадает под "ass"
+    if kind == 'invite':
+        return True
+    inner = word_char if kind == 'word' else host_char
+    if start > 0 and inner(text[start - 1]):
+        return False
+    return end + 1 >= len(text) or not inner(text[end + 1])
+
+
+class ContentFilter:
+    def __init__(self, logic, limit=None):
+        self.logic = logic
+        self.limit = limit or config.FILTER_CACHE_LIMIT
+        self.lock = threading.Lock()
+        # chat_id -> Automaton или None, если у чата нет правил
+        self.chats = OrderedDict()
+        # Растет под self.lock при каждом add/remove: так automaton() видит записи, пока читал базу
+        self.writes = 0
+
+    def cached(self, chat_id):
+        return chat_id in self.chats
+
+    def automaton(self, chat_id):
+        if chat_id in self.chats:
+            cache_hit('filters', True)
+            return self.chats[chat_id]
+        cache_hit('filters', False)
+        with self.lock:
+            writes = self.writes
+        automaton = self.build(chat_id)
+        with self.lock:
+            if self.writes != writes and chat_id not in self.chats:
+                # Пока читали базу, правила меняли, а чата в кэше еще не было — эти записи
+                # никуда не применились. Перечитываем под self.lock, чтобы новых не случилось
+                automaton = self.build(chat_id)
+            automaton = self.chats.setdefault(chat_id, automaton)
+            self.chats.move_to_end(chat_id)
+            while len(self.chats) > self.limit:
+                self.chats.popitem(last=False)
+        return automaton
+
+    def build(self, chat_id):
+        rules = self.logic.storage.get_filters(chat_id)
+        if not rules:
+            return None
+        automaton = Automaton()
+        with automaton.lock:
+            for kind, pattern, action in rules:
+                automaton.add(kind, pattern, action)
+        return automaton
+
+    def match(self, chat_id, text):
+        if not text:
+            return None
+        automaton = self.automaton(chat_id)
+        if automaton is None:
+            return None
+        # Шаблоны хранятся в нижнем регистре с одиночными пробелами, текст приводим так же
+        text = ' '.join(text.lower().split())
+        best = None
+        for end, (kind, pattern, action) in automaton.search(text):
+            if not bounded(text, kind, end - len(pattern) + 1, end):
+                continue
+            if best is None or ACTIONS[action] > ACTIONS[best[2]]:
+                best = (kind, pattern, action)
+        return best
+
+    def count(self, chat_id):
+        automaton = self.automaton(chat_id)
+        return automaton.size() if automaton else 0
+
+    def add(self, chat_id, kind, pattern, action):
+        self.logic.storage.add_filter(chat_id, kind, pattern, action)
+        with self.lock:
+            self.writes += 1
+            automaton = self.chats.get(chat_id)
+            if chat_id in self.chats and automaton is None:
+                automaton = self.chats[chat_id] = Automaton()
+        if automaton is not None:
+            with automaton.lock:
+                automaton.add(kind, pattern, action)
+
+    def remove(self, chat_id, pattern):
+        removed = self.logic.storage.remove_filter(chat_id, pattern)
+        with self.lock:
+            self.writes += 1
+            automaton = self.chats.get(chat_id)
+        if removed and automaton is not None:
+            with automaton.lock:
+                for kind in KINDS:
+                    automaton.remove(kind, pattern)
+                # Удаленных узлов больше, чем живых правил: проще собрать автомат заново
+                stale = automaton.removed > max(automaton.size(), 100)
+            if stale:
+                with self.lock:
+                    self.chats.pop(chat_id, None)
+        return removed
@@ -0,0 +1,103 @@
+import threading
+import time
+from collections import OrderedDict
+
+import config
+
+
+class ReportDigest:
+    def __init__(self, notify, interval=None, urgent=None, window=None, limit=None):
+        # notify(text) рассылает текст всем админам из ADMIN_IDS
+        self.notify = notify
+        self.interval = config.REPORT_DIGEST_INTERVAL if interval is None else interval
+        self.urgent = urgent or config.REPORT_URGENT_COMPLAINTS
+        self.window = window or config.REPORT_DEDUP_WINDOW
+        self.limit = limit or config.REPORT_DIGEST_LIMIT
+        self.lock = threading.Lock()
+        # report_id -> [chat_id, название чата, на кого, причина, новых жалоб, всего жалоб]
+        self.pending = OrderedDict()
+        # (chat_id, reported_id, message_id, reporter_id) -> время жалобы, от старых к новым
+        self.reporters = OrderedDict()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.running = False
+
+    def complained(self, chat_id, reported_id, message_id, reporter_id, now=None):
+        # True — этот человек уже жаловался на это сообщение в пределах окна, счетчик не растет
+        now = now or time.monotonic()
+        key = (chat_id, reported_id, message_id, reporter_id)
+        with self.lock:
+            while self.reporters:
+                oldest, at = next(iter(self.reporters.items()))
+                if now - at < self.window:
+                    break
+                del self.reporters[oldest]
+            if key in self.reporters:
+                return True
+            self.reporters[key] = now
+            return False
+
+    def add(self, report_id, complaints, chat_id, chat, reported, reason):
+        # Сразу уходят репорты, набравшие urgent жалоб, и все репорты при interval = 0
+        if not self.interval or complaints == self.urgent:
+            with self.lock:
+                self.pending.pop(report_id, None)
+            if complaints == 1:
+                title = f"🚨 Новый репорт #{report_id}"
+            else:
+                title = f"🚨 Репорт #{report_id}: жалоб {complaints}"
+            self.notify(f"{title}\nЧат: {chat}\nНа кого: {reported}\nПричина: {reason}")
+            return
+        with self.lock:
+            entry = self.pending.get(report_id)
+            if entry is None:
+                entry = self.pending[report_id] = [chat_id, chat, reported, reason, 0, complaints]
+            entry[4] += 1
+            entry[5] = complaints
+            if self.thread is None:
+                self.start()
+
+    def render(self, pending):
+        total = sum(entry[4] for entry in pending.values())
+        chats = OrderedDict()
+        for report_id, entry in pending.items():
+            chats.setdefault(entry[0], []).append((report_id, entry))
+        text = f"📬 Сводка репортов: новых жалоб {total}, репортов {len(pending)}\n"
+        shown = 0
+        for reports in chats.values():
+            if shown >= self.limit:
+                break
+            text += f"\nЧат: {reports[0][1][1]}\n"
+            for report_id, (_, _, reported, reason, new, complaints) in reports[:self.limit - shown]:
+                text += f"#{report_id} {reported} — жалоб: {complaints} (+{new}), {reason[:40]}\n"
+                shown += 1
+        if shown < len(pending):
+            text += f"\n…и еще {len(pending) - shown}\n"
+        return text + "\nПодробнее: /reports в чате"
+
+    def start(self):
+        # Вызывается под self.lock при первом репорте
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='report-digest', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while self.running:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, OrderedDict()
+        if pending:
+            self.notify(self.render(pending))
+
+    def stop(self):
+        with self.lock:
+            thread, self.thread = self.thread, None
+            self.running = False
+        if thread:
+            self.wakeup.set()
+            thread.join()
+        self.flush()
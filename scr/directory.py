@@ -0,0 +1,141 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import config
+
+
+class UserDirectory:
+    def __init__(self, logic, limit=None, interval=None, max_pending=None):
+        self.logic = logic
+        self.limit = limit or config.USERS_CACHE_LIMIT
+        self.interval = interval or config.USERS_FLUSH_INTERVAL
+        self.max_pending = max_pending or config.USERS_FLUSH_MAX
+        # Хранилищу без пакетной записи буфер не нужен, пишем сразу
+        self.batching = logic.storage.batching
+        self.lock = threading.Lock()
+        # username в нижнем регистре -> user_id, последний увиденный владелец имени
+        self.names = OrderedDict()
+        # user_id -> username в нижнем регистре, чтобы снимать старое имя при смене
+        self.ids = {}
+        # (user_id, chat_id) -> username: уже записанные строки, повторно не пишем
+        self.rows = OrderedDict()
+        # (user_id, chat_id) -> [username, first_name, сообщений, последнее сообщение, вход в чат],
+        # копятся в памяти и пишутся одним UPSERT
+        self.pending = {}
+        # user_id -> (username, first_name) из последнего seen среди pending: имя одно на все чаты
+        self.renames = {}
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.running = False
+
+    def seen(self, user_id, chat_id, username, first_name, message=False, joined=False):
+        # message=True — пользователь сам написал, joined=True — вошел в чат, иначе его только упомянули
+        key = (user_id, chat_id)
+        name = username.lower() if username else None
+        with self.lock:
+            entry = self.pending.get(key)
+            if message or joined:
+                if entry is None:
+                    entry = self.pending[key] = [username, first_name, 0, None, None]
+                if message:
+                    entry[2] += 1
+                    entry[3] = time.time()
+                if joined:
+                    entry[4] = time.time()
+            if key in self.rows and self.rows[key] == name:
+                self.rows.move_to_end(key)
+            else:
+                self.remember(user_id, name)
+                self.rows[key] = name
+                self.rows.move_to_end(key)
+                while len(self.rows) > self.limit:
+                    self.rows.popitem(last=False)
+                if entry is None:
+                    entry = self.pending[key] = [username, first_name, 0, None, None]
+            if entry is not None:
+                # Пользователь мог сменить имя, пока строка ждет записи
+                entry[0], entry[1] = username, first_name
+                self.renames[user_id] = (username, first_name)
+            full = len(self.pending) >= self.max_pending
+            if self.thread is None and self.batching:
+                self.start()
+        if not self.batching:
+            self.flush()
+        elif full:
+            self.wakeup.set()
+
+    def remember(self, user_id, name):
+        # Вызывается под self.lock
+        old = self.ids.get(user_id)
+        if old and old != name and self.names.get(old) == user_id:
+            del self.names[old]
+        if not name:
+            self.ids.pop(user_id, None)
+            return
+        self.ids[user_id] = name
+        self.names[name] = user_id
+        self.names.move_to_end(name)
+        while len(self.names) > self.limit:
+            evicted, evicted_id = self.names.popitem(last=False)
+            if self.ids.get(evicted_id) == evicted:
+                del self.ids[evicted_id]
+
+    def resolve(self, username, chat_id=None):
+        name = username.lower()
+        user_id = self.names.get(name)
+        if user_id is not None:
+            return user_id
+        # Смена имени могла еще не дойти до базы: в памяти у пользователя уже другое имя
+        rows = [row for row in self.logic.storage.find_username(username) if self.ids.get(row[0], name) == name]
+        # Одно имя в разных чатах у разных людей: сначала текущий чат, иначе только однозначный ответ
+        for row_user_id, row_chat_id in rows:
+            if row_chat_id == chat_id:
+                user_id = row_user_id
+                break
+        else:
+            candidates = {row_user_id for row_user_id, _ in rows}
+            if len(candidates) != 1:
+                return None
+            user_id = candidates.pop()
+        with self.lock:
+            if self.ids.get(user_id, name) == name:
+                self.remember(user_id, name)
+        return user_id
+
+    def start(self):
+        # Вызывается под self.lock при первой записи
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='user-directory', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while self.running:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            renames, self.renames = self.renames, {}
+        if not pending:
+            return
+        rows = [
+            (user_id, chat_id, username, first_name, count,
+             datetime.fromtimestamp(last).isoformat() if last else None,
+             datetime.fromtimestamp(joined).isoformat() if joined else None)
+            for (user_id, chat_id), (username, first_name, count, last, joined) in pending.items()
+        ]
+        # Имя у пользователя одно на все чаты; у прежнего владельца имени оно стирается
+        self.logic.count_members(self.logic.storage.record_activity(rows, renames))
+
+    def stop(self):
+        with self.lock:
+            thread, self.thread = self.thread, None
+            self.running = False
+        if thread:
+            self.wakeup.set()
+            thread.join()
+        self.flush()
@@ -0,0 +1,130 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class FakeBotAPI:
+    def __init__(self, host='127.0.0.1', port=0, flood_every=0, retry_after=1, latency=0):
+        self.flood_every = flood_every
+        self.retry_after = retry_after
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.calls = []
+        self.floods = 0
+        self.message_id = 0
+        self.updates = []
+        # id, которые getChatAdministrators отдает админами любого чата
+        self.chat_admins = []
+        # id, на которые бан и ограничения отвечают 400, как на ушедших из чата
+        self.missing_users = set()
+        self.server = ThreadingHTTPServer((host, port), self.handler_class())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/bot{{0}}/{{1}}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name='fake-api', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset(self):
+        with self.lock:
+            self.calls = []
+            self.floods = 0
+
+    def count(self, method=None):
+        with self.lock:
+            if method is None:
+                return len(self.calls)
+            return sum(1 for call in self.calls if call[1] == method)
+
+    def handler_class(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.handle_call()
+
+            def do_POST(self):
+                self.handle_call()
+
+            def handle_call(self):
+                url = urlparse(self.path)
+                method = url.path.rsplit('/', 1)[-1]
+                params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                length = int(self.headers.get('Content-Length') or 0)
+                if length:
+                    body = self.rfile.read(length).decode()
+                    if self.headers.get('Content-Type', '').startswith('application/json'):
+                        params.update(json.loads(body))
+                    else:
+                        params.update({key: values[0] for key, values in parse_qs(body).items()})
+                status, payload = api.respond(method, params)
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def respond(self, method, params):
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            flood = self.flood_every and (len(self.calls) + 1) % self.flood_every == 0
+            self.calls.append((time.monotonic(), method, params, 429 if flood else 200))
+            if flood:
+                self.floods += 1
+                return 429, {
+                    'ok': False,
+                    'error_code': 429,
+                    'description': f"Too Many Requests: retry after {self.retry_after}",
+                    'parameters': {'retry_after': self.retry_after},
+                }
+            self.message_id += 1
+            message_id = self.message_id
+        if method in ('banChatMember', 'restrictChatMember', 'unbanChatMember') and int(params.get('user_id', 0)) in self.missing_users:
+            return 400, {'ok': False, 'error_code': 400, 'description': "Bad Request: user not found"}
+        if method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Admin Bot', 'username': 'admin_bot'}
+        elif method == 'getUpdates':
+            offset = int(params.get('offset') or 0)
+            limit = int(params.get('limit') or 100)
+            with self.lock:
+                self.updates = [update for update in self.updates if update['update_id'] >= offset]
+                result = self.updates[:limit]
+        elif method == 'getChatAdministrators':
+            result = [
+                {
+                    'status': 'creator',
+                    'is_anonymous': False,
+                    'user': {'id': user_id, 'is_bot': False, 'first_name': f"admin{user_id}"},
+                }
+                for user_id in self.chat_admins
+            ]
+        elif method == 'sendMessage':
+            chat_id = int(params.get('chat_id', 0))
+            result = {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'supergroup' if chat_id < 0 else 'private'},
+                'text': params.get('text', ''),
+            }
+        else:
+            result = True
+        return 200, {'ok': True, 'result': result}
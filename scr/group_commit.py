@@ -0,0 +1,87 @@
+import threading
+import time
+from concurrent.futures import Future
+
+
+class GroupCommit:
+    def __init__(self, conn, lock, interval=0.005, max_ops=100):
+        self.conn = conn
+        self.lock = lock
+        self.interval = interval
+        self.max_ops = max_ops
+        self.cond = threading.Condition()
+        self.future = Future()
+        self.ops = 0
+        self.first_op = None
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='group-commit', daemon=True)
+        self.thread.start()
+
+    def submit(self):
+        # Вызывается под self.lock сразу после записи, возвращает future текущей пачки
+        with self.cond:
+            if self.ops == 0:
+                self.first_op = time.monotonic()
+            self.ops += 1
+            future = self.future
+            if self.ops == 1 or self.ops >= self.max_ops:
+                self.cond.notify()
+            return future
+
+    def pending(self):
+        with self.cond:
+            if self.ops == 0:
+                future = Future()
+                future.set_result(True)
+                return future
+            return self.future
+
+    def run(self):
+        while True:
+            with self.cond:
+                while self.running and self.ops == 0:
+                    self.cond.wait()
+                while self.running and self.ops < self.max_ops:
+                    remaining = self.first_op + self.interval - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+                if not self.running and self.ops == 0:
+                    return
+            self.commit()
+
+    def commit(self):
+        with self.lock:
+            with self.cond:
+                future = self.future
+                ops = self.ops
+                self.future = Future()
+                self.ops = 0
+            if not ops:
+                return
+            try:
+                self.conn.commit()
+            except Exception as e:
+                future.set_exception(e)
+                return
+        future.set_result(True)
+
+    def abort(self, error):
+        # Вызывается под self.lock после rollback: записи текущей пачки потеряны
+        with self.cond:
+            future = self.future
+            ops = self.ops
+            self.future = Future()
+            self.ops = 0
+        if ops:
+            future.set_exception(error)
+
+    def flush(self):
+        self.commit()
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        self.thread.join()
+        self.commit()
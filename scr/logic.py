@@ -1,50 +1,101 @@
-import sqlite3
 import re
 from datetime import datetime, timedelta
 import json
+import config
+from metrics import cache_hit
+from scheduler import ExpiryScheduler
+from directory import UserDirectory
+from content_filter import ContentFilter
+from audit import AuditJournal
+from chatstats import ChatCounters
+from sharding import shard_of
+from storage import open_storage
 
 class BotLogic:
-    def __init__(self):
-        self.conn = sqlite3.connect('./scr/bot.db', check_same_thread=False)
-        self.create_tables()
+    def __init__(self, db_path=None, group_commit=None, shard=None, storage=None):
+        # Хранилище выбирается в config.STORAGE_BACKEND, кэши и расписание живут здесь
+        self.storage = storage or open_storage(db_path=db_path, group_commit=group_commit)
+        self.shard = shard or config.SHARD
+        self.bot_id = None
+        self.admins = None
+        self.chats = {}
+        self.muted = {}
+        self.load_muted()
+        self.scheduler = ExpiryScheduler(self)
+        self.directory = UserDirectory(self)
+        self.filters = ContentFilter(self)
+        self.audit = AuditJournal(self.storage)
+        self.counters = ChatCounters(self)
     
-    def create_tables(self):
-        cursor = self.conn.cursor()
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS chats (
-                chat_id INTEGER PRIMARY KEY,
-                welcome_enabled INTEGER DEFAULT 1
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER,
-                chat_id INTEGER,
-                username TEXT,
-                first_name TEXT,
-                warns INTEGER DEFAULT 0,
-                is_muted INTEGER DEFAULT 0,
-                mute_until TEXT,
-                is_banned INTEGER DEFAULT 0,
-                PRIMARY KEY (user_id, chat_id)
-            )
-        ''')
+    def durable(self):
+        return self.storage.durable()
+    
+    def owns(self, chat_id):
+        # В шардированном режиме процесс держит в памяти и расписании только свои чаты
+        return self.shard is None or shard_of(chat_id, self.shard[1]) == self.shard[0]
+    
+    def load_muted(self):
+        for user_id, chat_id, mute_until in self.storage.load_muted():
+            if not self.owns(chat_id):
+                continue
+            self.muted[(user_id, chat_id)] = datetime.fromisoformat(mute_until) if mute_until else None
+    
+    def load_expiries(self):
+        return [row for row in self.storage.load_expiries() if self.owns(row[2])]
+    
+    def expire(self, items):
+        now = datetime.now().isoformat()
+        mutes = [(user_id, chat_id, now) for kind, user_id, chat_id in items if kind == 'mute']
+        bans = [(user_id, chat_id, now) for kind, user_id, chat_id in items if kind == 'ban']
+        self.storage.expire(mutes, bans)
+        for kind, user_id, chat_id in items:
+            self.audit.record('unmute' if kind == 'mute' else 'unban', chat_id, None, user_id, details="срок истек")
+        for user_id, chat_id, _ in mutes:
+            mute_until = self.muted.get((user_id, chat_id))
+            if mute_until and mute_until <= datetime.now():
+                del self.muted[(user_id, chat_id)]
+                self.counters.change(chat_id, 'muted', -1)
+        for user_id, chat_id, _ in bans:
+            self.counters.change(chat_id, 'banned', -1)
+    
+    def get_bot_id(self, bot):
+        if self.bot_id is None:
+            self.bot_id = bot.get_me().id
+        return self.bot_id
+    
+    def is_admin(self, user_id, chat_id=None):
+        # ADMIN_IDS — суперпользователи во всех чатах, остальных проверяем по админам группы
+        if user_id in config.ADMIN_IDS:
+            return True
+        return chat_id is not None and chat_id < 0 and self.admins is not None and self.admins.is_admin(chat_id, user_id)
+    
+    def extract_user_info(self, message):
+        if message.reply_to_message:
+            user = message.reply_to_message.from_user
+            return user.id, user.username or user.first_name
         
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS reports (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                chat_id INTEGER,
-                reporter_id INTEGER,
-                reported_id INTEGER,
-                reason TEXT,
-                status TEXT DEFAULT 'pending',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+        parts = message.text.split()
+        if len(parts) > 1:
+            for part in parts[1:]:
+                if part.startswith('@'):
+                    return self.directory.resolve(part[1:], message.chat.id), part[1:]
+                elif part.isdigit():
+                    return int(part), None
         
-        self.conn.commit()
+        return None, None
+    
+    def see_message(self, message):
+        # Автор, тот, кому ответили, и вошедшие попадают в индекс @username -> id
+        users = [message.from_user]
+        if message.reply_to_message:
+            users.append(message.reply_to_message.from_user)
+        if message.new_chat_members:
+            users.extend(message.new_chat_members)
+        joined = message.new_chat_members or ()
+        for user in users:
+            if user and not user.is_bot:
+                self.directory.seen(user.id, message.chat.id, user.username, user.first_name,
+                                    user is message.from_user, user in joined)
     
     def parse_time(self, time_str):
         time_str = time_str.lower().strip()
@@ -84,170 +135,270 @@ class BotLogic:
         return f"{seconds} секунд"
     
     def add_chat(self, chat_id):
-        cursor = self.conn.cursor()
+        if chat_id in self.chats:
+            return True
         try:
-            cursor.execute(
-                "INSERT OR IGNORE INTO chats (chat_id) VALUES (?)",
-                (chat_id,)
-            )
-            self.conn.commit()
+            self.storage.add_chat(chat_id)
             return True
         except:
             return False
     
     def get_chat(self, chat_id):
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT * FROM chats WHERE chat_id = ?", (chat_id,))
-        return cursor.fetchone()
+        if chat_id in self.chats:
+            cache_hit('chats', True)
+            return self.chats[chat_id]
+        cache_hit('chats', False)
+        chat = self.storage.get_chat(chat_id)
+        if chat:
+            self.chats[chat_id] = chat
+        return chat
     
     def toggle_welcome(self, chat_id):
-        cursor = self.conn.cursor()
-        cursor.execute(
-            "UPDATE chats SET welcome_enabled = NOT welcome_enabled WHERE chat_id = ?",
-            (chat_id,)
-        )
-        self.conn.commit()
-        return cursor.rowcount > 0
+        welcome_enabled = self.storage.toggle_welcome(chat_id)
+        self.chats.pop(chat_id, None)
+        if welcome_enabled is None:
+            return False
+        self.chats[chat_id] = (chat_id, welcome_enabled)
+        return True
     
     def add_user(self, user_id, chat_id, username, first_name):
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            INSERT OR REPLACE INTO users 
-            (user_id, chat_id, username, first_name, warns, is_muted, is_banned) 
-            VALUES (?, ?, ?, ?, COALESCE((SELECT warns FROM users WHERE user_id=? AND chat_id=?), 0), 
-            COALESCE((SELECT is_muted FROM users WHERE user_id=? AND chat_id=?), 0),
-            COALESCE((SELECT is_banned FROM users WHERE user_id=? AND chat_id=?), 0))
-        ''', (user_id, chat_id, username, first_name, user_id, chat_id, user_id, chat_id, user_id, chat_id))
-        self.conn.commit()
+        self.add_users([(user_id, chat_id, username, first_name)])
+    
+    def add_users(self, users):
+        self.count_members(self.storage.add_users(users))
+    
+    def count_members(self, added):
+        # added: chat_id -> сколько строк users появилось
+        for chat_id, count in added.items():
+            if self.owns(chat_id):
+                self.counters.change(chat_id, 'members', count)
+    
+    def get_inactive_users(self, chat_id, seconds, limit):
+        # Свежая активность еще может лежать в буфере
+        self.directory.flush()
+        since = (datetime.now() - timedelta(seconds=seconds)).isoformat()
+        return self.storage.get_inactive_users(chat_id, since, limit)
+    
+    def get_recent_joins(self, chat_id, seconds, limit):
+        # Входы тоже копятся в буфере UserDirectory
+        self.directory.flush()
+        since = (datetime.now() - timedelta(seconds=seconds)).isoformat()
+        return self.storage.get_recent_joins(chat_id, since, limit)
     
     def get_user(self, user_id, chat_id):
-        cursor = self.conn.cursor()
-        cursor.execute(
-            "SELECT * FROM users WHERE user_id = ? AND chat_id = ?",
-            (user_id, chat_id)
-        )
-        return cursor.fetchone()
+        return self.storage.get_user(user_id, chat_id)
     
-    def add_warn(self, user_id, chat_id):
-        cursor = self.conn.cursor()
-        cursor.execute(
-            "UPDATE users SET warns = warns + 1 WHERE user_id = ? AND chat_id = ?",
-            (user_id, chat_id)
-        )
-        self.conn.commit()
-        cursor.execute(
-            "SELECT warns FROM users WHERE user_id = ? AND chat_id = ?",
-            (user_id, chat_id)
-        )
-        result = cursor.fetchone()
-        return result[0] if result else 0
-    
-    def remove_warn(self, user_id, chat_id):
-        cursor = self.conn.cursor()
-        cursor.execute(
-            "UPDATE users SET warns = GREATEST(warns - 1, 0) WHERE user_id = ? AND chat_id = ?",
-            (user_id, chat_id)
-        )
-        self.conn.commit()
-        cursor.execute(
-            "SELECT warns FROM users WHERE user_id = ? AND chat_id = ?",
-            (user_id, chat_id)
-        )
-        result = cursor.fetchone()
-        return result[0] if result else 0
-    
-    def reset_warns(self, user_id, chat_id):
-        cursor = self.conn.cursor()
-        cursor.execute(
-            "UPDATE users SET warns = 0 WHERE user_id = ? AND chat_id = ?",
-            (user_id, chat_id)
-        )
-        self.conn.commit()
+    # actor_id — кто выполнил действие, для журнала; None — сам бот, reason пишется в подробности
+    def add_warn(self, user_id, chat_id, actor_id=None, reason=None):
+        warns = self.storage.add_warn(user_id, chat_id)
+        self.audit.record('warn', chat_id, actor_id, user_id, details=reason)
+        self.counters.change(chat_id, 'warns_today', 1)
+        return warns
+    
+    def remove_warn(self, user_id, chat_id, actor_id=None):
+        warns = self.storage.remove_warn(user_id, chat_id)
+        self.audit.record('unwarn', chat_id, actor_id, user_id)
+        return warns
+    
+    def reset_warns(self, user_id, chat_id, actor_id=None):
+        self.storage.reset_warns(user_id, chat_id)
+        self.audit.record('reset_warns', chat_id, actor_id, user_id)
         return True
     
-    def mute_user(self, user_id, chat_id, duration_seconds):
-        mute_until = (datetime.now() + timedelta(seconds=duration_seconds)).isoformat()
-        cursor = self.conn.cursor()
-        cursor.execute(
-            "UPDATE users SET is_muted = 1, mute_until = ? WHERE user_id = ? AND chat_id = ?",
-            (mute_until, user_id, chat_id)
-        )
-        self.conn.commit()
+    def mute_user(self, user_id, chat_id, duration_seconds, actor_id=None, reason=None):
+        # Бессрочный мут, как и бан, хранится без срока и в расписание не попадает
+        duration = duration_seconds if duration_seconds < 315360000 else None
+        mute_until = datetime.now() + timedelta(seconds=duration) if duration else None
+        if self.storage.set_muted(user_id, chat_id, mute_until.isoformat() if mute_until else None):
+            # Кэш мутов полный, по нему видно, был ли пользователь уже в муте
+            if (user_id, chat_id) not in self.muted:
+                self.counters.change(chat_id, 'muted', 1)
+            self.muted[(user_id, chat_id)] = mute_until
+            if mute_until:
+                self.scheduler.schedule('mute', user_id, chat_id, mute_until)
+            else:
+                self.scheduler.cancel('mute', user_id, chat_id)
+        self.audit.record('mute', chat_id, actor_id, user_id, duration, reason)
         return True
     
-    def unmute_user(self, user_id, chat_id):
-        cursor = self.conn.cursor()
-        cursor.execute(
-            "UPDATE users SET is_muted = 0, mute_until = NULL WHERE user_id = ? AND chat_id = ?",
-            (user_id, chat_id)
-        )
-        self.conn.commit()
+    def unmute_user(self, user_id, chat_id, actor_id=None):
+        self.storage.clear_muted(user_id, chat_id)
+        self.audit.record('unmute', chat_id, actor_id, user_id)
+        if (user_id, chat_id) in self.muted:
+            self.counters.change(chat_id, 'muted', -1)
+        self.muted.pop((user_id, chat_id), None)
+        self.scheduler.cancel('mute', user_id, chat_id)
         return True
     
     def is_muted(self, user_id, chat_id):
-        cursor = self.conn.cursor()
-        cursor.execute(
-            "SELECT is_muted, mute_until FROM users WHERE user_id = ? AND chat_id = ?",
-            (user_id, chat_id)
-        )
-        result = cursor.fetchone()
-        if result and result[0] == 1:
-            if result[1]:  # Если есть время окончания
-                mute_until = datetime.fromisoformat(result[1])
-                if mute_until > datetime.now():
-                    return True
-                else:
-                    self.unmute_user(user_id, chat_id)
-                    return False
-            return True
-        return False
+        # Кэш мутов держится в памяти, в базу за ним не ходим
+        if (user_id, chat_id) not in self.muted:
+            return False
+        # Истекшие муты снимает ExpiryScheduler, здесь только сравниваем время
+        mute_until = self.muted[(user_id, chat_id)]
+        return mute_until is None or mute_until > datetime.now()
     
-    def ban_user(self, user_id, chat_id):
-        cursor = self.conn.cursor()
-        cursor.execute(
-            "UPDATE users SET is_banned = 1 WHERE user_id = ? AND chat_id = ?",
-            (user_id, chat_id)
-        )
-        self.conn.commit()
+    def get_mute_until(self, user_id, chat_id):
+        # Срок больше года Telegram все равно считает бессрочным
+        mute_until = self.muted.get((user_id, chat_id))
+        if mute_until is None or mute_until - datetime.now() > timedelta(days=366):
+            return None
+        return mute_until
+    
+    def ban_user(self, user_id, chat_id, duration_seconds=None, actor_id=None, reason=None):
+        ban_until = None
+        if duration_seconds and duration_seconds < 315360000:
+            ban_until = (datetime.now() + timedelta(seconds=duration_seconds)).isoformat()
+        # None — пользователя нет в чате, иначе был ли он уже забанен
+        banned = self.storage.set_banned(user_id, chat_id, ban_until)
+        if banned is not None and ban_until:
+            self.scheduler.schedule('ban', user_id, chat_id, datetime.fromisoformat(ban_until))
+        else:
+            self.scheduler.cancel('ban', user_id, chat_id)
+        if banned == 0:
+            self.counters.change(chat_id, 'banned', 1)
+        duration = duration_seconds if ban_until else None
+        self.audit.record('ban', chat_id, actor_id, user_id, duration, reason)
         return True
     
-    def unban_user(self, user_id, chat_id):
-        cursor = self.conn.cursor()
-        cursor.execute(
-            "UPDATE users SET is_banned = 0 WHERE user_id = ? AND chat_id = ?",
-            (user_id, chat_id)
-        )
-        self.conn.commit()
+    def unban_user(self, user_id, chat_id, actor_id=None):
+        if self.storage.clear_banned(user_id, chat_id):
+            self.counters.change(chat_id, 'banned', -1)
+        self.scheduler.cancel('ban', user_id, chat_id)
+        self.audit.record('unban', chat_id, actor_id, user_id)
+        return True
+    
+    # Массовые варианты: одна транзакция на весь список, кэш, расписание и журнал — как у одиночных
+    def warn_users(self, user_ids, chat_id, actor_id=None, reason=None):
+        warns, added = self.storage.warn_many(chat_id, user_ids)
+        self.count_members(added)
+        for user_id in user_ids:
+            self.audit.record('warn', chat_id, actor_id, user_id, details=reason)
+        self.counters.change(chat_id, 'warns_today', len(user_ids))
+        return warns
+    
+    def mute_users(self, user_ids, chat_id, duration_seconds, actor_id=None, reason=None):
+        duration = duration_seconds if duration_seconds < 315360000 else None
+        mute_until = datetime.now() + timedelta(seconds=duration) if duration else None
+        self.count_members(self.storage.mute_many(chat_id, user_ids, mute_until.isoformat() if mute_until else None))
+        self.counters.change(chat_id, 'muted', sum(1 for user_id in user_ids if (user_id, chat_id) not in self.muted))
+        for user_id in user_ids:
+            self.muted[(user_id, chat_id)] = mute_until
+            if mute_until:
+                self.scheduler.schedule('mute', user_id, chat_id, mute_until)
+            else:
+                self.scheduler.cancel('mute', user_id, chat_id)
+            self.audit.record('mute', chat_id, actor_id, user_id, duration, reason)
         return True
     
+    def unmute_users(self, user_ids, chat_id, actor_id=None, reason=None):
+        self.storage.unmute_many(chat_id, user_ids)
+        self.counters.change(chat_id, 'muted', -sum(1 for user_id in user_ids if (user_id, chat_id) in self.muted))
+        for user_id in user_ids:
+            self.muted.pop((user_id, chat_id), None)
+            self.scheduler.cancel('mute', user_id, chat_id)
+            self.audit.record('unmute', chat_id, actor_id, user_id, details=reason)
+        return True
+    
+    def ban_users(self, user_ids, chat_id, duration_seconds=None, actor_id=None, reason=None):
+        ban_until = None
+        if duration_seconds and duration_seconds < 315360000:
+            ban_until = datetime.now() + timedelta(seconds=duration_seconds)
+        banned, added = self.storage.ban_many(chat_id, user_ids, ban_until.isoformat() if ban_until else None)
+        self.count_members(added)
+        self.counters.change(chat_id, 'banned', banned)
+        for user_id in user_ids:
+            if ban_until:
+                self.scheduler.schedule('ban', user_id, chat_id, ban_until)
+            else:
+                self.scheduler.cancel('ban', user_id, chat_id)
+            self.audit.record('ban', chat_id, actor_id, user_id, duration_seconds if ban_until else None, reason)
+        return True
+    
+    def unban_users(self, user_ids, chat_id, actor_id=None, reason=None):
+        unbanned = self.storage.unban_many(chat_id, user_ids)
+        self.counters.change(chat_id, 'banned', -unbanned)
+        for user_id in user_ids:
+            self.scheduler.cancel('ban', user_id, chat_id)
+            self.audit.record('unban', chat_id, actor_id, user_id, details=reason)
+        return True
+    
+    def match_filter(self, chat_id, text):
+        # (kind, pattern, action) самого строгого сработавшего правила или None
+        return self.filters.match(chat_id, text)
+    
+    def count_filters(self, chat_id):
+        return self.filters.count(chat_id)
+    
+    def get_filters(self, chat_id):
+        return sorted(self.storage.get_filters(chat_id))
+    
+    def add_filter(self, chat_id, kind, pattern, action):
+        self.filters.add(chat_id, kind, pattern, action)
+    
+    def remove_filter(self, chat_id, pattern):
+        return self.filters.remove(chat_id, pattern) > 0
+    
     def add_report(self, chat_id, reporter_id, reported_id, reason):
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            INSERT INTO reports (chat_id, reporter_id, reported_id, reason)
-            VALUES (?, ?, ?, ?)
-        ''', (chat_id, reporter_id, reported_id, reason))
-        self.conn.commit()
-        return cursor.lastrowid
+        report_id = self.storage.add_report(chat_id, reporter_id, reported_id, reason)
+        self.audit.record('report', chat_id, reporter_id, reported_id, details=f"#{report_id} {reason}")
+        self.counters.change(chat_id, 'reports', 1)
+        return report_id
+    
+    def file_report(self, chat_id, reporter_id, reported_id, reason, message_id):
+        # (id репорта, жалоб в нем): повтор на то же сообщение не создает новую строку
+        report_id, complaints = self.storage.file_report(
+            chat_id, reporter_id, reported_id, reason, message_id, config.REPORT_DEDUP_WINDOW
+        )
+        self.audit.record('report', chat_id, reporter_id, reported_id, details=f"#{report_id} {reason}")
+        if complaints == 1:
+            self.counters.change(chat_id, 'reports', 1)
+        return report_id, complaints
     
     def get_pending_reports(self, chat_id=None):
-        cursor = self.conn.cursor()
-        if chat_id:
-            cursor.execute(
-                "SELECT * FROM reports WHERE status = 'pending' AND chat_id = ? ORDER BY created_at",
-                (chat_id,)
-            )
-        else:
-            cursor.execute("SELECT * FROM reports WHERE status = 'pending' ORDER BY created_at")
-        return cursor.fetchall()
+        return self.storage.get_pending_reports(chat_id)
     
-    def mark_report_resolved(self, report_id):
-        cursor = self.conn.cursor()
-        cursor.execute(
-            (report_id,)
-        )
-        self.conn.commit()
+    def get_report_groups(self, chat_id, after=None, before=None, limit=5):
+        return self.storage.get_report_groups(chat_id, after, before, limit)
+    
+    def mark_report_resolved(self, report_id, chat_id=None, actor_id=None):
+        # chat_id=None — репорт любого чата; журнал и счетчики берут чат из самого репорта
+        report_chat_id = self.storage.mark_report_resolved(report_id, chat_id)
+        if report_chat_id is None:
+            return False
+        self.audit.record('resolve', report_chat_id, actor_id, None, details=f"#{report_id}")
+        if self.owns(report_chat_id):
+            self.counters.change(report_chat_id, 'reports', -1)
         return True
     
+    def resolve_reports_against(self, chat_id, reported_id, actor_id=None):
+        count = self.storage.resolve_reports_against(chat_id, reported_id)
+        if count:
+            self.audit.record('resolve', chat_id, actor_id, reported_id, details=f"репортов: {count}")
+            self.counters.change(chat_id, 'reports', -count)
+        return count
+    
+    def resolve_reports_older(self, chat_id, seconds=None, actor_id=None):
+        count = self.storage.resolve_reports_older(chat_id, seconds)
+        if count:
+            older = f", старше {self.format_time(seconds)}" if seconds else ""
+            self.audit.record('resolve', chat_id, actor_id, None, details=f"репортов: {count}{older}")
+            self.counters.change(chat_id, 'reports', -count)
+        return count
+    
+    def get_audit(self, chat_id, seconds=None, target_id=None, limit=20):
+        # Свежие записи еще могут лежать в буфере журнала
+        self.audit.flush()
+        since = (datetime.now() - timedelta(seconds=seconds)).isoformat(timespec='seconds') if seconds else None
+        return self.storage.get_audit(chat_id, since, None, target_id, limit)
+    
+    def get_chat_stats(self, chat_id):
+        # (участники, в муте, забанены, репорты, варны за сегодня) из счетчиков в памяти
+        return self.counters.get(chat_id)
+    
     def close(self):
-
-        self.conn.close()
+        self.scheduler.stop()
+        self.counters.stop()
+        self.directory.stop()
+        self.audit.stop()
+        self.storage.close()
@@ -0,0 +1,287 @@
+import bisect
+import cProfile
+import functools
+import inspect
+import io
+import logging
+import pstats
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import config
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(BUCKETS, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def quantile(self, fraction):
+        # Оценка по верхней границе корзины, для /stats этого достаточно
+        with self.lock:
+            counts = list(self.counts)
+            target = self.count * fraction
+        seen = 0
+        for bound, count in zip(BUCKETS + (float('inf'),), counts):
+            seen += count
+            if seen >= target and count:
+                return bound
+        return 0
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+
+    def inc(self, name, labels=(), value=1):
+        key = (name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def histogram(self, name, labels=()):
+        key = (name, labels)
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            return self.histograms[key]
+
+    def gauge(self, name, function, labels=()):
+        self.gauges[(name, labels)] = function
+
+    def counter_value(self, name, labels=()):
+        return self.counters.get((name, labels), 0)
+
+    def render(self):
+        lines = []
+        types = {}
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+
+        def declare(name, kind):
+            if name not in types:
+                types[name] = kind
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            declare(name, 'counter')
+            lines.append(f"{name}{format_labels(labels)} {value}")
+        for (name, labels), histogram in histograms:
+            declare(name, 'histogram')
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ('+Inf',), histogram.counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', str(bound)),))} {cumulative}")
+            lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum}")
+            lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+        for (name, labels), function in sorted(self.gauges.items(), key=lambda item: item[0]):
+            try:
+                value = function()
+                declare(name, 'gauge')
+                lines.append(f"{name}{format_labels(labels)} {value}")
+            except Exception:
+                logger.exception("gauge %s failed", name)
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+metrics = Metrics()
+
+
+def profiled(function, args, kwargs):
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(function, *args, **kwargs)
+    finally:
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(15)
+        logger.info("profile %s\n%s", function.__name__, stream.getvalue())
+
+
+def timed(function, name, labels):
+    histogram = metrics.histogram(name, labels)
+    errors = (name.replace('_seconds', '_errors_total'), labels)
+
+    if inspect.iscoroutinefunction(function):
+        @functools.wraps(function)
+        async def async_wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await function(*args, **kwargs)
+            except Exception:
+                metrics.inc(*errors)
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - start)
+
+        return async_wrapper
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            if config.PROFILE_SAMPLE_RATE and random.random() < config.PROFILE_SAMPLE_RATE:
+                return profiled(function, args, kwargs)
+            return function(*args, **kwargs)
+        except Exception:
+            metrics.inc(*errors)
+            raise
+        finally:
+            histogram.observe(time.perf_counter() - start)
+
+    return wrapper
+
+
+def instrument_handlers(bot):
+    for handlers in (bot.message_handlers, bot.callback_query_handlers, bot.chat_member_handlers):
+        for handler in handlers:
+            function = handler['function']
+            handler['function'] = timed(function, 'bot_handler_seconds', (('handler', function.__name__),))
+
+
+# Контекстные менеджеры и служебные методы не оборачиваем
+LOGIC_SKIP = {'durable'}
+
+
+def instrument_logic(logic):
+    if getattr(logic, 'instrumented', False):
+        return
+    logic.instrumented = True
+    for name in dir(type(logic)):
+        if name.startswith('_') or name in LOGIC_SKIP:
+            continue
+        method = getattr(logic, name)
+        if callable(method):
+            setattr(logic, name, timed(method, 'logic_call_seconds', (('method', name),)))
+
+
+def instrument_api():
+    from telebot import apihelper
+
+    make_request = apihelper._make_request
+    if getattr(make_request, 'instrumented', False):
+        return
+
+    def wrapper(token, method_name, *args, **kwargs):
+        try:
+            result = make_request(token, method_name, *args, **kwargs)
+        except apihelper.ApiTelegramException as e:
+            metrics.inc('telegram_api_calls_total', (('method', method_name), ('result', str(e.error_code))))
+            raise
+        except Exception:
+            metrics.inc('telegram_api_calls_total', (('method', method_name), ('result', 'network')))
+            raise
+        metrics.inc('telegram_api_calls_total', (('method', method_name), ('result', 'ok')))
+        return result
+
+    wrapper.instrumented = True
+    apihelper._make_request = wrapper
+
+
+def register_gauges(logic, outbound, muted_guard, flood_guard=None):
+    metrics.gauge('outbound_queue_depth', outbound.depth)
+    metrics.gauge('scheduler_heap_depth', lambda: len(logic.scheduler.heap))
+    metrics.gauge('group_commit_pending_depth', lambda: logic.storage.group_commit.ops if getattr(logic.storage, 'group_commit', None) else 0)
+    metrics.gauge('muted_cache_size', lambda: len(logic.muted))
+    metrics.gauge('chats_cache_size', lambda: len(logic.chats))
+    metrics.gauge('muted_guard_size', lambda: len(muted_guard.entries))
+    metrics.gauge('audit_pending_depth', lambda: len(logic.audit.pending))
+    if flood_guard:
+        metrics.gauge('flood_guard_size', lambda: len(flood_guard.entries))
+
+
+def cache_hit(cache, hit):
+    metrics.inc('cache_requests_total', (('cache', cache), ('result', 'hit' if hit else 'miss')))
+
+
+def stats_text():
+    lines = ["📈 Статистика"]
+    # Обработчики в других потоках добавляют ключи в словари, поэтому как в render() берем снимок
+    with metrics.lock:
+        counters = list(metrics.counters.items())
+        histograms = list(metrics.histograms.items())
+        gauges = sorted(metrics.gauges.items(), key=lambda item: item[0])
+    handlers = [
+        (labels[0][1], histogram) for (name, labels), histogram in histograms
+        if name == 'bot_handler_seconds' and histogram.count
+    ]
+    if handlers:
+        lines.append("\nОбработчики (вызовы, p50, p99):")
+        for handler, histogram in sorted(handlers, key=lambda item: -item[1].count)[:10]:
+            lines.append(
+                f"{handler}: {histogram.count}, "
+                f"{histogram.quantile(0.5) * 1000:g} мс, {histogram.quantile(0.99) * 1000:g} мс"
+            )
+    api = {}
+    for (name, labels), value in counters:
+        if name == 'telegram_api_calls_total':
+            result = dict(labels)['result']
+            api[result] = api.get(result, 0) + value
+    if api:
+        lines.append("\nВызовы API: " + ', '.join(f"{result}: {count}" for result, count in sorted(api.items())))
+    caches = {}
+    for (name, labels), value in counters:
+        if name == 'cache_requests_total':
+            values = dict(labels)
+            caches.setdefault(values['cache'], {})[values['result']] = value
+    for cache, results in sorted(caches.items()):
+        total = results.get('hit', 0) + results.get('miss', 0)
+        lines.append(f"Кэш {cache}: {results.get('hit', 0) / total:.1%} попаданий из {total}")
+    for (name, labels), function in gauges:
+        if name.endswith('_depth'):
+            lines.append(f"{name}: {function()}")
+    return '\n'.join(lines)
+
+
+class MetricsServer:
+    def __init__(self, host=None, port=None):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                data = metrics.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host or config.METRICS_HOST, port or config.METRICS_PORT), Handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name='metrics', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
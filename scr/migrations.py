@@ -0,0 +1,388 @@
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+
+def column_exists(cursor, table, column):
+    cursor.execute(f"PRAGMA table_info({table})")
+    return column in [row[1] for row in cursor.fetchall()]
+
+
+def initial_schema(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS chats (
+            chat_id INTEGER PRIMARY KEY,
+            welcome_enabled INTEGER DEFAULT 1
+        )
+    ''')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER,
+            chat_id INTEGER,
+            username TEXT,
+            first_name TEXT,
+            warns INTEGER DEFAULT 0,
+            is_muted INTEGER DEFAULT 0,
+            mute_until TEXT,
+            is_banned INTEGER DEFAULT 0,
+            PRIMARY KEY (user_id, chat_id)
+        )
+    ''')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS reports (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER,
+            reporter_id INTEGER,
+            reported_id INTEGER,
+            reason TEXT,
+            status TEXT DEFAULT 'pending',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def expiry_and_report_indexes(cursor):
+    # Базы, созданные до миграций, могли уже получить ban_until и индексы сроков
+    if not column_exists(cursor, 'users', 'ban_until'):
+        cursor.execute("ALTER TABLE users ADD COLUMN ban_until TEXT")
+    
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_users_mute_until
+        ON users (mute_until) WHERE is_muted = 1
+    ''')
+    
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_users_ban_until
+        ON users (ban_until) WHERE is_banned = 1
+    ''')
+    
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_reports_chat_status_created
+        ON reports (chat_id, status, created_at)
+    ''')
+
+
+def pending_reports_by_user(cursor):
+    # Постраничный /reports идет по этому индексу и не трогает решенные репорты
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_reports_pending_reported
+        ON reports (chat_id, reported_id, id) WHERE status = 'pending'
+    ''')
+
+
+def username_index(cursor):
+    # @username в командах ищется без учета регистра, как в Telegram
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_users_username
+        ON users (username COLLATE NOCASE)
+    ''')
+
+
+def user_activity(cursor):
+    cursor.execute("ALTER TABLE users ADD COLUMN last_seen TEXT")
+    cursor.execute("ALTER TABLE users ADD COLUMN message_count INTEGER DEFAULT 0")
+    # /inactive идет по чату от самых давно молчащих
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_users_chat_last_seen
+        ON users (chat_id, last_seen)
+    ''')
+
+
+def content_filters(cursor):
+    # Правила фильтра читаются целиком по чату, первичный ключ начинается с chat_id
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS filters (
+            chat_id INTEGER,
+            kind TEXT,
+            pattern TEXT,
+            action TEXT,
+            PRIMARY KEY (chat_id, kind, pattern)
+        )
+    ''')
+
+
+def report_complaints(cursor):
+    # Повторные жалобы на одно сообщение копятся в complaints одного репорта.
+    # Поиск повтора идет по idx_reports_pending_reported: открытых репортов на одного человека немного
+    cursor.execute("ALTER TABLE reports ADD COLUMN message_id INTEGER")
+    cursor.execute("ALTER TABLE reports ADD COLUMN complaints INTEGER DEFAULT 1")
+
+
+def audit_journal(cursor):
+    # Журнал только дописывается; /audit читает чат за период или историю одного пользователя,
+    # очистка по сроку хранения идет по индексу времени
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS audit (
+            id INTEGER PRIMARY KEY,
+            at TEXT,
+            chat_id INTEGER,
+            actor_id INTEGER,
+            target_id INTEGER,
+            action TEXT,
+            duration INTEGER,
+            details TEXT
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_audit_chat_at ON audit (chat_id, at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_audit_chat_target_at ON audit (chat_id, target_id, at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_audit_at ON audit (at)")
+
+
+def join_times(cursor):
+    # Массовые команды выбирают вошедших за последние N минут по индексу чата и времени входа
+    cursor.execute("ALTER TABLE users ADD COLUMN joined_at TEXT")
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_users_chat_joined
+        ON users (chat_id, joined_at)
+    ''')
+
+
+def chat_counters(cursor):
+    # Счетчики /chatstats. Частичные индексы дают сверке муты и баны чата без обхода всех участников
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS chat_counters (
+            chat_id INTEGER PRIMARY KEY,
+            members INTEGER DEFAULT 0,
+            muted INTEGER DEFAULT 0,
+            banned INTEGER DEFAULT 0,
+            reports INTEGER DEFAULT 0,
+            warns_today INTEGER DEFAULT 0,
+            day TEXT
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_chat_muted ON users (chat_id) WHERE is_muted = 1")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_chat_banned ON users (chat_id) WHERE is_banned = 1")
+    # Чаты, которые уже есть в базе, получают счетчики сразу, дальше их ведет бот
+    cursor.execute('''
+        INSERT OR IGNORE INTO chat_counters (chat_id, members, muted, banned, reports, warns_today, day)
+        SELECT chat_id,
+            (SELECT COUNT(*) FROM users WHERE users.chat_id = ids.chat_id),
+            (SELECT COUNT(*) FROM users WHERE users.chat_id = ids.chat_id AND is_muted = 1),
+            (SELECT COUNT(*) FROM users WHERE users.chat_id = ids.chat_id AND is_banned = 1),
+            (SELECT COUNT(*) FROM reports WHERE reports.chat_id = ids.chat_id AND status = 'pending'),
+            (SELECT COUNT(*) FROM audit WHERE audit.chat_id = ids.chat_id
+                AND at >= date('now', 'localtime') AND action = 'warn'),
+            date('now', 'localtime')
+        FROM (SELECT chat_id FROM users UNION SELECT chat_id FROM reports) AS ids
+    ''')
+
+
+def inactive_activity(cursor):
+    # /inactive считает молчание с последнего сообщения, а у не писавших — со входа в чат.
+    # Индекс по тому же выражению, что в запросе; прежний по last_seen больше никто не читает
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_users_chat_activity
+        ON users (chat_id, COALESCE(last_seen, joined_at, ''))
+    ''')
+    cursor.execute("DROP INDEX IF EXISTS idx_users_chat_last_seen")
+
+
+def permanent_mutes(cursor):
+    # Бессрочный мут раньше хранился как срок на 10 лет вперед и попадал в расписание;
+    # теперь он, как бессрочный бан, без срока
+    cursor.execute('''
+        UPDATE users SET mute_until = NULL
+        WHERE is_muted = 1 AND mute_until > date('now', 'localtime', '+9 years')
+    ''')
+
+
+MIGRATIONS = [
+    (1, 'initial schema', initial_schema),
+    (2, 'expiry and report indexes', expiry_and_report_indexes),
+    (3, 'pending reports by user', pending_reports_by_user),
+    (4, 'username index', username_index),
+    (5, 'user activity', user_activity),
+    (6, 'content filters', content_filters),
+    (7, 'report complaints', report_complaints),
+    (8, 'audit journal', audit_journal),
+    (9, 'join times', join_times),
+    (10, 'chat counters', chat_counters),
+    (11, 'inactive by last activity', inactive_activity),
+    (12, 'permanent mutes without deadline', permanent_mutes),
+]
+
+# Горячие запросы и индексы, которые они обязаны использовать
+HOT_QUERIES = [
+    (
+        "SELECT * FROM reports WHERE status = 'pending' AND chat_id = ? ORDER BY created_at",
+        (1,),
+        ['idx_reports_chat_status_created'],
+    ),
+    (
+        "SELECT user_id, chat_id, mute_until FROM users WHERE is_muted = 1",
+        (),
+        # Те же строки есть в обоих частичных индексах мутов, планировщик берет меньший
+        ['idx_users_chat_muted'],
+    ),
+    (
+        '''SELECT 'mute', user_id, chat_id, mute_until FROM users
+        WHERE is_muted = 1 AND mute_until IS NOT NULL
+        UNION ALL
+        SELECT 'ban', user_id, chat_id, ban_until FROM users
+        WHERE is_banned = 1 AND ban_until IS NOT NULL''',
+        (),
+        ['idx_users_mute_until', 'idx_users_ban_until'],
+    ),
+    (
+        '''SELECT reported_id, SUM(complaints), MAX(id), reason FROM reports
+        WHERE chat_id = ? AND status = 'pending' AND reported_id > ?
+        GROUP BY reported_id ORDER BY reported_id LIMIT ?''',
+        (1, 0, 6),
+        ['idx_reports_pending_reported'],
+    ),
+    (
+        "SELECT 1 FROM reports WHERE chat_id = ? AND status = 'pending' AND reported_id < ? LIMIT 1",
+        (1, 0),
+        ['idx_reports_pending_reported'],
+    ),
+    (
+        '''UPDATE reports SET status = 'resolved'
+        WHERE chat_id = ? AND status = 'pending' AND created_at < datetime('now', ?)''',
+        (1, '-0 seconds'),
+        ['idx_reports_chat_status_created'],
+    ),
+    (
+        "SELECT user_id, chat_id FROM users WHERE username = ? COLLATE NOCASE",
+        ('name',),
+        ['idx_users_username'],
+    ),
+    (
+        "UPDATE users SET username = NULL WHERE username = ? COLLATE NOCASE AND user_id != ?",
+        ('name', 1),
+        ['idx_users_username'],
+    ),
+    (
+        '''SELECT user_id, username, first_name, COALESCE(last_seen, joined_at), message_count FROM users
+        WHERE chat_id = ? AND COALESCE(last_seen, joined_at, '') < ?
+        ORDER BY COALESCE(last_seen, joined_at, '') LIMIT ?''',
+        (1, '2000-01-01', 20),
+        ['idx_users_chat_activity'],
+    ),
+    (
+        '''SELECT id, complaints FROM reports
+        WHERE chat_id = ? AND reported_id = ? AND message_id = ? AND status = 'pending'
+        AND +created_at >= datetime('now', ?)
+        ORDER BY id DESC LIMIT 1''',
+        (1, 2, 3, '-600 seconds'),
+        ['idx_reports_pending_reported'],
+    ),
+    (
+        "SELECT kind, pattern, action FROM filters WHERE chat_id = ?",
+        (1,),
+        ['sqlite_autoindex_filters_1'],
+    ),
+    (
+        '''SELECT * FROM audit WHERE chat_id = ? AND at >= ? AND at < ?
+        ORDER BY at DESC, id DESC LIMIT ?''',
+        (1, '2000-01-01', '2100-01-01', 20),
+        ['idx_audit_chat_at'],
+    ),
+    (
+        '''SELECT * FROM audit WHERE chat_id = ? AND target_id = ? AND at >= ? AND at < ?
+        ORDER BY at DESC, id DESC LIMIT ?''',
+        (1, 2, '2000-01-01', '2100-01-01', 20),
+        ['idx_audit_chat_target_at'],
+    ),
+    (
+        "DELETE FROM audit WHERE id IN (SELECT id FROM audit WHERE at < ? LIMIT ?)",
+        ('2000-01-01', 1000),
+        ['idx_audit_at'],
+    ),
+    (
+        "SELECT user_id FROM users WHERE chat_id = ? AND joined_at >= ? ORDER BY joined_at DESC LIMIT ?",
+        (1, '2000-01-01', 201),
+        ['idx_users_chat_joined'],
+    ),
+    (
+        "SELECT COUNT(*) FROM users WHERE chat_id = ? AND is_muted = 1",
+        (1,),
+        ['idx_users_chat_muted'],
+    ),
+    (
+        "SELECT COUNT(*) FROM users WHERE chat_id = ? AND is_banned = 1",
+        (1,),
+        ['idx_users_chat_banned'],
+    ),
+    (
+        "SELECT COUNT(*) FROM audit WHERE chat_id = ? AND at >= ? AND action = 'warn'",
+        (1, '2000-01-01'),
+        ['idx_audit_chat_at'],
+    ),
+]
+
+
+def schema_version(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations").fetchone()[0]
+
+
+def migrate(conn):
+    version = schema_version(conn)
+    for number, name, step in MIGRATIONS:
+        if number <= version:
+            continue
+        cursor = conn.cursor()
+        # IMMEDIATE: шарды стартуют одновременно, шаг применяет только тот, кто первым взял запись
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            if cursor.execute("SELECT 1 FROM schema_migrations WHERE version = ?", (number,)).fetchone():
+                conn.rollback()
+                version = number
+                continue
+            step(cursor)
+            cursor.execute(
+                "INSERT INTO schema_migrations (version, name) VALUES (?, ?)",
+                (number, name)
+            )
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+        version = number
+    return version
+
+
+def query_plan_problems(conn):
+    problems = []
+    for sql, params, indexes in HOT_QUERIES:
+        plan = ' | '.join(row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params))
+        for index in indexes:
+            if index not in plan:
+                problems.append(f"{index} не используется: {plan}")
+        if 'TEMP B-TREE' in plan:
+            problems.append(f"сортировка без индекса: {plan}")
+    return problems
+
+
+def check(db_path):
+    # Обновляем копию базы, исходный файл не трогаем
+    with tempfile.TemporaryDirectory() as tmp:
+        copy = os.path.join(tmp, 'bot.db')
+        shutil.copy(db_path, copy)
+        conn = sqlite3.connect(copy)
+        before = schema_version(conn)
+        after = migrate(conn)
+        again = migrate(conn)
+        problems = query_plan_problems(conn)
+        conn.close()
+    print(f"{db_path}: schema version {before} -> {after}")
+    if again != after or after != MIGRATIONS[-1][0]:
+        problems.append(f"повторная миграция дала версию {again}")
+    for problem in problems:
+        print(f"  FAIL {problem}")
+    return not problems
+
+
+if __name__ == '__main__':
+    db_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(__file__), 'bot.db')
+    sys.exit(0 if check(db_path) else 1)
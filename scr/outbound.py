@@ -0,0 +1,279 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from telebot.apihelper import ApiTelegramException
+
+import config
+
+logger = logging.getLogger(__name__)
+
+MODERATION = 0
+NOTIFY = 1
+REPLY = 2
+
+SEND_METHODS = {'reply_to', 'send_message'}
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0
+
+    def wait_time(self, now):
+        if now < self.paused_until:
+            return self.paused_until - now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self.tokens -= 1
+
+    def pause(self, until):
+        self.paused_until = max(self.paused_until, until)
+        self.tokens = 0
+
+    def idle(self, now):
+        # Полная корзина без паузы ничем не отличается от новой
+        return now >= self.paused_until and self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+class OutboundItem:
+    def __init__(self, method, chat_id, args, kwargs, priority, coalesce, lane=None):
+        self.method = method
+        self.chat_id = chat_id
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        # Задачи одной полосы уходят строго по очереди; массовые команды раскладывают вызовы по нескольким
+        self.lane = lane or (chat_id, priority)
+        self.coalesce = coalesce
+        self.parts = None
+        self.attempts = 0
+        self.future = Future()
+
+
+class OutboundDispatcher:
+    def __init__(self, bot, workers=None):
+        self.bot = bot
+        self.workers = workers or config.OUTBOUND_WORKERS
+        self.cond = threading.Condition()
+        self.seq = itertools.count()
+        self.ready = []
+        self.delayed = []
+        self.busy = {}
+        self.waiting = {}
+        self.pending = {}
+        self.global_bucket = TokenBucket(config.OUTBOUND_GLOBAL_RATE, config.OUTBOUND_GLOBAL_RATE)
+        # chat_id -> TokenBucket, давно не тронутые первыми
+        self.chat_buckets = OrderedDict()
+        self.bucket_limit = config.OUTBOUND_BUCKET_TRACK_LIMIT
+        self.threads = []
+        self.running = False
+
+    def submit(self, method, chat_id, args, kwargs=None, priority=REPLY, coalesce=None, lane=None):
+        with self.cond:
+            if coalesce is not None and coalesce in self.pending:
+                return self.pending[coalesce].future
+            item = OutboundItem(method, chat_id, args, kwargs or {}, priority, coalesce, lane)
+            return self.enqueue(item)
+
+    def enqueue(self, item):
+        # Вызывается под self.cond
+        if item.coalesce is not None:
+            self.pending[item.coalesce] = item
+        heapq.heappush(self.ready, (item.priority, next(self.seq), item))
+        self.cond.notify()
+        return item.future
+
+    def reply_to(self, message, text, priority=REPLY, coalesce=None, **kwargs):
+        return self.submit('reply_to', message.chat.id, (message, text), kwargs, priority, coalesce)
+
+    def send_message(self, chat_id, text, priority=REPLY, coalesce=None, **kwargs):
+        return self.submit('send_message', chat_id, (chat_id, text), kwargs, priority, coalesce)
+
+    def delete_message(self, chat_id, message_id, batch=False):
+        if not batch or not hasattr(self.bot, 'delete_messages'):
+            return self.submit('delete_message', chat_id, (chat_id, message_id), priority=MODERATION)
+        # Пока пачка не ушла, новые id дописываются в нее и удаляются одним deleteMessages
+        with self.cond:
+            item = self.pending.get(('delete', chat_id))
+            if item and len(item.args[1]) < config.OUTBOUND_DELETE_BATCH:
+                item.args[1].append(message_id)
+                return item.future
+            key = ('delete', chat_id)
+            self.pending.pop(key, None)
+        return self.submit('delete_messages', chat_id, (chat_id, [message_id]), priority=MODERATION, coalesce=key)
+
+    def send_merged(self, chat_id, key, part, render, limit, priority=REPLY, **kwargs):
+        # Пока сообщение не ушло, новые части дописываются в него, текст собирает render(parts)
+        with self.cond:
+            item = self.pending.get(key)
+            if item and len(item.parts) < limit:
+                item.parts.append(part)
+                item.args = (chat_id, render(item.parts))
+                return item.future
+            self.pending.pop(key, None)
+            item = OutboundItem('send_message', chat_id, (chat_id, render([part])), kwargs, priority, key)
+            item.parts = [part]
+            return self.enqueue(item)
+
+    def restrict_chat_member(self, chat_id, user_id, **kwargs):
+        return self.submit('restrict_chat_member', chat_id, (chat_id, user_id), kwargs, MODERATION)
+
+    def ban_chat_member(self, chat_id, user_id, **kwargs):
+        return self.submit('ban_chat_member', chat_id, (chat_id, user_id), kwargs, MODERATION)
+
+    def unban_chat_member(self, chat_id, user_id, **kwargs):
+        return self.submit('unban_chat_member', chat_id, (chat_id, user_id), kwargs, MODERATION)
+
+    def edit_message_text(self, text, chat_id, message_id, **kwargs):
+        return self.submit('edit_message_text', chat_id, (text, chat_id, message_id), kwargs, REPLY)
+
+    def answer_callback_query(self, chat_id, callback_query_id, text=None):
+        return self.submit('answer_callback_query', chat_id, (callback_query_id, text), priority=NOTIFY)
+
+    def notify_admins(self, text, **kwargs):
+        return [
+            self.send_message(admin_id, text, priority=NOTIFY, **kwargs)
+            for admin_id in config.ADMIN_IDS
+        ]
+
+    def chat_bucket(self, chat_id, now):
+        # Вызывается под self.cond
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if chat_id < 0:
+                bucket = TokenBucket(config.OUTBOUND_GROUP_RATE, config.OUTBOUND_GROUP_BURST)
+            else:
+                bucket = TokenBucket(config.OUTBOUND_CHAT_RATE, config.OUTBOUND_CHAT_BURST)
+            self.chat_buckets[chat_id] = bucket
+            # Сверх лимита выбрасываются старые корзины, если они успели наполниться;
+            # корзина с долгом остается, иначе чат получил бы лишний запас
+            while len(self.chat_buckets) > self.bucket_limit:
+                oldest = next(iter(self.chat_buckets.values()))
+                if oldest is bucket or not oldest.idle(now):
+                    break
+                self.chat_buckets.popitem(last=False)
+        self.chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    def depth(self):
+        with self.cond:
+            return len(self.ready) + len(self.delayed) + sum(len(items) for items in self.waiting.values())
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        for n in range(self.workers):
+            thread = threading.Thread(target=self.run, name=f'outbound-{n}', daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def drain(self, timeout=None):
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self.cond:
+            while self.ready or self.delayed or self.busy:
+                if deadline is not None and time.monotonic() >= deadline:
+                    return False
+                self.cond.wait(0.1)
+        return True
+
+    def stop(self, timeout=10):
+        # Сначала даем очереди опустеть, потом останавливаем потоки
+        self.drain(timeout)
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def next_item(self):
+        # Вызывается под self.cond; возвращает задачу, которую можно отправлять прямо сейчас
+        while self.running:
+            now = time.monotonic()
+            while self.delayed and self.delayed[0][0] <= now:
+                _, seq, item = heapq.heappop(self.delayed)
+                heapq.heappush(self.ready, (item.priority, seq, item))
+            while self.ready:
+                priority, seq, item = heapq.heappop(self.ready)
+                if self.busy.get(item.lane, item) is not item:
+                    # Внутри чата и приоритета задачи уходят строго по очереди,
+                    # задача в ожидании лимита или повтора держит свою полосу
+                    self.waiting.setdefault(item.lane, []).append((priority, seq, item))
+                    continue
+                self.busy[item.lane] = item
+                bucket = self.chat_bucket(item.chat_id, now) if item.method in SEND_METHODS else None
+                wait = max(self.global_bucket.wait_time(now), bucket.wait_time(now) if bucket else 0)
+                if wait > 0:
+                    heapq.heappush(self.delayed, (now + wait, seq, item))
+                    continue
+                self.global_bucket.consume()
+                if bucket:
+                    bucket.consume()
+                if item.coalesce is not None and self.pending.get(item.coalesce) is item:
+                    del self.pending[item.coalesce]
+                return item
+            self.cond.wait(self.delayed[0][0] - now if self.delayed else None)
+        return None
+
+    def release(self, item):
+        del self.busy[item.lane]
+        for entry in self.waiting.pop(item.lane, []):
+            heapq.heappush(self.ready, entry)
+        self.cond.notify_all()
+
+    def retry(self, item, delay):
+        # Полоса остается занятой, пока задача не уйдет
+        item.attempts += 1
+        heapq.heappush(self.delayed, (time.monotonic() + delay, next(self.seq), item))
+        self.cond.notify_all()
+
+    def run(self):
+        while True:
+            with self.cond:
+                item = self.next_item()
+            if item is None:
+                return
+            try:
+                result = getattr(self.bot, item.method)(*item.args, **item.kwargs)
+            except ApiTelegramException as e:
+                with self.cond:
+                    if e.error_code == 429 and item.attempts < config.OUTBOUND_MAX_RETRIES:
+                        retry_after = e.result_json.get('parameters', {}).get('retry_after', 1)
+                        # Корзины есть только у отправки сообщений, остальные вызовы просто ждут повтора
+                        if item.method in SEND_METHODS:
+                            now = time.monotonic()
+                            self.chat_bucket(item.chat_id, now).pause(now + retry_after)
+                        self.retry(item, retry_after)
+                    elif e.error_code >= 500 and item.attempts < config.OUTBOUND_MAX_RETRIES:
+                        self.retry(item, 2 ** item.attempts)
+                    else:
+                        logger.warning("%s failed: %s", item.method, e)
+                        item.future.set_exception(e)
+                        self.release(item)
+                continue
+            except Exception as e:
+                with self.cond:
+                    if item.attempts < config.OUTBOUND_MAX_RETRIES:
+                        self.retry(item, 2 ** item.attempts)
+                    else:
+                        logger.warning("%s failed: %s", item.method, e)
+                        item.future.set_exception(e)
+                        self.release(item)
+                continue
+            item.future.set_result(result)
+            with self.cond:
+                self.release(item)
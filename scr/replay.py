@@ -0,0 +1,252 @@
+import json
+import os
+import random
+import tempfile
+import time
+from contextlib import contextmanager
+
+import config
+
+ADMIN_ID = 1000
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class UpdateGenerator:
+    def __init__(self, seed=0):
+        self.rnd = random.Random(seed)
+        self.update_id = 0
+        self.message_id = 0
+
+    def message(self, chat_id, user_id, text='', reply_to=None, **extra):
+        self.update_id += 1
+        self.message_id += 1
+        message = {
+            'message_id': self.message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'supergroup', 'title': f"chat {chat_id}"},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f"user{user_id}", 'username': f"user{user_id}"},
+        }
+        if text:
+            message['text'] = text
+            if text.startswith('/'):
+                message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        if reply_to:
+            message['reply_to_message'] = {
+                'message_id': self.message_id - 1,
+                'date': int(time.time()),
+                'chat': message['chat'],
+                'from': {'id': reply_to, 'is_bot': False, 'first_name': f"user{reply_to}"},
+                'text': "...",
+            }
+        message.update(extra)
+        return {'update_id': self.update_id, 'message': message}
+
+    def chatty(self, groups=20, users=50, messages=3000):
+        updates = []
+        for _ in range(messages):
+            chat_id = -1000 - self.rnd.randrange(groups)
+            user_id = self.rnd.randrange(1, users + 1)
+            text = ' '.join(self.rnd.choice(['привет', 'как дела', 'ок', 'ссылка', 'спасибо']) for _ in range(5))
+            updates.append(self.message(chat_id, user_id, text))
+        return updates
+
+    def raid(self, chat_id=-2000, joins=500):
+        return [
+            self.message(chat_id, 50000 + n, new_chat_members=[
+                {'id': 50000 + n, 'is_bot': False, 'first_name': f"raider{n}", 'username': f"raider{n}"}
+            ])
+            for n in range(joins)
+        ]
+
+    def muted_spam(self, chat_id=-3000, users=10, messages=1000):
+        updates = [self.message(chat_id, 60000 + n, '/mywarns') for n in range(users)]
+        updates += [self.message(chat_id, ADMIN_ID, f"/mute 1h {60000 + n}") for n in range(users)]
+        updates += [
+            self.message(chat_id, 60000 + self.rnd.randrange(users), 'spam spam spam')
+            for _ in range(messages)
+        ]
+        return updates
+
+    def admin_burst(self, chat_id=-4000, users=50, commands=400):
+        updates = [self.message(chat_id, 70000 + n, '/mywarns') for n in range(users)]
+        for _ in range(commands):
+            target = 70000 + self.rnd.randrange(users)
+            kind = self.rnd.random()
+            if kind < 0.3:
+                updates.append(self.message(chat_id, ADMIN_ID, f"/warns {target}"))
+            elif kind < 0.5:
+                updates.append(self.message(chat_id, ADMIN_ID, f"/mute 30m {target}"))
+            elif kind < 0.6:
+                updates.append(self.message(chat_id, ADMIN_ID, f"/unmute {target}"))
+            elif kind < 0.8:
+                updates.append(self.message(chat_id, target + 1, "/report спам", reply_to=target))
+            else:
+                updates.append(self.message(chat_id, ADMIN_ID, "/reports"))
+        return updates
+
+    def flood(self, chat_id=-5000, users=20, messages=600):
+        # Половина пишет быстрее лимита разными текстами, остальные повторяют одно и то же
+        # Каждый прогон — новые пользователи, иначе они остались бы в муте с прошлого раза
+        first = 80000 + self.message_id
+        updates = []
+        for n in range(messages):
+            user_id = first + self.rnd.randrange(users)
+            text = "купи крипту" if user_id % 2 else f"сообщение {n}"
+            updates.append(self.message(chat_id, user_id, text))
+        return updates
+
+
+SCENARIOS = ['chatty', 'raid', 'muted_spam', 'admin_burst', 'flood']
+
+
+class ReplayHarness:
+    def __init__(self, tmp_dir, seed=0, storage=None):
+        from telebot import apihelper
+        from fake_api import FakeBotAPI
+
+        # Настройки подменяются до импорта bot, иначе он откроет боевую базу
+        config.TOKEN = '1:replay'
+        config.ADMIN_IDS = [ADMIN_ID]
+        config.DB_PATH = os.path.join(tmp_dir, 'replay.db')
+        if storage:
+            config.STORAGE_BACKEND = storage
+        # Лимиты Telegram здесь не меряем, иначе прогон упрется в 20 сообщений в минуту
+        config.OUTBOUND_GLOBAL_RATE = 1e6
+        config.OUTBOUND_CHAT_RATE = 1e6
+        config.OUTBOUND_GROUP_RATE = 1e6
+        self.api = FakeBotAPI().start()
+        apihelper.API_URL = self.api.url
+
+        import bot
+        self.bot = bot
+        self.generator = UpdateGenerator(seed)
+        self.handler_times = {}
+        self.sqlite_time = 0
+        bot.bot.threaded = False
+        self.instrument()
+        bot.logic.scheduler.start()
+        bot.outbound.start()
+
+    def instrument(self):
+        for handlers in (self.bot.bot.message_handlers, self.bot.bot.callback_query_handlers):
+            for handler in handlers:
+                handler['function'] = self.timed_handler(handler['function'])
+        storage = self.bot.logic.storage
+        if hasattr(storage, 'read'):
+            storage.read = self.timed_db(storage.read)
+            storage.write = self.timed_db(storage.write)
+
+    def timed_handler(self, function):
+        times = self.handler_times.setdefault(function.__name__, [])
+
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                times.append(time.perf_counter() - start)
+
+        wrapper.__name__ = function.__name__
+        return wrapper
+
+    def timed_db(self, block):
+        harness = self
+
+        @contextmanager
+        def wrapper():
+            start = time.perf_counter()
+            try:
+                with block() as cursor:
+                    yield cursor
+            finally:
+                harness.sqlite_time += time.perf_counter() - start
+
+        return wrapper
+
+    def run(self, scenario):
+        from telebot import types
+
+        updates = [types.Update.de_json(update) for update in getattr(self.generator, scenario)()]
+        self.api.reset()
+        self.sqlite_time = 0
+        # Прогон сжимает часы переписки в доли секунды: счетчики флуда начинаем заново
+        self.bot.flood_guard.entries.clear()
+        latencies = []
+        start = time.perf_counter()
+        for update in updates:
+            begin = time.perf_counter()
+            self.bot.bot.process_new_updates([update])
+            latencies.append(time.perf_counter() - begin)
+        elapsed = time.perf_counter() - start
+        self.bot.outbound.drain(60)
+        return {
+            'updates': len(updates),
+            'updates_per_sec': len(updates) / elapsed,
+            'p50_ms': percentile(latencies, 0.5) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+            'sqlite_ms_per_update': self.sqlite_time * 1000 / len(updates),
+            'api_calls_per_update': self.api.count() / len(updates),
+        }
+
+    def handler_report(self):
+        return {
+            name: {
+                'calls': len(times),
+                'p50_ms': percentile(times, 0.5) * 1000,
+                'p99_ms': percentile(times, 0.99) * 1000,
+            }
+            for name, times in self.handler_times.items() if times
+        }
+
+    def close(self):
+        self.bot.outbound.stop()
+        self.bot.logic.close()
+        self.api.stop()
+
+
+def run_replay(scenarios=None, seed=0, repeat=3, storage=None):
+    # Каждый сценарий гоняется repeat раз, в результат идет медиана по каждой метрике
+    with tempfile.TemporaryDirectory() as tmp:
+        harness = ReplayHarness(tmp, seed, storage)
+        try:
+            results = {}
+            for scenario in scenarios or SCENARIOS:
+                runs = [harness.run(scenario) for _ in range(repeat)]
+                results[scenario] = {name: percentile([run[name] for run in runs], 0.5) for name in runs[0]}
+            handlers = harness.handler_report()
+        finally:
+            harness.close()
+    return results, handlers
+
+
+# Для этих метрик рост - это ухудшение, для остальных - улучшение
+LOWER_IS_BETTER = {'p50_ms', 'p99_ms', 'sqlite_ms_per_update', 'api_calls_per_update'}
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for scenario, metrics in results.items():
+        for name, value in metrics.items():
+            old = baseline.get(scenario, {}).get(name)
+            if not old or name == 'updates':
+                continue
+            change = (value - old) / old
+            if name in LOWER_IS_BETTER and change > tolerance or name not in LOWER_IS_BETTER and change < -tolerance:
+                regressions.append(f"{scenario}.{name}: {old:.3f} -> {value:.3f} ({change:+.0%})")
+    return regressions
+
+
+def load_baseline(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_baseline(path, results):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
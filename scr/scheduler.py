@@ -0,0 +1,96 @@
+import heapq
+import threading
+from datetime import datetime
+
+
+class ExpiryScheduler:
+    def __init__(self, logic, batch_delay=0.5):
+        self.logic = logic
+        self.batch_delay = batch_delay
+        self.heap = []
+        # (kind, user_id, chat_id) -> живой дедлайн; записи кучи с другим сроком устарели
+        self.deadlines = {}
+        self.stale = 0
+        self.cond = threading.Condition()
+        self.thread = None
+        self.running = False
+
+    def schedule(self, kind, user_id, chat_id, until):
+        with self.cond:
+            key = (kind, user_id, chat_id)
+            previous = self.deadlines.get(key)
+            if previous == until:
+                return
+            if previous is not None:
+                self.stale += 1
+            self.deadlines[key] = until
+            heapq.heappush(self.heap, (until, kind, user_id, chat_id))
+            self.compact()
+            if self.heap[0][0] == until:
+                self.cond.notify()
+
+    def cancel(self, kind, user_id, chat_id):
+        # Запись в куче остается, но при срабатывании будет пропущена
+        with self.cond:
+            if self.deadlines.pop((kind, user_id, chat_id), None) is not None:
+                self.stale += 1
+                self.compact()
+
+    def compact(self):
+        # Вызывается под self.cond; устаревших записей больше половины — собираем кучу из живых
+        if self.stale <= max(len(self.heap) // 2, 64):
+            return
+        self.heap = [(until, *key) for key, until in self.deadlines.items()]
+        heapq.heapify(self.heap)
+        self.stale = 0
+
+    def rebuild(self):
+        with self.cond:
+            self.heap = []
+            self.deadlines = {}
+            self.stale = 0
+        for kind, user_id, chat_id, until in self.logic.load_expiries():
+            self.schedule(kind, user_id, chat_id, datetime.fromisoformat(until))
+
+    def start(self):
+        if self.running:
+            return
+        self.rebuild()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='expiry-scheduler', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def pop_due(self):
+        now = datetime.now()
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            until, kind, user_id, chat_id = heapq.heappop(self.heap)
+            key = (kind, user_id, chat_id)
+            if self.deadlines.get(key) == until:
+                del self.deadlines[key]
+                due.append(key)
+            else:
+                self.stale -= 1
+        return due
+
+    def run(self):
+        while True:
+            with self.cond:
+                while self.running and (not self.heap or self.heap[0][0] > datetime.now()):
+                    timeout = (self.heap[0][0] - datetime.now()).total_seconds() if self.heap else None
+                    self.cond.wait(timeout)
+                if not self.running:
+                    return
+                # Даем соседним дедлайнам накопиться, чтобы записать их одной транзакцией
+                self.cond.wait(self.batch_delay)
+                due = self.pop_due()
+            if due:
+                self.logic.expire(due)
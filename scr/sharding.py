@@ -0,0 +1,201 @@
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+
+import telebot
+from telebot import types, util
+
+import config
+from digest import ReportDigest
+from outbound import OutboundDispatcher
+from webhook import WebhookServer, update_chat_id
+
+logger = logging.getLogger(__name__)
+
+
+def shard_of(chat_id, shards):
+    return chat_id % shards
+
+
+class ShardOutbound(OutboundDispatcher):
+    def __init__(self, bot, admin_queue):
+        super().__init__(bot)
+        self.admin_queue = admin_queue
+
+    def notify_admins(self, text, **kwargs):
+        # Личка админов не принадлежит ни одному шарду, ее отправляет фронт
+        self.admin_queue.put(('notify', text, kwargs))
+        return []
+
+
+class ShardDigest(ReportDigest):
+    # Сводка репортов одна на все шарды, ее собирает фронт. Повторные жалобы отсекаются
+    # здесь: чат целиком живет в одном шарде
+    def __init__(self, admin_queue):
+        super().__init__(None)
+        self.admin_queue = admin_queue
+
+    def add(self, *args):
+        self.admin_queue.put(('report', args))
+
+
+def worker(index, shards, updates, admin_queue, ready, settings=None):
+    # Настройки выставляются до импорта bot, он создает BotLogic при импорте
+    for name, value in (settings or {}).items():
+        if name == 'API_URL':
+            telebot.apihelper.API_URL = value
+        else:
+            setattr(config, name, value)
+    config.SHARD = (index, shards)
+    # Общий лимит Telegram делится между шардами поровну
+    config.OUTBOUND_GLOBAL_RATE = config.OUTBOUND_GLOBAL_RATE / shards
+
+    import bot as app
+    import metrics
+
+    app.outbound = ShardOutbound(app.bot, admin_queue)
+    app.report_digest = ShardDigest(admin_queue)
+    metrics.register_gauges(app.logic, app.outbound, app.muted_guard, app.flood_guard)
+    app.bot.threaded = False
+    app.logic.scheduler.start()
+    app.outbound.start()
+    ready.put(index)
+    try:
+        while True:
+            update = updates.get()
+            if update is None:
+                break
+            try:
+                app.bot.process_new_updates([types.Update.de_json(update)])
+            except Exception:
+                logger.exception("shard %s: update %s failed", index, update.get('update_id'))
+    finally:
+        app.report_digest.stop()
+        app.outbound.stop()
+        app.logic.close()
+
+
+class ShardManager:
+    def __init__(self, shards=None, queue_size=None, settings=None):
+        # spawn: воркеры не наследуют потоки и соединения с базой фронта
+        context = multiprocessing.get_context('spawn')
+        self.shards = shards or config.SHARDS
+        size = max(1, (queue_size or config.SHARD_QUEUE_SIZE) // self.shards)
+        self.queues = [context.Queue(size) for _ in range(self.shards)]
+        self.admin_queue = context.Queue()
+        self.ready = context.Queue()
+        self.processes = [
+            context.Process(
+                target=worker,
+                args=(n, self.shards, q, self.admin_queue, self.ready, settings),
+                name=f'shard-{n}',
+                daemon=True
+            )
+            for n, q in enumerate(self.queues)
+        ]
+        self.forwarder = None
+        self.digest = None
+
+    def put(self, update, timeout=None):
+        # Тот же интерфейс, что у UpdatePipeline: очередь полна — ждем, по таймауту queue.Full
+        self.queues[shard_of(update_chat_id(update), self.shards)].put(update, timeout=timeout)
+
+    def depth(self):
+        return sum(q.qsize() for q in self.queues)
+
+    def start(self, notify=None):
+        for process in self.processes:
+            process.start()
+        started = 0
+        while started < len(self.processes):
+            try:
+                self.ready.get(timeout=1)
+                started += 1
+            except queue.Empty:
+                dead = [process.name for process in self.processes if not process.is_alive()]
+                if dead:
+                    self.terminate()
+                    raise RuntimeError(f"shards failed to start: {', '.join(dead)}")
+        if notify:
+            self.digest = ReportDigest(lambda text: notify(text))
+        self.forwarder = threading.Thread(target=self.forward, args=(notify,), name='shard-admins', daemon=True)
+        self.forwarder.start()
+        return self
+
+    def forward(self, notify):
+        while True:
+            item = self.admin_queue.get()
+            if item is None:
+                return
+            if not notify:
+                continue
+            if item[0] == 'report':
+                self.digest.add(*item[1])
+            else:
+                _, text, kwargs = item
+                notify(text, **kwargs)
+
+    def terminate(self):
+        for process in self.processes:
+            if process.is_alive():
+                process.terminate()
+
+    def stop(self):
+        for q in self.queues:
+            q.put(None)
+        for process in self.processes:
+            process.join()
+        self.admin_queue.put(None)
+        self.forwarder.join()
+        if self.digest:
+            self.digest.stop()
+
+
+def poll(manager):
+    # Апдейты нужны как JSON для очереди, поэтому забираем их без разбора в объекты
+    offset = None
+    backoff = 1
+    while True:
+        try:
+            updates = telebot.apihelper.get_updates(
+                config.TOKEN, offset=offset, timeout=25,
+                allowed_updates=util.update_types, long_polling_timeout=20
+            )
+        except Exception as e:
+            # Сеть или API упали — фронт ждет и повторяет, шарды продолжают работать
+            logger.warning("getUpdates failed, retry in %s s: %s", backoff, e)
+            time.sleep(backoff)
+            backoff = min(backoff * 2, config.SHARD_POLL_MAX_BACKOFF)
+            continue
+        backoff = 1
+        for update in updates:
+            offset = update['update_id'] + 1
+            manager.put(update)
+
+
+def run():
+    bot = telebot.TeleBot(config.TOKEN)
+    outbound = OutboundDispatcher(bot)
+    outbound.start()
+    manager = ShardManager().start(notify=outbound.notify_admins)
+    try:
+        if config.WEBHOOK_URL:
+            bot.set_webhook(
+                url=config.WEBHOOK_URL,
+                secret_token=config.WEBHOOK_SECRET,
+                max_connections=config.WEBHOOK_MAX_CONNECTIONS,
+                allowed_updates=util.update_types
+            )
+            WebhookServer(manager).server.serve_forever()
+        else:
+            bot.remove_webhook()
+            poll(manager)
+    finally:
+        manager.stop()
+        outbound.stop()
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,1113 @@
+import bisect
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+from contextlib import contextmanager
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+
+import config
+from group_commit import GroupCommit
+from migrations import migrate
+
+
+def done():
+    future = Future()
+    future.set_result(True)
+    return future
+
+
+class SQLiteStorage:
+    # Возможности хранилища: batching — пачка записей дешевле, чем по одной,
+    # transactions — записи можно копить в одной транзакции (групповой коммит)
+    batching = True
+    transactions = True
+
+    def __init__(self, db_path=None, group_commit=None):
+        self.db_path = db_path or config.DB_PATH
+        self.conn = self.connect()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.lock = threading.RLock()
+        self.local = threading.local()
+        self.readers = []
+        with self.lock:
+            migrate(self.conn)
+        if group_commit is None:
+            group_commit = config.GROUP_COMMIT
+        self.group_commit = None
+        if group_commit:
+            self.group_commit = GroupCommit(
+                self.conn, self.lock,
+                config.GROUP_COMMIT_INTERVAL, config.GROUP_COMMIT_MAX_OPS
+            )
+
+    def connect(self):
+        return sqlite3.connect(self.db_path, timeout=config.DB_BUSY_TIMEOUT, check_same_thread=False)
+
+    @contextmanager
+    def read(self):
+        # Пока в групповом коммите есть незафиксированные записи, их видит только писатель
+        if not config.DB_THREAD_READERS or self.group_commit:
+            with self.lock:
+                yield self.conn.cursor()
+            return
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.connect()
+            conn.execute("PRAGMA query_only = 1")
+            self.local.conn = conn
+            with self.lock:
+                self.readers.append(conn)
+        yield conn.cursor()
+
+    @contextmanager
+    def write(self):
+        with self.lock:
+            cursor = self.conn.cursor()
+            try:
+                yield cursor
+            except BaseException as e:
+                # Откат снимает и записи пачки группового коммита, которые еще не зафиксированы
+                self.conn.rollback()
+                if self.group_commit:
+                    self.group_commit.abort(e)
+                raise
+            if self.group_commit:
+                self.group_commit.submit()
+            else:
+                self.conn.commit()
+
+    def durable(self):
+        if self.group_commit:
+            return self.group_commit.pending()
+        return done()
+
+    def load_muted(self):
+        with self.read() as cursor:
+            cursor.execute("SELECT user_id, chat_id, mute_until FROM users WHERE is_muted = 1")
+            return cursor.fetchall()
+
+    def load_expiries(self):
+        with self.read() as cursor:
+            cursor.execute('''
+                SELECT 'mute', user_id, chat_id, mute_until FROM users
+                WHERE is_muted = 1 AND mute_until IS NOT NULL
+                UNION ALL
+                SELECT 'ban', user_id, chat_id, ban_until FROM users
+                WHERE is_banned = 1 AND ban_until IS NOT NULL
+            ''')
+            return cursor.fetchall()
+
+    def expire(self, mutes, bans):
+        with self.write() as cursor:
+            cursor.executemany(
+                "UPDATE users SET is_muted = 0, mute_until = NULL WHERE user_id = ? AND chat_id = ? AND mute_until <= ?",
+                mutes
+            )
+            cursor.executemany(
+                "UPDATE users SET is_banned = 0, ban_until = NULL WHERE user_id = ? AND chat_id = ? AND ban_until <= ?",
+                bans
+            )
+
+    def add_chat(self, chat_id):
+        with self.write() as cursor:
+            cursor.execute(
+                "INSERT OR IGNORE INTO chats (chat_id) VALUES (?)",
+                (chat_id,)
+            )
+
+    def get_chat(self, chat_id):
+        with self.read() as cursor:
+            cursor.execute("SELECT * FROM chats WHERE chat_id = ?", (chat_id,))
+            return cursor.fetchone()
+
+    def toggle_welcome(self, chat_id):
+        # Возвращает новое значение welcome_enabled или None, если чата нет
+        with self.write() as cursor:
+            cursor.execute(
+                "UPDATE chats SET welcome_enabled = NOT welcome_enabled WHERE chat_id = ?",
+                (chat_id,)
+            )
+            if cursor.rowcount == 0:
+                return None
+            cursor.execute("SELECT welcome_enabled FROM chats WHERE chat_id = ?", (chat_id,))
+            return cursor.fetchone()[0]
+
+    def new_users(self, cursor, rows):
+        # Вызывается внутри write() до вставки: chat_id -> сколько строк (user_id, chat_id, ...) еще нет
+        added = {}
+        for key in {row[:2] for row in rows}:
+            cursor.execute("SELECT 1 FROM users WHERE user_id = ? AND chat_id = ?", key)
+            if cursor.fetchone() is None:
+                added[key[1]] = added.get(key[1], 0) + 1
+        return added
+
+    def add_users(self, users):
+        # Возвращает chat_id -> сколько пользователей добавлено
+        with self.write() as cursor:
+            added = self.new_users(cursor, users)
+            # UPSERT не трогает варны, муты, баны и активность существующей строки
+            cursor.executemany('''
+                INSERT INTO users (user_id, chat_id, username, first_name) VALUES (?, ?, ?, ?)
+                ON CONFLICT (user_id, chat_id) DO UPDATE SET
+                    username = excluded.username,
+                    first_name = excluded.first_name
+            ''', users)
+        return added
+
+    def record_activity(self, rows, names):
+        # rows: (user_id, chat_id, username, first_name, сообщений, последнее сообщение, вход в чат),
+        # names: user_id -> (username, first_name), имя одно на все чаты пользователя.
+        # Возвращает chat_id -> сколько пользователей добавлено
+        with self.write() as cursor:
+            added = self.new_users(cursor, rows)
+            cursor.executemany('''
+                INSERT INTO users (user_id, chat_id, username, first_name, message_count, last_seen, joined_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (user_id, chat_id) DO UPDATE SET
+                    username = excluded.username,
+                    first_name = excluded.first_name,
+                    message_count = COALESCE(users.message_count, 0) + excluded.message_count,
+                    last_seen = COALESCE(excluded.last_seen, users.last_seen),
+                    joined_at = COALESCE(excluded.joined_at, users.joined_at)
+            ''', rows)
+            cursor.executemany(
+                "UPDATE users SET username = NULL WHERE username = ? COLLATE NOCASE AND user_id != ?",
+                [(username, user_id) for user_id, (username, _) in names.items() if username]
+            )
+            cursor.executemany(
+                "UPDATE users SET username = ?, first_name = ? WHERE user_id = ?",
+                [(username, first_name, user_id) for user_id, (username, first_name) in names.items()]
+            )
+        return added
+
+    def find_username(self, username):
+        with self.read() as cursor:
+            cursor.execute(
+                "SELECT user_id, chat_id FROM users WHERE username = ? COLLATE NOCASE",
+                (username,)
+            )
+            return cursor.fetchall()
+
+    def get_inactive_users(self, chat_id, since, limit):
+        # Не писавший ни разу считается молчащим со входа, а без даты входа — молчащим всегда.
+        # Выражение совпадает с idx_users_chat_activity, иначе SQLite не возьмет индекс
+        with self.read() as cursor:
+            cursor.execute('''
+                SELECT user_id, username, first_name, COALESCE(last_seen, joined_at), message_count FROM users
+                WHERE chat_id = ? AND COALESCE(last_seen, joined_at, '') < ?
+                ORDER BY COALESCE(last_seen, joined_at, '') LIMIT ?
+            ''', (chat_id, since, limit))
+            return cursor.fetchall()
+
+    def get_recent_joins(self, chat_id, since, limit):
+        # Вошедшие не раньше since, последние первыми
+        with self.read() as cursor:
+            cursor.execute(
+                "SELECT user_id FROM users WHERE chat_id = ? AND joined_at >= ? ORDER BY joined_at DESC LIMIT ?",
+                (chat_id, since, limit)
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def get_user(self, user_id, chat_id):
+        with self.read() as cursor:
+            cursor.execute(
+                "SELECT * FROM users WHERE user_id = ? AND chat_id = ?",
+                (user_id, chat_id)
+            )
+            return cursor.fetchone()
+
+    def add_warn(self, user_id, chat_id):
+        with self.write() as cursor:
+            cursor.execute(
+                "UPDATE users SET warns = warns + 1 WHERE user_id = ? AND chat_id = ?",
+                (user_id, chat_id)
+            )
+            cursor.execute(
+                "SELECT warns FROM users WHERE user_id = ? AND chat_id = ?",
+                (user_id, chat_id)
+            )
+            result = cursor.fetchone()
+        return result[0] if result else 0
+
+    def remove_warn(self, user_id, chat_id):
+        with self.write() as cursor:
+            cursor.execute(
+                "UPDATE users SET warns = MAX(warns - 1, 0) WHERE user_id = ? AND chat_id = ?",
+                (user_id, chat_id)
+            )
+            cursor.execute(
+                "SELECT warns FROM users WHERE user_id = ? AND chat_id = ?",
+                (user_id, chat_id)
+            )
+            result = cursor.fetchone()
+        return result[0] if result else 0
+
+    def reset_warns(self, user_id, chat_id):
+        with self.write() as cursor:
+            cursor.execute(
+                "UPDATE users SET warns = 0 WHERE user_id = ? AND chat_id = ?",
+                (user_id, chat_id)
+            )
+
+    def set_muted(self, user_id, chat_id, mute_until):
+        # Возвращает False, если пользователя нет в чате
+        with self.write() as cursor:
+            cursor.execute(
+                "UPDATE users SET is_muted = 1, mute_until = ? WHERE user_id = ? AND chat_id = ?",
+                (mute_until, user_id, chat_id)
+            )
+        return cursor.rowcount > 0
+
+    def clear_muted(self, user_id, chat_id):
+        with self.write() as cursor:
+            cursor.execute(
+                "UPDATE users SET is_muted = 0, mute_until = NULL WHERE user_id = ? AND chat_id = ?",
+                (user_id, chat_id)
+            )
+
+    def set_banned(self, user_id, chat_id, ban_until):
+        # Возвращает None, если пользователя нет в чате, иначе прежнее is_banned
+        with self.write() as cursor:
+            cursor.execute(
+                "SELECT is_banned FROM users WHERE user_id = ? AND chat_id = ?",
+                (user_id, chat_id)
+            )
+            row = cursor.fetchone()
+            cursor.execute(
+                "UPDATE users SET is_banned = 1, ban_until = ? WHERE user_id = ? AND chat_id = ?",
+                (ban_until, user_id, chat_id)
+            )
+        return row[0] if row else None
+
+    def clear_banned(self, user_id, chat_id):
+        # Возвращает True, если пользователь был забанен
+        with self.write() as cursor:
+            cursor.execute(
+                "UPDATE users SET is_banned = 0, ban_until = NULL WHERE user_id = ? AND chat_id = ? AND is_banned = 1",
+                (user_id, chat_id)
+            )
+        return cursor.rowcount > 0
+
+    # Массовые операции: весь список одной транзакцией, строки отсутствующих пользователей создаются,
+    # added в результате — chat_id -> сколько создано, как у add_users
+    def mute_many(self, chat_id, user_ids, mute_until):
+        # Возвращает added
+        rows = [(user_id, chat_id, mute_until) for user_id in user_ids]
+        with self.write() as cursor:
+            added = self.new_users(cursor, rows)
+            cursor.executemany('''
+                INSERT INTO users (user_id, chat_id, is_muted, mute_until) VALUES (?, ?, 1, ?)
+                ON CONFLICT (user_id, chat_id) DO UPDATE SET is_muted = 1, mute_until = excluded.mute_until
+            ''', rows)
+        return added
+
+    def unmute_many(self, chat_id, user_ids):
+        with self.write() as cursor:
+            cursor.executemany(
+                "UPDATE users SET is_muted = 0, mute_until = NULL WHERE user_id = ? AND chat_id = ?",
+                [(user_id, chat_id) for user_id in user_ids]
+            )
+
+    def ban_many(self, chat_id, user_ids, ban_until):
+        # Возвращает (сколько пользователей не было забанено до этого, added)
+        rows = [(user_id, chat_id, ban_until) for user_id in user_ids]
+        with self.write() as cursor:
+            added = self.new_users(cursor, rows)
+            cursor.execute(
+                f"SELECT COUNT(*) FROM users WHERE chat_id = ? AND is_banned = 1 AND user_id IN ({', '.join('?' * len(user_ids))})",
+                (chat_id, *user_ids)
+            )
+            banned = cursor.fetchone()[0]
+            cursor.executemany('''
+                INSERT INTO users (user_id, chat_id, is_banned, ban_until) VALUES (?, ?, 1, ?)
+                ON CONFLICT (user_id, chat_id) DO UPDATE SET is_banned = 1, ban_until = excluded.ban_until
+            ''', rows)
+        return len(user_ids) - banned, added
+
+    def unban_many(self, chat_id, user_ids):
+        # Возвращает, сколько пользователей было забанено
+        with self.write() as cursor:
+            cursor.executemany(
+                "UPDATE users SET is_banned = 0, ban_until = NULL WHERE user_id = ? AND chat_id = ? AND is_banned = 1",
+                [(user_id, chat_id) for user_id in user_ids]
+            )
+        return cursor.rowcount
+
+    def warn_many(self, chat_id, user_ids):
+        # Возвращает (user_id -> варнов после выдачи, added)
+        rows = [(user_id, chat_id) for user_id in user_ids]
+        with self.write() as cursor:
+            added = self.new_users(cursor, rows)
+            cursor.executemany('''
+                INSERT INTO users (user_id, chat_id, warns) VALUES (?, ?, 1)
+                ON CONFLICT (user_id, chat_id) DO UPDATE SET warns = warns + 1
+            ''', rows)
+            cursor.execute(
+                f"SELECT user_id, warns FROM users WHERE chat_id = ? AND user_id IN ({', '.join('?' * len(user_ids))})",
+                (chat_id, *user_ids)
+            )
+            return dict(cursor.fetchall()), added
+
+    def get_filters(self, chat_id):
+        with self.read() as cursor:
+            cursor.execute("SELECT kind, pattern, action FROM filters WHERE chat_id = ?", (chat_id,))
+            return cursor.fetchall()
+
+    def add_filter(self, chat_id, kind, pattern, action):
+        with self.write() as cursor:
+            cursor.execute('''
+                INSERT INTO filters (chat_id, kind, pattern, action) VALUES (?, ?, ?, ?)
+                ON CONFLICT (chat_id, kind, pattern) DO UPDATE SET action = excluded.action
+            ''', (chat_id, kind, pattern, action))
+
+    def remove_filter(self, chat_id, pattern):
+        with self.write() as cursor:
+            cursor.execute("DELETE FROM filters WHERE chat_id = ? AND pattern = ?", (chat_id, pattern))
+        return cursor.rowcount
+
+    def add_report(self, chat_id, reporter_id, reported_id, reason, message_id=None):
+        with self.write() as cursor:
+            cursor.execute('''
+                INSERT INTO reports (chat_id, reporter_id, reported_id, reason, message_id)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (chat_id, reporter_id, reported_id, reason, message_id))
+        return cursor.lastrowid
+
+    def file_report(self, chat_id, reporter_id, reported_id, reason, message_id, window):
+        # Жалоба на то же сообщение в пределах окна увеличивает счетчик открытого репорта.
+        # Возвращает (id репорта, жалоб в нем). Унарный плюс не дает планировщику
+        # уйти на индекс по created_at: нужен idx_reports_pending_reported и порядок по id
+        with self.write() as cursor:
+            cursor.execute('''
+                SELECT id, complaints FROM reports
+                WHERE chat_id = ? AND reported_id = ? AND message_id = ? AND status = 'pending'
+                AND +created_at >= datetime('now', ?)
+                ORDER BY id DESC LIMIT 1
+            ''', (chat_id, reported_id, message_id, f"-{window} seconds"))
+            row = cursor.fetchone()
+            if row:
+                cursor.execute("UPDATE reports SET complaints = complaints + 1 WHERE id = ?", (row[0],))
+                return row[0], row[1] + 1
+            cursor.execute('''
+                INSERT INTO reports (chat_id, reporter_id, reported_id, reason, message_id)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (chat_id, reporter_id, reported_id, reason, message_id))
+            return cursor.lastrowid, 1
+
+    def get_pending_reports(self, chat_id=None):
+        with self.read() as cursor:
+            if chat_id:
+                cursor.execute(
+                    "SELECT * FROM reports WHERE status = 'pending' AND chat_id = ? ORDER BY created_at",
+                    (chat_id,)
+                )
+            else:
+                cursor.execute("SELECT * FROM reports WHERE status = 'pending' ORDER BY created_at")
+            return cursor.fetchall()
+
+    def get_report_groups(self, chat_id, after=None, before=None, limit=5):
+        # Keyset-пагинация по reported_id: страница читается по индексу, без OFFSET.
+        # Возвращает (группы, есть ли группы раньше, есть ли дальше)
+        with self.read() as cursor:
+            if before is not None:
+                cursor.execute('''
+                    SELECT reported_id, SUM(complaints), MAX(id), reason FROM reports
+                    WHERE chat_id = ? AND status = 'pending' AND reported_id < ?
+                    GROUP BY reported_id ORDER BY reported_id DESC LIMIT ?
+                ''', (chat_id, before, limit + 1))
+                groups = cursor.fetchall()
+                page = list(reversed(groups[:limit]))
+                if not page:
+                    return page, False, False
+                # Раньше курсора что-то могли решить, поэтому соседняя сторона проверяется запросом
+                return page, len(groups) > limit, self.pending_group_exists(cursor, chat_id, '>', page[-1][0])
+            cursor.execute('''
+                SELECT reported_id, SUM(complaints), MAX(id), reason FROM reports
+                WHERE chat_id = ? AND status = 'pending' AND reported_id > ?
+                GROUP BY reported_id ORDER BY reported_id LIMIT ?
+            ''', (chat_id, after if after is not None else -2 ** 63, limit + 1))
+            groups = cursor.fetchall()
+            page = groups[:limit]
+            if not page:
+                return page, False, False
+            return page, self.pending_group_exists(cursor, chat_id, '<', page[0][0]), len(groups) > limit
+
+    def pending_group_exists(self, cursor, chat_id, op, reported_id):
+        cursor.execute(
+            f"SELECT 1 FROM reports WHERE chat_id = ? AND status = 'pending' AND reported_id {op} ? LIMIT 1",
+            (chat_id, reported_id)
+        )
+        return cursor.fetchone() is not None
+
+    def mark_report_resolved(self, report_id, chat_id=None):
+        # Возвращает чат решенного репорта или None. С chat_id решается только репорт этого чата
+        with self.write() as cursor:
+            cursor.execute(
+                "SELECT chat_id FROM reports WHERE id = ? AND status = 'pending' AND (? IS NULL OR chat_id = ?)",
+                (report_id, chat_id, chat_id)
+            )
+            row = cursor.fetchone()
+            if row:
+                cursor.execute("UPDATE reports SET status = 'resolved' WHERE id = ?", (report_id,))
+        return row[0] if row else None
+
+    def resolve_reports_against(self, chat_id, reported_id):
+        with self.write() as cursor:
+            cursor.execute(
+                "UPDATE reports SET status = 'resolved' WHERE chat_id = ? AND status = 'pending' AND reported_id = ?",
+                (chat_id, reported_id)
+            )
+        return cursor.rowcount
+
+    def resolve_reports_older(self, chat_id, seconds=None):
+        with self.write() as cursor:
+            if seconds is None:
+                cursor.execute(
+                    "UPDATE reports SET status = 'resolved' WHERE chat_id = ? AND status = 'pending'",
+                    (chat_id,)
+                )
+            else:
+                cursor.execute(
+                    "UPDATE reports SET status = 'resolved' WHERE chat_id = ? AND status = 'pending' AND created_at < datetime('now', ?)",
+                    (chat_id, f"-{seconds} seconds")
+                )
+        return cursor.rowcount
+
+    def load_chat_counters(self):
+        with self.read() as cursor:
+            cursor.execute("SELECT chat_id, members, muted, banned, reports, warns_today, day FROM chat_counters")
+            return cursor.fetchall()
+
+    def save_chat_counters(self, rows):
+        with self.write() as cursor:
+            cursor.executemany('''
+                INSERT OR REPLACE INTO chat_counters (chat_id, members, muted, banned, reports, warns_today, day)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+
+    def count_chat(self, chat_id, day):
+        # Счетчики /chatstats по таблицам, для сверки: (участники, в муте, забанены, репорты, варны с day)
+        with self.read() as cursor:
+            return tuple(cursor.execute(sql, params).fetchone()[0] for sql, params in [
+                ("SELECT COUNT(*) FROM users WHERE chat_id = ?", (chat_id,)),
+                ("SELECT COUNT(*) FROM users WHERE chat_id = ? AND is_muted = 1", (chat_id,)),
+                ("SELECT COUNT(*) FROM users WHERE chat_id = ? AND is_banned = 1", (chat_id,)),
+                ("SELECT COUNT(*) FROM reports WHERE chat_id = ? AND status = 'pending'", (chat_id,)),
+                ("SELECT COUNT(*) FROM audit WHERE chat_id = ? AND at >= ? AND action = 'warn'", (chat_id, day)),
+            ])
+
+    def append_audit(self, rows):
+        # rows: (время, chat_id, кто, кого, действие, срок, подробности), одна вставка на пачку
+        with self.write() as cursor:
+            cursor.executemany('''
+                INSERT INTO audit (at, chat_id, actor_id, target_id, action, duration, details)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+
+    def get_audit(self, chat_id, since=None, until=None, target_id=None, limit=20):
+        # Новые записи первыми; границы — ISO-время, since включительно, until нет
+        since = since or ''
+        until = until or '9999'
+        with self.read() as cursor:
+            if target_id is None:
+                cursor.execute('''
+                    SELECT * FROM audit WHERE chat_id = ? AND at >= ? AND at < ?
+                    ORDER BY at DESC, id DESC LIMIT ?
+                ''', (chat_id, since, until, limit))
+            else:
+                cursor.execute('''
+                    SELECT * FROM audit WHERE chat_id = ? AND target_id = ? AND at >= ? AND at < ?
+                    ORDER BY at DESC, id DESC LIMIT ?
+                ''', (chat_id, target_id, since, until, limit))
+            return cursor.fetchall()
+
+    def compact_audit(self, before, limit):
+        # Удаляет не больше limit записей старше before, возвращает сколько удалено
+        with self.write() as cursor:
+            cursor.execute(
+                "DELETE FROM audit WHERE id IN (SELECT id FROM audit WHERE at < ? LIMIT ?)",
+                (before, limit)
+            )
+        return cursor.rowcount
+
+    def close(self):
+        if self.group_commit:
+            self.group_commit.stop()
+        with self.lock:
+            for conn in self.readers:
+                conn.close()
+            self.readers = []
+            self.conn.close()
+
+
+# Порядок полей как у SELECT * в SQLite, обработчики читают строки по индексам
+USER_FIELDS = ('user_id', 'chat_id', 'username', 'first_name', 'warns', 'is_muted', 'mute_until',
+               'is_banned', 'ban_until', 'last_seen', 'message_count', 'joined_at')
+REPORT_FIELDS = ('id', 'chat_id', 'reporter_id', 'reported_id', 'reason', 'status', 'created_at',
+                 'message_id', 'complaints')
+
+
+class MemoryStorage:
+    # Каждая операция — пара обращений к dict, копить их незачем; отката нет
+    batching = False
+    transactions = False
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.chats = {}
+        # (user_id, chat_id) -> dict полей USER_FIELDS
+        self.users = {}
+        self.chat_users = {}
+        self.user_chats = {}
+        # username в нижнем регистре -> множество (user_id, chat_id)
+        self.usernames = {}
+        self.reports = {}
+        self.report_id = 0
+        # chat_id -> {(kind, pattern): action}
+        self.filters = {}
+        # (chat_id, reported_id, message_id) -> последний репорт на это сообщение
+        self.report_keys = {}
+        # Строки журнала в порядке записи, поля как у SELECT * FROM audit
+        self.audit = []
+        self.audit_id = 0
+        # chat_id -> (участники, в муте, забанены, репорты, варны за день, день)
+        self.chat_counters = {}
+
+    def durable(self):
+        return done()
+
+    def load_muted(self):
+        with self.lock:
+            return [(u['user_id'], u['chat_id'], u['mute_until']) for u in self.users.values() if u['is_muted']]
+
+    def load_expiries(self):
+        with self.lock:
+            mutes = [('mute', u['user_id'], u['chat_id'], u['mute_until'])
+                     for u in self.users.values() if u['is_muted'] and u['mute_until']]
+            bans = [('ban', u['user_id'], u['chat_id'], u['ban_until'])
+                    for u in self.users.values() if u['is_banned'] and u['ban_until']]
+            return mutes + bans
+
+    def expire(self, mutes, bans):
+        with self.lock:
+            for user_id, chat_id, now in mutes:
+                user = self.users.get((user_id, chat_id))
+                if user and user['mute_until'] and user['mute_until'] <= now:
+                    user['is_muted'], user['mute_until'] = 0, None
+            for user_id, chat_id, now in bans:
+                user = self.users.get((user_id, chat_id))
+                if user and user['ban_until'] and user['ban_until'] <= now:
+                    user['is_banned'], user['ban_until'] = 0, None
+
+    def add_chat(self, chat_id):
+        with self.lock:
+            self.chats.setdefault(chat_id, 1)
+
+    def get_chat(self, chat_id):
+        welcome_enabled = self.chats.get(chat_id)
+        return None if welcome_enabled is None else (chat_id, welcome_enabled)
+
+    def toggle_welcome(self, chat_id):
+        with self.lock:
+            if chat_id not in self.chats:
+                return None
+            self.chats[chat_id] = 0 if self.chats[chat_id] else 1
+            return self.chats[chat_id]
+
+    def user(self, user_id, chat_id):
+        # Вызывается под self.lock; создает строку, как INSERT с DEFAULT
+        key = (user_id, chat_id)
+        user = self.users.get(key)
+        if user is None:
+            user = dict.fromkeys(USER_FIELDS)
+            user.update(user_id=user_id, chat_id=chat_id, warns=0, is_muted=0, is_banned=0, message_count=0)
+            self.users[key] = user
+            self.chat_users.setdefault(chat_id, set()).add(user_id)
+            self.user_chats.setdefault(user_id, set()).add(chat_id)
+        return user
+
+    def rename(self, user, username, first_name):
+        # Вызывается под self.lock
+        key = (user['user_id'], user['chat_id'])
+        if user['username']:
+            self.usernames.get(user['username'].lower(), set()).discard(key)
+        user['username'], user['first_name'] = username, first_name
+        if username:
+            self.usernames.setdefault(username.lower(), set()).add(key)
+
+    def add_users(self, users):
+        with self.lock:
+            added = self.new_users(users)
+            for user_id, chat_id, username, first_name in users:
+                self.rename(self.user(user_id, chat_id), username, first_name)
+        return added
+
+    def new_users(self, rows):
+        # Вызывается под self.lock
+        added = {}
+        for key in {row[:2] for row in rows}:
+            if key not in self.users:
+                added[key[1]] = added.get(key[1], 0) + 1
+        return added
+
+    def record_activity(self, rows, names):
+        with self.lock:
+            added = self.new_users(rows)
+            for user_id, chat_id, username, first_name, count, last_seen, joined_at in rows:
+                user = self.user(user_id, chat_id)
+                user['message_count'] = (user['message_count'] or 0) + count
+                if last_seen:
+                    user['last_seen'] = last_seen
+                if joined_at:
+                    user['joined_at'] = joined_at
+            for user_id, (username, first_name) in names.items():
+                if username:
+                    for key in list(self.usernames.get(username.lower(), ())):
+                        if key[0] != user_id:
+                            self.rename(self.users[key], None, self.users[key]['first_name'])
+                for chat_id in self.user_chats.get(user_id, ()):
+                    self.rename(self.users[(user_id, chat_id)], username, first_name)
+        return added
+
+    def find_username(self, username):
+        with self.lock:
+            return list(self.usernames.get(username.lower(), ()))
+
+    def get_inactive_users(self, chat_id, since, limit):
+        with self.lock:
+            users = [self.users[(user_id, chat_id)] for user_id in self.chat_users.get(chat_id, ())]
+            users = sorted(
+                (u for u in users if (u['last_seen'] or u['joined_at'] or '') < since),
+                key=lambda u: u['last_seen'] or u['joined_at'] or ''
+            )
+            return [(u['user_id'], u['username'], u['first_name'], u['last_seen'] or u['joined_at'], u['message_count'])
+                    for u in users[:limit]]
+
+    def get_recent_joins(self, chat_id, since, limit):
+        with self.lock:
+            users = [self.users[(user_id, chat_id)] for user_id in self.chat_users.get(chat_id, ())]
+            users = sorted((u for u in users if u['joined_at'] and u['joined_at'] >= since), key=lambda u: u['joined_at'], reverse=True)
+            return [u['user_id'] for u in users[:limit]]
+
+    def get_user(self, user_id, chat_id):
+        with self.lock:
+            user = self.users.get((user_id, chat_id))
+            return tuple(user[field] for field in USER_FIELDS) if user else None
+
+    def change_warns(self, user_id, chat_id, change):
+        with self.lock:
+            user = self.users.get((user_id, chat_id))
+            if user is None:
+                return 0
+            user['warns'] = change(user['warns'])
+            return user['warns']
+
+    def add_warn(self, user_id, chat_id):
+        return self.change_warns(user_id, chat_id, lambda warns: warns + 1)
+
+    def remove_warn(self, user_id, chat_id):
+        return self.change_warns(user_id, chat_id, lambda warns: max(warns - 1, 0))
+
+    def reset_warns(self, user_id, chat_id):
+        self.change_warns(user_id, chat_id, lambda warns: 0)
+
+    def set_flag(self, user_id, chat_id, flag, until_field, until):
+        # None, если пользователя нет, иначе прежнее значение флага
+        with self.lock:
+            user = self.users.get((user_id, chat_id))
+            if user is None:
+                return None
+            previous = user[flag]
+            user[flag], user[until_field] = (1 if until is not False else 0), (until or None)
+            return previous
+
+    def set_muted(self, user_id, chat_id, mute_until):
+        return self.set_flag(user_id, chat_id, 'is_muted', 'mute_until', mute_until) is not None
+
+    def clear_muted(self, user_id, chat_id):
+        self.set_flag(user_id, chat_id, 'is_muted', 'mute_until', False)
+
+    def set_banned(self, user_id, chat_id, ban_until):
+        return self.set_flag(user_id, chat_id, 'is_banned', 'ban_until', ban_until)
+
+    def clear_banned(self, user_id, chat_id):
+        return bool(self.set_flag(user_id, chat_id, 'is_banned', 'ban_until', False))
+
+    def mute_many(self, chat_id, user_ids, mute_until):
+        with self.lock:
+            added = self.new_users([(user_id, chat_id) for user_id in user_ids])
+            for user_id in user_ids:
+                self.user(user_id, chat_id)
+                self.set_muted(user_id, chat_id, mute_until)
+            return added
+
+    def unmute_many(self, chat_id, user_ids):
+        with self.lock:
+            for user_id in user_ids:
+                self.clear_muted(user_id, chat_id)
+
+    def ban_many(self, chat_id, user_ids, ban_until):
+        with self.lock:
+            added = self.new_users([(user_id, chat_id) for user_id in user_ids])
+            for user_id in user_ids:
+                self.user(user_id, chat_id)
+            return sum(1 for user_id in user_ids if not self.set_banned(user_id, chat_id, ban_until)), added
+
+    def unban_many(self, chat_id, user_ids):
+        with self.lock:
+            return sum(1 for user_id in user_ids if self.clear_banned(user_id, chat_id))
+
+    def warn_many(self, chat_id, user_ids):
+        with self.lock:
+            added = self.new_users([(user_id, chat_id) for user_id in user_ids])
+            for user_id in user_ids:
+                self.user(user_id, chat_id)
+            return {user_id: self.add_warn(user_id, chat_id) for user_id in user_ids}, added
+
+    def get_filters(self, chat_id):
+        with self.lock:
+            return [(kind, pattern, action) for (kind, pattern), action in self.filters.get(chat_id, {}).items()]
+
+    def add_filter(self, chat_id, kind, pattern, action):
+        with self.lock:
+            self.filters.setdefault(chat_id, {})[(kind, pattern)] = action
+
+    def remove_filter(self, chat_id, pattern):
+        with self.lock:
+            rules = self.filters.get(chat_id, {})
+            keys = [key for key in rules if key[1] == pattern]
+            for key in keys:
+                del rules[key]
+            return len(keys)
+
+    def add_report(self, chat_id, reporter_id, reported_id, reason, message_id=None):
+        with self.lock:
+            self.report_id += 1
+            # Формат и часовой пояс как у CURRENT_TIMESTAMP в SQLite
+            created_at = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+            self.reports[self.report_id] = [
+                self.report_id, chat_id, reporter_id, reported_id, reason, 'pending', created_at, message_id, 1
+            ]
+            if message_id is not None:
+                self.report_keys[(chat_id, reported_id, message_id)] = self.report_id
+            return self.report_id
+
+    def file_report(self, chat_id, reporter_id, reported_id, reason, message_id, window):
+        with self.lock:
+            report = self.reports.get(self.report_keys.get((chat_id, reported_id, message_id)))
+            since = (datetime.utcnow() - timedelta(seconds=window)).strftime('%Y-%m-%d %H:%M:%S')
+            if report and report[5] == 'pending' and report[6] >= since:
+                report[8] += 1
+                return report[0], report[8]
+            return self.add_report(chat_id, reporter_id, reported_id, reason, message_id), 1
+
+    def pending(self, chat_id=None):
+        # Вызывается под self.lock
+        return [
+            report for report in self.reports.values()
+            if report[5] == 'pending' and (not chat_id or report[1] == chat_id)
+        ]
+
+    def get_pending_reports(self, chat_id=None):
+        with self.lock:
+            return [tuple(report) for report in sorted(self.pending(chat_id), key=lambda report: report[6])]
+
+    def get_report_groups(self, chat_id, after=None, before=None, limit=5):
+        with self.lock:
+            groups = {}
+            for report in self.pending(chat_id):
+                group = groups.setdefault(report[3], [report[3], 0, 0, None])
+                group[1] += report[8]
+                if report[0] > group[2]:
+                    group[2], group[3] = report[0], report[4]
+        ordered = sorted(groups.values())
+        keys = [group[0] for group in ordered]
+        if before is not None:
+            end = bisect.bisect_left(keys, before)
+            start = max(end - limit, 0)
+        else:
+            start = bisect.bisect_right(keys, after) if after is not None else 0
+            end = min(start + limit, len(ordered))
+        page = [tuple(group) for group in ordered[start:end]]
+        if not page:
+            return page, False, False
+        return page, start > 0, end < len(ordered)
+
+    def resolve(self, reports):
+        # Вызывается под self.lock
+        for report in reports:
+            report[5] = 'resolved'
+        return len(reports)
+
+    def mark_report_resolved(self, report_id, chat_id=None):
+        with self.lock:
+            report = self.reports.get(report_id)
+            if not report or report[5] != 'pending' or (chat_id is not None and report[1] != chat_id):
+                return None
+            self.resolve([report])
+            return report[1]
+
+    def resolve_reports_against(self, chat_id, reported_id):
+        with self.lock:
+            return self.resolve([report for report in self.pending(chat_id) if report[3] == reported_id])
+
+    def resolve_reports_older(self, chat_id, seconds=None):
+        with self.lock:
+            reports = self.pending(chat_id)
+            if seconds is not None:
+                before = (datetime.utcnow() - timedelta(seconds=seconds)).strftime('%Y-%m-%d %H:%M:%S')
+                reports = [report for report in reports if report[6] < before]
+            return self.resolve(reports)
+
+    def load_chat_counters(self):
+        with self.lock:
+            return [(chat_id, *counters) for chat_id, counters in self.chat_counters.items()]
+
+    def save_chat_counters(self, rows):
+        with self.lock:
+            for row in rows:
+                self.chat_counters[row[0]] = tuple(row[1:])
+
+    def count_chat(self, chat_id, day):
+        with self.lock:
+            users = [self.users[(user_id, chat_id)] for user_id in self.chat_users.get(chat_id, ())]
+            return (
+                len(users),
+                sum(1 for user in users if user['is_muted']),
+                sum(1 for user in users if user['is_banned']),
+                len(self.pending(chat_id)),
+                sum(1 for row in self.audit if row[2] == chat_id and row[1] >= day and row[5] == 'warn'),
+            )
+
+    def append_audit(self, rows):
+        with self.lock:
+            for row in rows:
+                self.audit_id += 1
+                self.audit.append((self.audit_id,) + tuple(row))
+
+    def get_audit(self, chat_id, since=None, until=None, target_id=None, limit=20):
+        since = since or ''
+        until = until or '9999'
+        with self.lock:
+            rows = [
+                row for row in self.audit
+                if row[2] == chat_id and since <= row[1] < until and (target_id is None or row[4] == target_id)
+            ]
+        rows.sort(key=lambda row: (row[1], row[0]), reverse=True)
+        return rows[:limit]
+
+    def compact_audit(self, before, limit):
+        with self.lock:
+            old = [row for row in self.audit if row[1] < before][:limit]
+            if old:
+                removed = {row[0] for row in old}
+                self.audit = [row for row in self.audit if row[0] not in removed]
+            return len(old)
+
+    def close(self):
+        pass
+
+
+BACKENDS = {
+    'sqlite': SQLiteStorage,
+    'memory': MemoryStorage,
+}
+
+
+def open_storage(backend=None, db_path=None, group_commit=None):
+    backend = backend or config.STORAGE_BACKEND
+    if backend == 'sqlite':
+        return SQLiteStorage(db_path, group_commit)
+    if backend == 'memory':
+        return MemoryStorage()
+    raise ValueError(f"unknown storage backend: {backend}")
+
+
+def check(storage):
+    # Общий набор проверок: каждый бэкенд должен вести себя как SQLite
+    problems = []
+
+    def expect(name, got, want):
+        if got != want:
+            problems.append(f"{name}: {got!r} != {want!r}")
+
+    expect("get_chat без чата", storage.get_chat(-1), None)
+    storage.add_chat(-1)
+    storage.add_chat(-1)
+    expect("get_chat", storage.get_chat(-1), (-1, 1))
+    expect("toggle_welcome", storage.toggle_welcome(-1), 0)
+    expect("toggle_welcome без чата", storage.toggle_welcome(-2), None)
+
+    expect("add_users", storage.add_users([(1, -1, 'Alice', 'A'), (2, -1, 'bob', 'B'), (1, -2, 'Alice', 'A')]), {-1: 2, -2: 1})
+    expect("add_warn", [storage.add_warn(1, -1), storage.add_warn(1, -1)], [1, 2])
+    expect("add_users повтор", storage.add_users([(1, -1, 'alice2', 'A2')]), {})
+    user = storage.get_user(1, -1)
+    expect("upsert сохраняет варны", (user[2], user[3], user[4]), ('alice2', 'A2', 2))
+    expect("remove_warn", [storage.remove_warn(1, -1), storage.remove_warn(1, -1), storage.remove_warn(1, -1)], [1, 0, 0])
+    storage.add_warn(2, -1)
+    storage.reset_warns(2, -1)
+    expect("reset_warns", storage.get_user(2, -1)[4], 0)
+    expect("add_warn без пользователя", storage.add_warn(9, -1), 0)
+    expect("get_user без пользователя", storage.get_user(9, -1), None)
+
+    expect("set_muted без пользователя", storage.set_muted(9, -1, '2000-01-01T00:00:00'), False)
+    expect("set_muted", storage.set_muted(1, -1, '2000-01-01T00:00:00'), True)
+    expect("set_banned", storage.set_banned(2, -1, '2000-01-01T00:00:00'), 0)
+    expect("set_banned навсегда", [storage.set_banned(1, -2, None), storage.set_banned(1, -2, None)], [0, 1])
+    expect("set_banned без пользователя", storage.set_banned(9, -1, None), None)
+    expect("load_muted", sorted(storage.load_muted()), [(1, -1, '2000-01-01T00:00:00')])
+    expect("load_expiries", sorted(storage.load_expiries()),
+           [('ban', 2, -1, '2000-01-01T00:00:00'), ('mute', 1, -1, '2000-01-01T00:00:00')])
+    storage.expire([(1, -1, '1999-01-01T00:00:00')], [(2, -1, '2001-01-01T00:00:00')])
+    expect("expire до срока", storage.get_user(1, -1)[5:7], (1, '2000-01-01T00:00:00'))
+    expect("expire", storage.get_user(2, -1)[7:9], (0, None))
+    storage.clear_muted(1, -1)
+    expect("clear_banned", [storage.clear_banned(1, -2), storage.clear_banned(1, -2)], [True, False])
+    expect("clear_muted", storage.get_user(1, -1)[5:7], (0, None))
+    expect("clear_banned", storage.get_user(1, -2)[7:9], (0, None))
+
+    expect("record_activity новые", storage.record_activity(
+        [(3, -1, 'Alice2', 'C', 2, '2000-01-02T00:00:00', '2000-01-02T00:00:00'),
+         (2, -1, 'bob', 'B', 1, '2000-01-01T00:00:00', None)],
+        {3: ('Alice2', 'C'), 2: ('bob', 'B')}
+    ), {-1: 1})
+    storage.record_activity([(2, -1, 'bob', 'B', 3, None, '2000-01-01T00:00:00')], {2: ('bob', 'B')})
+    storage.record_activity([(3, -1, 'Alice2', 'C', 0, None, None)], {3: ('Alice2', 'C')})
+    expect("find_username", sorted(storage.find_username('ALICE2')), [(3, -1)])
+    expect("имя переходит к новому владельцу", storage.get_user(1, -1)[2], None)
+    storage.record_activity([(4, -1, 'dan', 'D', 0, None, '1999-12-31T00:00:00')], {4: ('dan', 'D')})
+    # 1 не писал и не входил при боте, 4 вошел и молчит
+    expect("get_inactive_users", storage.get_inactive_users(-1, '2000-01-03', 10), [
+        (1, None, 'A2', None, 0),
+        (4, 'dan', 'D', '1999-12-31T00:00:00', 0),
+        (2, 'bob', 'B', '2000-01-01T00:00:00', 4),
+        (3, 'Alice2', 'C', '2000-01-02T00:00:00', 2),
+    ])
+    expect("get_inactive_users since", [row[0] for row in storage.get_inactive_users(-1, '2000-01-01', 10)], [1, 4])
+    expect("get_inactive_users limit", len(storage.get_inactive_users(-1, '2000-01-03', 1)), 1)
+    expect("get_recent_joins", storage.get_recent_joins(-1, '2000-01-01', 10), [3, 2])
+    expect("get_recent_joins since", storage.get_recent_joins(-1, '2000-01-01T12:00:00', 10), [3])
+    expect("get_recent_joins limit", storage.get_recent_joins(-1, '2000-01-01', 1), [3])
+
+    expect("mute_many создал", storage.mute_many(-4, [1, 2], '2000-01-01T00:00:00'), {-4: 2})
+    expect("ban_many новых", [storage.ban_many(-4, [2], None), storage.ban_many(-4, [2, 3], None)], [(1, {}), (1, {-4: 1})])
+    expect("mute_many", [storage.get_user(user_id, -4)[5:7] for user_id in (1, 2)], [(1, '2000-01-01T00:00:00')] * 2)
+    expect("ban_many", [storage.get_user(user_id, -4)[7:9] for user_id in (2, 3)], [(1, None)] * 2)
+    storage.unmute_many(-4, [1, 2, 9])
+    expect("unban_many забаненных", storage.unban_many(-4, [2, 9]), 1)
+    expect("unmute_many", [storage.get_user(user_id, -4)[5] for user_id in (1, 2)], [0, 0])
+    expect("unban_many", [storage.get_user(user_id, -4)[7] for user_id in (2, 3)], [0, 1])
+    expect("warn_many", [storage.warn_many(-4, [1, 4]), storage.warn_many(-4, [1])], [({1: 1, 4: 1}, {-4: 1}), ({1: 2}, {})])
+    expect("unmute_many без пользователя", storage.get_user(9, -4), None)
+    expect("load_muted после массовых", [row for row in storage.load_muted() if row[1] == -4], [])
+
+    ids = [storage.add_report(-1, 1, reported_id, f"r{reported_id}") for reported_id in (5, 6, 5, 7)]
+    storage.add_report(-2, 1, 5, 'other')
+    expect("add_report", len(set(ids)), 4)
+    expect("get_pending_reports", len(storage.get_pending_reports(-1)), 4)
+    expect("get_pending_reports все", len(storage.get_pending_reports()), 5)
+    expect("get_report_groups", storage.get_report_groups(-1, limit=2), ([(5, 2, ids[2], 'r5'), (6, 1, ids[1], 'r6')], False, True))
+    expect("get_report_groups after", storage.get_report_groups(-1, after=6, limit=2), ([(7, 1, ids[3], 'r7')], True, False))
+    expect("get_report_groups before", storage.get_report_groups(-1, before=7, limit=1), ([(6, 1, ids[1], 'r6')], True, True))
+    expect("get_report_groups пусто", storage.get_report_groups(-1, after=7), ([], False, False))
+    expect("mark_report_resolved чужого чата", storage.mark_report_resolved(ids[1], -2), None)
+    expect("mark_report_resolved", [storage.mark_report_resolved(ids[1], -1), storage.mark_report_resolved(ids[1])], [-1, None])
+    expect("mark_report_resolved без чата", storage.mark_report_resolved(storage.add_report(-2, 1, 8, 'r')), -2)
+    expect("resolve_reports_against", storage.resolve_reports_against(-1, 5), 2)
+    expect("resolve_reports_older", storage.resolve_reports_older(-1, 3600), 0)
+    expect("resolve_reports_older все", storage.resolve_reports_older(-1), 1)
+    expect("get_pending_reports после", [report[1] for report in storage.get_pending_reports()], [-2])
+    for reported_id in (5, 6, 7):
+        storage.add_report(-5, 1, reported_id, 'r')
+    storage.resolve_reports_against(-5, 5)
+    # После решения /reports перерисовывает страницу от ключа перед первой группой
+    expect("get_report_groups после решения", [storage.get_report_groups(-5, after=4, limit=2)[1:],
+           storage.get_report_groups(-5, after=6, limit=2)[1:], storage.get_report_groups(-5, before=7, limit=2)[1:]],
+           [(False, False), (True, False), (False, True)])
+    storage.resolve_reports_older(-5)
+    first = storage.file_report(-3, 1, 5, 'spam', 100, 3600)
+    expect("file_report повтор", storage.file_report(-3, 2, 5, 'other', 100, 3600), (first[0], 2))
+    expect("file_report другое сообщение", storage.file_report(-3, 2, 5, 'spam', 101, 3600)[1], 1)
+    expect("get_report_groups с повторами", storage.get_report_groups(-3)[0][0][:2], (5, 3))
+    storage.mark_report_resolved(first[0])
+    expect("file_report после решения", storage.file_report(-3, 3, 5, 'spam', 100, 3600)[1], 1)
+    expect("get_pending_reports поля", sorted(report[7:] for report in storage.get_pending_reports(-3)), [(100, 1), (101, 1)])
+    storage.add_filter(-1, 'word', 'spam', 'delete')
+    storage.add_filter(-1, 'link', 'spam', 'warn')
+    storage.add_filter(-1, 'word', 'spam', 'mute')
+    storage.add_filter(-2, 'invite', 't.me/+', 'delete')
+    expect("get_filters", sorted(storage.get_filters(-1)), [('link', 'spam', 'warn'), ('word', 'spam', 'mute')])
+    expect("remove_filter", [storage.remove_filter(-1, 'spam'), storage.remove_filter(-1, 'spam')], [2, 0])
+    expect("get_filters после", (storage.get_filters(-1), len(storage.get_filters(-2))), ([], 1))
+    storage.append_audit([
+        ('2000-01-01T10:00:00', -1, 10, 1, 'warn', None, None),
+        ('2000-01-01T11:00:00', -1, 10, 2, 'mute', 3600, None),
+        ('2000-01-02T10:00:00', -1, None, 1, 'mute', 600, 'флуд'),
+        ('2000-01-02T10:00:00', -2, 10, 1, 'ban', None, None),
+    ])
+    storage.append_audit([('2000-01-03T10:00:00', -1, 10, 1, 'unmute', None, None)])
+    expect("get_audit", [row[5] for row in storage.get_audit(-1)], ['unmute', 'mute', 'mute', 'warn'])
+    expect("get_audit поля", storage.get_audit(-1, limit=3)[1][1:], ('2000-01-02T10:00:00', -1, None, 1, 'mute', 600, 'флуд'))
+    expect("get_audit период", [row[5] for row in storage.get_audit(-1, '2000-01-01T10:30:00', '2000-01-03')], ['mute', 'mute'])
+    expect("get_audit по пользователю", [row[5] for row in storage.get_audit(-1, target_id=1, limit=2)], ['unmute', 'mute'])
+    expect("compact_audit", [storage.compact_audit('2000-01-02', 1), storage.compact_audit('2000-01-02', 5)], [1, 1])
+    expect("get_audit после очистки", [row[5] for row in storage.get_audit(-1)], ['unmute', 'mute'])
+    expect("compact_audit другой чат", len(storage.get_audit(-2)), 1)
+
+    storage.append_audit([
+        ('2000-01-04T23:00:00', -4, 10, 4, 'warn', None, None),
+        ('2000-01-05T10:00:00', -4, 10, 4, 'warn', None, None),
+        ('2000-01-05T11:00:00', -4, 10, 4, 'unwarn', None, None),
+    ])
+    expect("count_chat", storage.count_chat(-4, '2000-01-05'), (4, 0, 1, 0, 1))
+    expect("count_chat репорты", storage.count_chat(-3, '2000-01-05'), (0, 0, 0, 2, 0))
+    expect("count_chat без чата", storage.count_chat(-9, '2000-01-05'), (0, 0, 0, 0, 0))
+    storage.save_chat_counters([(-4, 4, 0, 1, 0, 1, '2000-01-05'), (-3, 0, 0, 0, 2, 0, '2000-01-05')])
+    storage.save_chat_counters([(-4, 5, 0, 1, 0, 2, '2000-01-05')])
+    expect("load_chat_counters", sorted(storage.load_chat_counters()),
+           [(-4, 5, 0, 1, 0, 2, '2000-01-05'), (-3, 0, 0, 0, 2, 0, '2000-01-05')])
+    storage.durable().result()
+
+    if storage.transactions:
+        # Ошибка внутри write() откатывает транзакцию; под lock пачка группового коммита не успеет
+        # зафиксироваться, и откат снимает ее целиком
+        with storage.lock:
+            storage.add_chat(-7)
+            pending = storage.durable()
+            try:
+                with storage.write() as cursor:
+                    cursor.execute("INSERT INTO chats (chat_id) VALUES (?)", (-8,))
+                    raise ValueError('откат')
+            except ValueError:
+                pass
+            expect("откат write", (storage.get_chat(-8), storage.conn.in_transaction), (None, False))
+        expect("откат пачки", (storage.get_chat(-7) is None, type(pending.exception(timeout=5)).__name__),
+               (True, 'ValueError') if storage.group_commit else (False, 'NoneType'))
+        storage.add_chat(-8)
+        storage.durable().result()
+        expect("запись после отката", storage.get_chat(-8), (-8, 1))
+    return problems
+
+
+if __name__ == '__main__':
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        backends = [
+            ('sqlite', lambda: SQLiteStorage(os.path.join(tmp, 'plain.db'), group_commit=False)),
+            ('sqlite+group_commit', lambda: SQLiteStorage(os.path.join(tmp, 'group.db'), group_commit=True)),
+            ('memory', MemoryStorage),
+        ]
+        for name, factory in backends:
+            storage = factory()
+            try:
+                problems = check(storage)
+            finally:
+                storage.close()
+            print(f"{name}: batching={storage.batching} transactions={storage.transactions} {'ok' if not problems else 'FAIL'}")
+            for problem in problems:
+                print(f"  FAIL {problem}")
+            failed = failed or bool(problems)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,229 @@
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import sys
+import time
+from urllib.request import pathname2url
+
+import config
+from migrations import migrate
+
+# Таблица -> (ключ для UPSERT, колонка времени для --since/--until или None)
+TABLES = {
+    'chats': (('chat_id',), None),
+    'users': (('user_id', 'chat_id'), 'last_seen'),
+    'reports': (('id',), 'created_at'),
+    'filters': (('chat_id', 'kind', 'pattern'), None),
+    'audit': (('id',), 'at'),
+}
+FORMATS = ('jsonl', 'csv')
+CHUNK = 5000
+
+
+def table_columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def time_bound(table, value):
+    # reports.created_at пишется как CURRENT_TIMESTAMP (пробел вместо T), остальные — isoformat
+    return value.replace('T', ' ') if table == 'reports' else value
+
+
+def select_rows(conn, table, chat_id=None, since=None, until=None):
+    # Курсор отдает строки по мере чтения, в памяти держится только текущая пачка
+    columns = table_columns(conn, table)
+    time_column = TABLES[table][1]
+    if (since or until) and not time_column:
+        raise ValueError(f"в таблице {table} нет времени, --since и --until к ней не применяются")
+    where, params = [], []
+    if chat_id is not None:
+        where.append("chat_id = ?")
+        params.append(chat_id)
+    if since:
+        where.append(f"{time_column} >= ?")
+        params.append(time_bound(table, since))
+    if until:
+        where.append(f"{time_column} < ?")
+        params.append(time_bound(table, until))
+    sql = f"SELECT {', '.join(columns)} FROM {table}"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    return columns, conn.execute(sql, params)
+
+
+def fetch(cursor, chunk=CHUNK):
+    while True:
+        rows = cursor.fetchmany(chunk)
+        if not rows:
+            return
+        yield from rows
+
+
+def write_rows(out, fmt, columns, rows):
+    count = 0
+    if fmt == 'csv':
+        writer = csv.writer(out)
+        writer.writerow(columns)
+        for row in rows:
+            # NULL пишется пустой ячейкой и при импорте читается обратно как NULL
+            writer.writerow(['' if value is None else value for value in row])
+            count += 1
+        return count
+    for row in rows:
+        out.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n')
+        count += 1
+    return count
+
+
+def read_rows(source, fmt):
+    # Первая строка задает колонки: заголовок CSV или ключи первого объекта JSONL
+    if fmt == 'csv':
+        reader = csv.reader(source)
+        columns = next(reader, None)
+        if columns is None:
+            return None, iter(())
+        return columns, ([value if value != '' else None for value in row] for row in reader)
+    lines = (line for line in source if line.strip())
+    first = next(lines, None)
+    if first is None:
+        return None, iter(())
+    first = json.loads(first)
+    columns = list(first)
+
+    def records():
+        yield [first.get(column) for column in columns]
+        for line in lines:
+            record = json.loads(line)
+            yield [record.get(column) for column in columns]
+
+    return columns, records()
+
+
+def upsert_sql(table, columns):
+    key = TABLES[table][0]
+    updates = [column for column in columns if column not in key]
+    sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    if updates:
+        sql += f" ON CONFLICT ({', '.join(key)}) DO UPDATE SET " + ", ".join(f"{column} = excluded.{column}" for column in updates)
+    else:
+        sql += " ON CONFLICT DO NOTHING"
+    return sql
+
+
+def import_rows(conn, table, columns, rows, chunk=CHUNK):
+    unknown = set(columns) - set(table_columns(conn, table))
+    if unknown:
+        raise ValueError(f"в таблице {table} нет колонок: {', '.join(sorted(unknown))}")
+    missing = set(TABLES[table][0]) - set(columns)
+    if missing:
+        raise ValueError(f"без ключа {', '.join(sorted(missing))} строки {table} не сопоставить")
+    sql = upsert_sql(table, columns)
+    count = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= chunk:
+            count += write_chunk(conn, sql, batch)
+            batch = []
+    if batch:
+        count += write_chunk(conn, sql, batch)
+    return count
+
+
+def write_chunk(conn, sql, batch):
+    # Каждая пачка — своя короткая транзакция: работающий бот успевает писать между ними
+    with conn:
+        conn.executemany(sql, batch)
+    return len(batch)
+
+
+def open_source(path):
+    # Только чтение: экспорт не создает и не мигрирует базу, работающему боту не мешает (WAL)
+    uri = f"file:{pathname2url(os.path.abspath(path))}?mode=ro"
+    return sqlite3.connect(uri, uri=True, timeout=config.DB_BUSY_TIMEOUT)
+
+
+def open_target(path):
+    conn = sqlite3.connect(path, timeout=config.DB_BUSY_TIMEOUT)
+    conn.execute("PRAGMA journal_mode=WAL")
+    migrate(conn)
+    return conn
+
+
+def guess_format(path, fmt):
+    if fmt:
+        return fmt
+    return 'csv' if path and path.endswith('.csv') else 'jsonl'
+
+
+def open_stream(path, mode):
+    if path and path != '-':
+        return open(path, mode, encoding='utf-8', newline='')
+    stream = sys.stdout if mode == 'w' else sys.stdin
+    return open(stream.fileno(), mode, encoding='utf-8', newline='', closefd=False)
+
+
+def cmd_export(args):
+    conn = open_source(args.db)
+    fmt = guess_format(args.output, args.format)
+    start = time.perf_counter()
+    try:
+        columns, cursor = select_rows(conn, args.table, args.chat, args.since, args.until)
+        with open_stream(args.output, 'w') as out:
+            count = write_rows(out, fmt, columns, fetch(cursor))
+    finally:
+        conn.close()
+    summary(args.table, 'exported', count, time.perf_counter() - start)
+
+
+def cmd_import(args):
+    conn = open_target(args.db)
+    fmt = guess_format(args.input, args.format)
+    start = time.perf_counter()
+    try:
+        with open_stream(args.input, 'r') as source:
+            columns, rows = read_rows(source, fmt)
+            count = import_rows(conn, args.table, columns, rows, args.chunk) if columns else 0
+    finally:
+        conn.close()
+    summary(args.table, 'imported', count, time.perf_counter() - start)
+
+
+def summary(table, action, count, elapsed):
+    print(f"{table}: {action} {count} rows in {elapsed:.2f} s ({count / elapsed if elapsed else 0:.0f} rows/s)", file=sys.stderr)
+
+
+def main():
+    default_db = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bot.db')
+    parser = argparse.ArgumentParser(description="Потоковый экспорт и импорт данных бота в JSON Lines или CSV")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = commands.add_parser('export', help="таблица из базы в файл или stdout")
+    export_parser.add_argument('table', choices=list(TABLES))
+    export_parser.add_argument('-o', '--output', help="файл, по умолчанию stdout")
+    export_parser.add_argument('--format', choices=FORMATS, help="по умолчанию по расширению файла, иначе jsonl")
+    export_parser.add_argument('--chat', type=int, help="только этот chat_id")
+    export_parser.add_argument('--since', help="не раньше этого времени, ISO: 2024-01-31 или 2024-01-31T12:00")
+    export_parser.add_argument('--until', help="раньше этого времени, ISO")
+    export_parser.add_argument('--db', default=default_db)
+    export_parser.set_defaults(func=cmd_export)
+
+    import_parser = commands.add_parser('import', help="строки из файла или stdin в базу, UPSERT по ключу")
+    import_parser.add_argument('table', choices=list(TABLES))
+    import_parser.add_argument('-i', '--input', help="файл, по умолчанию stdin")
+    import_parser.add_argument('--format', choices=FORMATS, help="по умолчанию по расширению файла, иначе jsonl")
+    import_parser.add_argument('--chunk', type=int, default=CHUNK, help="строк в одной транзакции")
+    import_parser.add_argument('--db', default=default_db)
+    import_parser.set_defaults(func=cmd_import)
+
+    args = parser.parse_args()
+    try:
+        args.func(args)
+    except (ValueError, sqlite3.Error) as error:
+        sys.exit(f"{args.command}: {error}")
+
+
+if __name__ == '__main__':
+    main()
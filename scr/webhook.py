@@ -0,0 +1,170 @@
+import json
+import logging
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from telebot import types, util
+
+import config
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+CHAT_KEYS = ('message', 'edited_message', 'channel_post', 'edited_channel_post',
+             'my_chat_member', 'chat_member', 'chat_join_request')
+
+
+def update_chat_id(update):
+    for key in CHAT_KEYS:
+        if key in update:
+            return update[key]['chat']['id']
+    callback = update.get('callback_query')
+    if callback:
+        if callback.get('message'):
+            return callback['message']['chat']['id']
+        return callback['from']['id']
+    for value in update.values():
+        if isinstance(value, dict) and 'from' in value:
+            return value['from']['id']
+    return 0
+
+
+class UpdatePipeline:
+    def __init__(self, bot, workers=None, queue_size=None):
+        self.bot = bot
+        self.workers = workers or config.WEBHOOK_WORKERS
+        size = max(1, (queue_size or config.WEBHOOK_QUEUE_SIZE) // self.workers)
+        # Апдейты одного чата всегда попадают в одну очередь, поэтому идут по порядку,
+        # разные чаты обрабатываются параллельно
+        self.queues = [queue.Queue(size) for _ in range(self.workers)]
+        self.threads = []
+        self.lock = threading.Lock()
+        self.processed = 0
+
+    def put(self, update, timeout=None):
+        # Очередь полна — ждем освобождения места, по таймауту queue.Full уходит наверх
+        chat_id = update_chat_id(update)
+        self.queues[hash(chat_id) % self.workers].put(update, timeout=timeout)
+
+    def depth(self):
+        return sum(q.qsize() for q in self.queues)
+
+    def start(self):
+        # Порядок внутри чата держат наши воркеры, собственный пул TeleBot не нужен
+        self.bot.threaded = False
+        for n, q in enumerate(self.queues):
+            thread = threading.Thread(target=self.run, args=(q,), name=f'webhook-{n}', daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def run(self, q):
+        while True:
+            update = q.get()
+            try:
+                if update is None:
+                    return
+                self.bot.process_new_updates([types.Update.de_json(update)])
+            except Exception:
+                logger.exception("update %s failed", update.get('update_id'))
+            finally:
+                with self.lock:
+                    self.processed += 1
+                q.task_done()
+
+    def join(self):
+        for q in self.queues:
+            q.join()
+
+    def stop(self):
+        for q in self.queues:
+            q.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+
+class HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Telegram держит до WEBHOOK_MAX_CONNECTIONS соединений, очередь accept должна их вмещать
+    request_queue_size = 128
+
+
+class WebhookServer:
+    def __init__(self, pipeline, host=None, port=None, path=None, secret=None, put_timeout=None):
+        self.pipeline = pipeline
+        self.path = path or urlparse(config.WEBHOOK_URL or '').path or '/'
+        self.secret = secret if secret is not None else config.WEBHOOK_SECRET
+        self.put_timeout = put_timeout if put_timeout is not None else config.WEBHOOK_PUT_TIMEOUT
+        port = port if port is not None else config.WEBHOOK_PORT
+        self.server = HTTPServer((host or config.WEBHOOK_HOST, port), self.handler_class())
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}{self.path}"
+
+    def handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive: Telegram переиспользует соединения
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                if self.path != server.path:
+                    self.send_error(404)
+                    return
+                if server.secret and self.headers.get('X-Telegram-Bot-Api-Secret-Token') != server.secret:
+                    self.send_error(403)
+                    return
+                length = int(self.headers.get('Content-Length') or 0)
+                try:
+                    update = json.loads(self.rfile.read(length))
+                except ValueError:
+                    self.send_error(400)
+                    return
+                try:
+                    server.pipeline.put(update, timeout=server.put_timeout)
+                except queue.Full:
+                    # Не 200 — Telegram повторит доставку позже, апдейт не теряется
+                    metrics.inc('webhook_rejected_total')
+                    self.send_error(503)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name='webhook', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def run(bot):
+    pipeline = UpdatePipeline(bot).start()
+    server = WebhookServer(pipeline)
+    metrics.gauge('webhook_queue_depth', pipeline.depth)
+    bot.set_webhook(
+        url=config.WEBHOOK_URL,
+        secret_token=config.WEBHOOK_SECRET,
+        max_connections=config.WEBHOOK_MAX_CONNECTIONS,
+        allowed_updates=util.update_types
+    )
+    try:
+        server.server.serve_forever()
+    finally:
+        server.server.server_close()
+        pipeline.stop()